@@ -17,21 +17,28 @@
 #    See http://abs.gov.au for correct attribution
 
 # Process:
-#   1. loads census metadata Excel files using Pandas dataframes
+#   0. optionally imports the boundary GeoPackages for both datums
+#   1. loads census metadata Excel files (or their cached, parsed copies)
 #   2. loads all census data CSV files
+#   3. adds primary keys, clusters & analyzes the data tables
+#   4. optionally builds analysis ready materialised views of selected stats with their boundary geometries
 #   6. party on!
 #
 # *********************************************************************************************************************
 
+import hashlib
 import io
 import logging.config
 import os
-import pandas  # module needs to be installed, along with openpyxl (for Excel file load)
 import psycopg  # module needs to be installed
+import queue
 import settings
+import threading
 import utils
 
-from datetime import datetime
+from datetime import datetime, timedelta
+
+logger = logging.getLogger()
 
 
 def main():
@@ -69,17 +76,143 @@ def main():
             else:
                 logger.info(f"\t- {arg} : ************")
 
+    # log the limits on the number of processes when they're set automatically
+    if settings.auto_tune_processes:
+        capacity = settings.process_capacity
+        logger.info(f"\t- auto max processes : {capacity['max_processes']} : server CPUs {capacity['server_cpus']} "
+                    f"(from {capacity['server_cpus_source']}) : free connections {capacity['free_connections']} "
+                    f": local CPUs {capacity['local_cpus']} : local memory for {capacity['memory_processes']} "
+                    f"processes")
+
+    # create the schemas and stop - loads run at the same time after this don't race to create them
+    if settings.setup_only:
+        setup_database(pg_cur)
+        return True
+
+    # rollback to the previous data schema and stop
+    if settings.rollback:
+        if not rollback_data_schema(pg_cur):
+            return False
+
+        # the analysis views still read the rolled back tables - rebuild them from the restored ones
+        if settings.analysis_view_list:
+            return build_analysis_views(pg_cur, False)
+
+        return True
+
+    # refresh the analysis views from the current data and stop
+    if settings.refresh_analysis_views:
+        return build_analysis_views(pg_cur, True)
+
+    if settings.staging and settings.resume:
+        logger.fatal("--resume can't be used with --staging, a staging load always starts from scratch")
+        return False
+
+    if settings.datapack_source and settings.resume:
+        logger.fatal("--resume can't be used with --datapack-source, the downloaded DataPacks are always loaded")
+        return False
+
+    if settings.infer_types != "off" and settings.table_layout == "partitioned":
+        logger.warning("--infer-types is ignored for the partitioned table layout - partitions use their parent's")
+
+    # PART 0 - import the boundaries
+    if settings.boundary_directory:
+        logger.info(f"")
+        start_time = datetime.now()
+        logger.info(f"Start boundary import : {start_time}")
+
+        if not load_boundaries(pg_cur):
+            return False
+
+        logger.info(f"Boundaries imported! : {datetime.now() - start_time}")
+
+    if settings.boundaries_only:
+        pg_cur.close()
+        pg_conn.close()
+
+        logger.info("")
+        logger.info(f"Total time : : {datetime.now() - full_start_time}")
+
+        return True
+
     # START LOADING DATA
 
+    # load into a clean staging schema - the live schema isn't touched until the staging schema is swapped in
+    if settings.staging:
+        logger.info(f"")
+        logger.info(f"Loading into staging schema : {settings.load_schema}")
+        pg_cur.execute(f"DROP SCHEMA IF EXISTS {settings.load_schema} CASCADE")
+
     # PART 1 - load census data from CSV files
     logger.info(f"")
     start_time = datetime.now()
     logger.info(f"Start census data load : {start_time}")
-    create_metadata_tables(pg_cur, settings.metadata_file_prefix, settings.metadata_file_type)
-    populate_data_tables(settings.data_file_prefix, settings.data_file_type,
-                         settings.table_name_part, settings.bdy_name_part)
+
+    if settings.datapack_source:
+        # load each DataPack as soon as it's downloaded
+        record_list = stream_data_tables(pg_cur)
+    else:
+        metadata_reloaded = create_metadata_tables(pg_cur, settings.metadata_file_prefix,
+                                                   settings.metadata_file_type)
+
+        # a metadata change could change any table's fields, so everything is reloaded
+        if settings.resume and metadata_reloaded:
+            logger.info("\t- metadata has changed - reloading all data tables")
+
+        record_list = populate_data_tables(pg_cur, settings.data_file_prefix, settings.data_file_type,
+                                           settings.table_name_part, settings.bdy_name_part,
+                                           settings.resume and not metadata_reloaded)
+    load_seconds = (datetime.now() - start_time).total_seconds()
     logger.info(f"Census data loaded! : {datetime.now() - start_time}")
 
+    table_list = [record["table"] for record in record_list if record["result"] == "SUCCESS"]
+    partitions = dict([(record["table"], (record["parent_table"], record["boundary"])) for record in record_list
+                       if record["result"] == "SUCCESS" and record.get("parent_table") is not None])
+
+    # PART 2 - index, cluster & analyze the data tables once all COPYs have finished
+    logger.info(f"")
+    start_time = datetime.now()
+    logger.info(f"Start post load processing : {start_time}")
+    post_load_list = post_load_data_tables(table_list, partitions)
+    logger.info(f"Post load processing done! : {datetime.now() - start_time}")
+
+    # add the post load timings to each file's load record & save them for analysis
+    post_load_dict = dict([(result["table"], result) for result in post_load_list])
+
+    for record in record_list:
+        post_load = post_load_dict.get(record["table"], dict())
+
+        for step in ["index", "cluster", "logged", "attach", "analyze"]:
+            record[f"{step}_seconds"] = post_load.get(step, 0.0)
+
+    if len(record_list) > 0:
+        logger.info(f"")
+        logger.info(f"Load telemetry")
+        utils.write_load_telemetry(record_list, settings.telemetry_file, load_seconds, logger)
+
+    # PART 3 - validate the staging schema & swap it with the live one
+    if settings.staging:
+        logger.info(f"")
+        start_time = datetime.now()
+        logger.info(f"Start staging schema publish : {start_time}")
+
+        if not validate_staging_schema(pg_cur):
+            logger.fatal(f"\t- {settings.load_schema} failed validation - {settings.data_schema} hasn't changed")
+            return False
+
+        if not publish_staging_schema(pg_cur):
+            return False
+
+        logger.info(f"Staging schema published! : {datetime.now() - start_time}")
+
+    # PART 4 - build the analysis ready views from the published data
+    if settings.analysis_view_list:
+        logger.info(f"")
+        start_time = datetime.now()
+        logger.info(f"Start analysis view build : {start_time}")
+        build_analysis_views(pg_cur, False)
+        logger.info(f"Analysis views built! : {datetime.now() - start_time}")
+
     # close Postgres connection
     pg_cur.close()
     pg_conn.close()
@@ -90,193 +223,789 @@ def main():
     return True
 
 
+# creates the data schema & the boundary schemas for both datums (PostGIS is added by main)
+def setup_database(pg_cur):
+    schema_list = list(settings.bdy_schemas.values())
+
+    if settings.load_schema != "public":
+        schema_list.append(settings.load_schema)
+
+    for schema in schema_list:
+        pg_cur.execute(f"CREATE SCHEMA IF NOT EXISTS {schema} AUTHORIZATION {settings.pg_user}")
+
+    logger.info(f"\t- database set up : PostGIS added & schemas created : {', '.join(schema_list)}")
+
+
+# imports every layer of the boundary GeoPackages into the boundary schema for its datum. Each layer is imported by its
+#   own ogr2ogr process, with the layers of both datums in the same pool (biggest first), then the spatial indexes are
+#   built in parallel once all the data's in
+def load_boundaries(pg_cur):
+    start_time = datetime.now()
+
+    layer_list = list()
+
+    for root, dirs, files in os.walk(settings.boundary_directory):
+        for file_name in sorted(files):
+            if not file_name.lower().endswith(".gpkg"):
+                continue
+
+            datum = next((datum for datum in settings.bdy_datums if datum.lower() in file_name.lower()), None)
+
+            if datum is None:
+                logger.warning(f"\t- {file_name} : no datum in the file name - skipped")
+                continue
+
+            for layer_dict in utils.get_geopackage_layers(os.path.join(root, file_name)):
+                layer_dict["path"] = os.path.join(root, file_name)
+                layer_dict["schema"] = settings.bdy_schemas[datum]
+                layer_list.append(layer_dict)
+
+    if len(layer_list) == 0:
+        logger.fatal("No boundary GeoPackages found\nACTION: Check your '--boundary-path' value")
+        return False
+
+    for bdy_schema in sorted(set([layer_dict["schema"] for layer_dict in layer_list])):
+        pg_cur.execute(f"CREATE SCHEMA IF NOT EXISTS {bdy_schema} AUTHORIZATION {settings.pg_user}")
+
+    # import the biggest layers first, so a big layer doesn't start last & run on its own at the end
+    layer_list.sort(key=lambda layer_dict: layer_dict["features"], reverse=True)
+
+    cmd_list = [utils.get_ogr2ogr_command(settings.pg_connect_string, layer_dict["path"], layer_dict["layer"],
+                                          layer_dict["schema"], layer_dict["table"]) for layer_dict in layer_list]
+    name_list = [f"{layer_dict['schema']}.{layer_dict['table']}" for layer_dict in layer_list]
+
+    result_list = utils.multiprocess_list("cmd", cmd_list, settings.max_concurrent_processes,
+                                          settings.pg_connect_string, logger, names=name_list,
+                                          timeout=settings.work_timeout)
+
+    # log each layer's import time, slowest first
+    result_dict = dict([(result["command"], result) for result in result_list if isinstance(result, dict)])
+    loaded_list = list()
+
+    for cmd, name, layer_dict in sorted(zip(cmd_list, name_list, layer_list),
+                                        key=lambda item: result_dict.get(item[0], dict()).get("seconds", 0.0),
+                                        reverse=True):
+        result = result_dict.get(cmd)
+
+        if result is not None and result["result"] == "SUCCESS":
+            logger.info(f"\t\t- {name} : {layer_dict['features']} features : "
+                        f"{timedelta(seconds=result['seconds'])}")
+            loaded_list.append(layer_dict)
+
+    logger.info(f"\t- {len(loaded_list)} of {len(layer_list)} boundary layers imported : "
+                f"{datetime.now() - start_time}")
+
+    # add the spatial indexes now the data's in (faster than updating them row by row) & update stats
+    index_start_time = datetime.now()
+    sql_list = list()
+
+    for layer_dict in loaded_list:
+        table = f"{layer_dict['schema']}.{layer_dict['table']}"
+
+        if layer_dict["spatial"]:
+            sql_list.append(f"CREATE INDEX {layer_dict['table']}_geom_idx ON {table} USING gist (geom); "
+                            f"ALTER TABLE {table} CLUSTER ON {layer_dict['table']}_geom_idx; ANALYZE {table}")
+        else:
+            sql_list.append(f"ANALYZE {table}")
+
+    if len(sql_list) > 0:
+        utils.multiprocess_list("sql", sql_list, settings.max_concurrent_processes, settings.pg_connect_string,
+                                logger, timeout=settings.work_timeout)
+
+    logger.info(f"\t- boundary spatial indexes created & tables analyzed : {datetime.now() - index_start_time}")
+
+    return len(loaded_list) == len(layer_list)
+
+
 def create_metadata_tables(pg_cur, prefix, suffix):
     # Step 1 of 2 : create metadata tables from Census Excel spreadsheets
     start_time = datetime.now()
 
     # create schema
-    if settings.data_schema != "public":
-        pg_cur.execute(f"CREATE SCHEMA IF NOT EXISTS {settings.data_schema} AUTHORIZATION {settings.pg_user}")
+    if settings.load_schema != "public":
+        pg_cur.execute(f"CREATE SCHEMA IF NOT EXISTS {settings.load_schema} AUTHORIZATION {settings.pg_user}")
 
-    # create metadata tables
-    sql = f"""DROP TABLE IF EXISTS {settings.data_schema}.metadata_tables CASCADE;
-              CREATE TABLE {settings.data_schema}.metadata_tables (
-                  table_number text,
-                  table_name text,
-                  table_description text
-              ) WITH (OIDS=FALSE);
-              ALTER TABLE {settings.data_schema}.metadata_tables OWNER TO {settings.pg_user}"""
-    pg_cur.execute(sql)
+    # get a list of all files matching the metadata filename prefix (including files in zipped DataPacks)
+    file_list = get_metadata_files(utils.get_source_files(settings.data_directory), prefix, suffix)
 
-    sql = f"""DROP TABLE IF EXISTS {settings.data_schema}.metadata_stats CASCADE;
-              CREATE TABLE {settings.data_schema}.metadata_stats (
-                  sequential_id text,
-                  short_id text,
-                  long_id text,
-                  table_number text,
-                  profile_table text,
-                  column_heading_description text
-              )
-              WITH (OIDS=FALSE);
-              ALTER TABLE {settings.data_schema}.metadata_stats OWNER TO {settings.pg_user}"""
-    pg_cur.execute(sql)
+    # create the manifest of loaded files & the inferred column types (if they don't exist) - a resumed load can add to
+    #   a schema created before they were
+    utils.create_manifest_table(pg_cur, settings.load_schema, settings.pg_user)
+    utils.create_column_types_table(pg_cur, settings.load_schema, settings.pg_user)
 
-    # get a list of all files matching the metadata filename prefix
-    file_list = list()
+    # in resume mode - skip the metadata if the workbooks haven't changed since they were last loaded
+    pg_cur.execute(f"SELECT to_regclass('{settings.load_schema}.metadata_stats') IS NOT NULL")
 
-    for root, dirs, files in os.walk(settings.data_directory):
-        for file_name in files:
-            if file_name.lower().startswith(prefix.lower()):
-                # find all XLS and XLSX files (2016 data has a mix!)
-                if file_name.lower().endswith(suffix.lower()) or file_name.lower().endswith(suffix.lower() + "x"):
-                    file_path = os.path.join(root, file_name)
+    if settings.resume and len(file_list) > 0 and pg_cur.fetchone()[0]:
+        manifest = utils.get_manifest(pg_cur, settings.load_schema)
 
-                    file_dict = dict()
-                    file_dict["name"] = file_name
-                    file_dict["path"] = file_path
+        if all([utils.is_file_unchanged(pg_cur, settings.load_schema, file_dict, manifest.get(file_dict["path"]))
+                for file_dict in file_list]):
+            logger.info(f"\t- Step 1 of 2 : metadata tables unchanged - skipped : {datetime.now() - start_time}")
+            return False
 
-                    file_list.append(file_dict)
+    create_empty_metadata_tables(pg_cur)
 
     # are there any files to load?
     if len(file_list) == 0:
         logger.fatal("No Census metadata XLS files found\nACTION: Check your '--census-data-path' value")
         logger.fatal("\t- Step 1 of 4 : create metadata tables FAILED!")
     else:
-        # read in excel worksheets into pandas dataframes
         for file_dict in file_list:
+            import_metadata_workbook(pg_cur, file_dict)
+
+    index_metadata_tables(pg_cur, file_list)
 
-            xl = pandas.ExcelFile(file_dict["path"])
+    logger.info(f"\t- Step 1 of 2 : metadata tables created : {datetime.now() - start_time}")
+
+    return True
 
-            sheets = xl.sheet_names
-            i = 0
 
-            for table_dict in settings.census_metadata_dicts:
+# returns the metadata workbooks in a list of source files
+def get_metadata_files(source_file_list, prefix, suffix):
+    file_list = list()
 
-                df = xl.parse(sheets[i])
+    for file_dict in source_file_list:
+        file_name = file_dict["name"]
 
-                # drop unwanted rows at the top
-                j = 0
-                first_row = False
+        if file_name.lower().startswith(prefix.lower()):
+            # find all XLS and XLSX files (2016 data has a mix!)
+            if file_name.lower().endswith(suffix.lower()) or file_name.lower().endswith(suffix.lower() + "x"):
+                file_dict["table_name"] = "metadata"
+                file_list.append(file_dict)
 
-                while not first_row:
-                    cell = df.iloc[j, 0]
+    return file_list
+
+
+# creates the empty metadata tables
+def create_empty_metadata_tables(pg_cur):
+    sql = f"""DROP TABLE IF EXISTS {settings.load_schema}.metadata_tables CASCADE;
+              CREATE TABLE {settings.load_schema}.metadata_tables (
+                  table_number text,
+                  table_name text,
+                  table_description text
+              ) WITH (OIDS=FALSE);
+              ALTER TABLE {settings.load_schema}.metadata_tables OWNER TO {settings.pg_user}"""
+    pg_cur.execute(sql)
 
-                    if str(cell).lower() == table_dict["first_row"]:
-                        df_clean = df.drop(df.index[0:j+1])
-                        first_row = True
+    sql = f"""DROP TABLE IF EXISTS {settings.load_schema}.metadata_stats CASCADE;
+              CREATE TABLE {settings.load_schema}.metadata_stats (
+                  sequential_id text,
+                  short_id text,
+                  long_id text,
+                  table_number text,
+                  profile_table text,
+                  column_heading_description text
+              )
+              WITH (OIDS=FALSE);
+              ALTER TABLE {settings.load_schema}.metadata_stats OWNER TO {settings.pg_user}"""
+    pg_cur.execute(sql)
 
-                        # drop excess columns in unclean Excel worksheets
-                        if table_dict["table"] == "metadata_stats":
-                            try:
-                                df_clean.drop(df.columns[[6, 7, 8]], axis=1, inplace=True)
-                            except:
-                                pass
+    pg_cur.execute(f"DROP TABLE IF EXISTS {settings.load_schema}.metadata_column_types CASCADE")
+    utils.create_column_types_table(pg_cur, settings.load_schema, settings.pg_user)
 
-                        # # order what's left by sequential_id field
-                        # df_clean.sort_values(by="Sequential", inplace=True)
 
-                        # export to in-memory tab delimited text file
-                        tsv_file = io.StringIO()
-                        df_clean.to_csv(tsv_file, sep="\t", index=False, header=False)
-                        tsv_file.seek(0)  # move position back to beginning of file before reading
+# imports a metadata workbook into the metadata tables
+def import_metadata_workbook(pg_cur, file_dict):
+    with utils.open_source_file(file_dict) as excel_file:
+        workbook_data = excel_file.read()
 
-                        # # output dataframe to test tsv file
-                        # with open(file_dict["name"] + '.tsv', 'w') as fd:
-                        #     shutil.copyfileobj(tsv_file, fd)
-                        # tsv_file.seek(0)
+    file_dict["hash"] = hashlib.sha256(workbook_data).hexdigest()
 
-                        # import into Postgres
-                        sql = f"""COPY {settings.data_schema}.{table_dict['table']} 
-                                      FROM stdin WITH CSV DELIMITER as '\t' NULL as ''"""
+    # use the parsed metadata from a previous run if the workbook hasn't changed
+    metadata = utils.get_cached_metadata(settings.metadata_cache_dir, file_dict["hash"],
+                                         settings.census_metadata_dicts)
 
-                        with pg_cur.copy(sql) as copy:
-                            while data := tsv_file.read():
-                                copy.write(data)
+    if metadata is None:
+        metadata = utils.read_metadata_workbook(io.BytesIO(workbook_data), settings.census_metadata_dicts)
+        utils.cache_metadata(settings.metadata_cache_dir, file_dict["hash"], metadata, settings.census_metadata_dicts)
+        source = "parsed"
+    else:
+        source = "cached"
 
-                    j += 1
+    # import into Postgres
+    for table_dict in settings.census_metadata_dicts:
+        with pg_cur.copy(f"COPY {settings.load_schema}.{table_dict['table']} FROM STDIN") as copy:
+            for row in metadata[table_dict["table"]]:
+                copy.write_row(row)
 
-                i += 1
+    logger.info(f"\t\t- imported {file_dict['name']} ({source})")
 
-            logger.info(f"\t\t- imported {file_dict['name']}")
 
+# cleans up, indexes & analyzes the metadata tables once all workbooks are imported, and records them as loaded
+def index_metadata_tables(pg_cur, file_list):
     # clean up invalid rows
-    pg_cur.execute(f"DELETE FROM {settings.data_schema}.metadata_tables WHERE table_number IS NULL")
+    pg_cur.execute(f"DELETE FROM {settings.load_schema}.metadata_tables WHERE table_number IS NULL")
 
     # add primary keys
-    pg_cur.execute(f"""ALTER TABLE {settings.data_schema}.metadata_tables
+    pg_cur.execute(f"""ALTER TABLE {settings.load_schema}.metadata_tables
                            ADD CONSTRAINT metadata_tables_pkey PRIMARY KEY (table_number)""")
-    pg_cur.execute(f"""ALTER TABLE {settings.data_schema}.metadata_stats 
+    pg_cur.execute(f"""ALTER TABLE {settings.load_schema}.metadata_stats 
                            ADD CONSTRAINT metadata_stats_pkey PRIMARY KEY (sequential_id)""")
 
     # cluster tables on primary key (for minor performance improvement)
-    pg_cur.execute(f"ALTER TABLE {settings.data_schema}.metadata_tables CLUSTER ON metadata_tables_pkey")
-    pg_cur.execute(f"ALTER TABLE {settings.data_schema}.metadata_stats CLUSTER ON metadata_stats_pkey")
+    pg_cur.execute(f"ALTER TABLE {settings.load_schema}.metadata_tables CLUSTER ON metadata_tables_pkey")
+    pg_cur.execute(f"ALTER TABLE {settings.load_schema}.metadata_stats CLUSTER ON metadata_stats_pkey")
 
     # update stats
-    pg_cur.execute(f"VACUUM ANALYZE {settings.data_schema}.metadata_tables")
-    pg_cur.execute(f"VACUUM ANALYZE {settings.data_schema}.metadata_stats")
+    pg_cur.execute(f"VACUUM ANALYZE {settings.load_schema}.metadata_tables")
+    pg_cur.execute(f"VACUUM ANALYZE {settings.load_schema}.metadata_stats")
 
-    logger.info(f"\t- Step 1 of 2 : metadata tables created : {datetime.now() - start_time}")
+    # record the workbooks as loaded
+    for file_dict in file_list:
+        utils.update_manifest(pg_cur, settings.load_schema, file_dict, "loaded",
+                              file_hash=file_dict["hash"])
 
 
 # create stats tables and import data from CSV files using multiprocessing
-def populate_data_tables(prefix, suffix, table_name_part, bdy_name_part):
+def populate_data_tables(pg_cur, prefix, suffix, table_name_part, bdy_name_part, resume):
     # Step 2 of 2 : create & populate stats tables with CSV files using multiprocessing
     start_time = datetime.now()
 
-    # get the file list and create sql copy statements
-    file_list = []
-    # get a dictionary of all files matching the filename prefix
-    for root, dirs, files in os.walk(settings.data_directory):
-        for file_name in files:
-            if file_name.lower().startswith(prefix.lower()):
-                if file_name.lower().endswith(suffix.lower()):
-
-                    file_path = os.path.join(root, file_name)
-                    file_name_components = file_name.lower().split(".")[0].split("_")
-
-                    table = file_name_components[table_name_part]
-
-                    # manual fix for the Australia wide data - has a different file name structure
-                    if settings.census_year != '2011':
-                        if "_aus." in file_name.lower():
-                            boundary = "aust"
-                        else:
-                            boundary = file_name_components[bdy_name_part]
-                    else:
-                        boundary = file_name_components[bdy_name_part]
+    # get a dictionary of all files matching the filename prefix (including files in zipped DataPacks)
+    file_list = get_data_files(utils.get_source_files(settings.data_directory), prefix, suffix, table_name_part,
+                               bdy_name_part)
+    add_data_file_fields(pg_cur, file_list)
+    create_layout_tables(pg_cur, file_list, resume)
+
+    # in resume mode - only load files that have changed, or failed or didn't finish last time
+    if resume and len(file_list) > 0:
+        manifest = utils.get_manifest(pg_cur, settings.load_schema)
+
+        pg_cur.execute(f"SELECT tablename FROM pg_tables WHERE schemaname = '{settings.load_schema}'")
+        existing_tables = set([row[0] for row in pg_cur.fetchall()])
 
-                        if "." in boundary:
-                            boundary = "aust"
+        num_files = len(file_list)
+        file_list = [file_dict for file_dict in file_list
+                     if file_dict["table_name"] not in existing_tables
+                     or not utils.is_file_unchanged(pg_cur, settings.load_schema, file_dict,
+                                                    manifest.get(file_dict["path"]))]
 
-                    file_dict = {
-                        "path": file_path,
-                        "table": table,
-                        "boundary": boundary,
-                        "name": file_name
-                    }
+        logger.info(f"\t- resuming : {num_files - len(file_list)} of {num_files} files already loaded")
 
-                    # if boundary == "ced":  # for testing
-                    # print(file_dict)
-                    file_list.append(file_dict)
+        if len(file_list) == 0:
+            return list()
 
     # are there any files to load?
     if len(file_list) == 0:
         logger.fatal("No Census data CSV files found\nACTION: Check your '--census-data-path' value")
         logger.fatal("\t- Step 2 of 2 : stats table create & populate FAILED!")
+        return list()
     else:
-        # load all files using multiprocessing
-        utils.multiprocess_csv_import(file_list, settings.max_concurrent_processes, settings.pg_connect_string,
-                                      settings.data_schema, settings.pg_user, settings.region_id_field, logger)
+        # estimate the relative cost of each file & schedule the most expensive first (longest processing time
+        # first) - stops a big file starting last & leaving one process running on its own at the end
+        estimate_cost = utils.cost_estimators[settings.cost_model]
+
+        for file_dict in file_list:
+            file_dict["cost"] = estimate_cost(file_dict)
+
+        unsorted_makespan = utils.get_makespan([file_dict["cost"] for file_dict in file_list],
+                                               settings.max_concurrent_processes)
+        file_list.sort(key=lambda file_dict: file_dict["cost"], reverse=True)
+        sorted_makespan = utils.get_makespan([file_dict["cost"] for file_dict in file_list],
+                                             settings.max_concurrent_processes)
+
+        # load all files using multiprocessing (or asyncio)
+        load_start_time = datetime.now()
+        if settings.engine == "async":
+            if settings.auto_tune_processes:
+                logger.info(f"\t- NOTICE: the async engine doesn't tune the number of COPY streams during the load "
+                            f"- using the maximum of {settings.max_concurrent_processes}")
+
+            result_list = utils.async_csv_import(file_list, settings.max_concurrent_processes,
+                                                 settings.max_copy_buffer_mb, settings.copy_format,
+                                                 settings.server_side_copy, settings.staging,
+                                                 settings.pg_connect_string, settings.load_schema,
+                                                 settings.pg_user, settings.region_id_field,
+                                                 settings.work_timeout, logger)
+        else:
+            result_list = utils.multiprocess_csv_import(file_list, settings.max_concurrent_processes,
+                                                        settings.auto_tune_processes, settings.max_copy_buffer_mb,
+                                                        settings.copy_format, settings.server_side_copy,
+                                                        settings.staging, settings.pg_connect_string,
+                                                        settings.load_schema, settings.pg_user,
+                                                        settings.region_id_field, settings.work_timeout, logger)
+        actual_makespan = datetime.now() - load_start_time
+
+        # convert the cost estimates to time, using the measured time per unit of cost
+        total_cost = sum([file_dict["cost"] for file_dict in file_list])
+        seconds_per_cost = sum([result["seconds"] for result in result_list]) / total_cost if total_cost else 0.0
+
+        logger.info(f"\t- predicted load time : {timedelta(seconds=sorted_makespan * seconds_per_cost)} "
+                    f"(biggest first) vs {timedelta(seconds=unsorted_makespan * seconds_per_cost)} (file system "
+                    f"order) : actual load time : {actual_makespan} : cost model : {settings.cost_model}")
+        if settings.server_side_copy != "off":
+            num_server_files = len([result for result in result_list if result["copy_method"].startswith("server")])
+            logger.info(f"\t- {num_server_files} of {len(result_list)} files read directly by the Postgres server")
+
         logger.info(f"\t- Step 2 of 2 : stats tables created & populated : {datetime.now() - start_time}")
 
+        # return the telemetry records of the loaded files
+        return result_list
+
+
+# downloads the DataPacks and loads them at the same time: each DataPack's metadata is imported as soon as it's
+#   downloaded, then its data files are added to the running load (biggest first) while the next one downloads. The
+#   load takes about as long as the longer of the downloads & the load, instead of both
+def stream_data_tables(pg_cur):
+    start_time = datetime.now()
+
+    if settings.load_schema != "public":
+        pg_cur.execute(f"CREATE SCHEMA IF NOT EXISTS {settings.load_schema} AUTHORIZATION {settings.pg_user}")
+
+    utils.create_manifest_table(pg_cur, settings.load_schema, settings.pg_user)
+    create_empty_metadata_tables(pg_cur)
+    os.makedirs(settings.data_directory, exist_ok=True)
+
+    if settings.engine == "async":
+        logger.info(f"\t- NOTICE: the async engine can't add files during a load - using the process engine")
+
+    feed = queue.Queue()
+    metadata_file_list = list()
+
+    producer = threading.Thread(target=download_datapacks, args=(feed, metadata_file_list))
+    producer.start()
+
+    try:
+        result_list = utils.multiprocess_csv_import(list(), settings.max_concurrent_processes,
+                                                    settings.auto_tune_processes, settings.max_copy_buffer_mb,
+                                                    settings.copy_format, settings.server_side_copy,
+                                                    settings.staging, settings.pg_connect_string,
+                                                    settings.load_schema, settings.pg_user,
+                                                    settings.region_id_field, settings.work_timeout, logger,
+                                                    feed=feed)
+    finally:
+        producer.join()
+
+    index_metadata_tables(pg_cur, metadata_file_list)
+
+    if len(result_list) == 0:
+        logger.fatal("No Census data CSV files downloaded\nACTION: Check your '--datapack-source' value")
+
+    logger.info(f"\t- {len(metadata_file_list)} metadata workbooks & {len(result_list)} data files downloaded & "
+                f"loaded : {datetime.now() - start_time}")
+
+    return result_list
+
+
+# the producer for stream_data_tables - downloads each DataPack in turn, imports its metadata and puts its data files
+#   on the load's feed. The feed is always ended, so the load finishes even if a download fails
+def download_datapacks(feed, metadata_file_list):
+    try:
+        with psycopg.connect(settings.pg_connect_string, autocommit=True) as producer_pg_conn:
+            with producer_pg_conn.cursor() as producer_pg_cur:
+                for datapack in settings.datapack_list:
+                    start_time = datetime.now()
+                    file_name = settings.datapack_file_name.format(datapack=datapack)
+
+                    try:
+                        archive_path = utils.download_file(settings.datapack_source, file_name,
+                                                           settings.data_directory)
+                    except (OSError, ValueError) as ex:
+                        logger.warning(f"\t- {file_name} : download FAILED : {ex}")
+                        continue
+
+                    source_file_list = utils.get_source_files(archive_path)
+
+                    for file_dict in get_metadata_files(source_file_list, settings.metadata_file_prefix,
+                                                        settings.metadata_file_type):
+                        import_metadata_workbook(producer_pg_cur, file_dict)
+                        metadata_file_list.append(file_dict)
+
+                    file_list = get_data_files(source_file_list, settings.data_file_prefix,
+                                               settings.data_file_type, settings.table_name_part,
+                                               settings.bdy_name_part)
+                    add_data_file_fields(producer_pg_cur, file_list)
+                    create_layout_tables(producer_pg_cur, file_list, False)
+
+                    # biggest first, within each DataPack
+                    estimate_cost = utils.cost_estimators[settings.cost_model]
+                    file_list.sort(key=estimate_cost, reverse=True)
+
+                    feed.put(file_list)
+
+                    logger.info(f"\t- {file_name} : downloaded in {datetime.now() - start_time} : "
+                                f"{len(file_list)} data files queued")
+    except Exception as ex:
+        logger.fatal(f"\t- DataPack downloads stopped : {ex}")
+    finally:
+        feed.put(None)
+
+
+# returns the census data files in a list of source files, with the table & boundary each one is loaded into
+def get_data_files(source_file_list, prefix, suffix, table_name_part, bdy_name_part):
+    file_list = list()
+
+    for file_dict in source_file_list:
+        file_name = file_dict["name"]
+
+        if file_name.lower().startswith(prefix.lower()):
+            if file_name.lower().endswith(suffix.lower()):
+
+                file_name_components = file_name.lower().split(".")[0].split("_")
+
+                table = file_name_components[table_name_part]
+
+                # manual fix for the Australia wide data - has a different file name structure
+                if settings.census_year != '2011':
+                    if "_aus." in file_name.lower():
+                        boundary = "aust"
+                    else:
+                        boundary = file_name_components[bdy_name_part]
+                else:
+                    boundary = file_name_components[bdy_name_part]
+
+                    if "." in boundary:
+                        boundary = "aust"
+
+                file_dict["table"] = table
+                file_dict["boundary"] = boundary
+
+                # in the partitioned layout, each file is a partition of its census table
+                if settings.table_layout == "partitioned":
+                    file_dict["parent_table"] = table
+                    file_dict["table_name"] = table + "_" + boundary
+                else:
+                    file_dict["table_name"] = boundary + "_" + table
+
+                # if boundary == "ced":  # for testing
+                # print(file_dict)
+                file_list.append(file_dict)
+
+    return file_list
+
+
+# creates the tables the data files are loaded into that aren't created by the load: the partitioned layout's parent
+#   tables (with their views), or nothing for the table layout. Tables & views in the way from the other layout are
+#   dropped. In resume mode, existing parent tables are kept
+def create_layout_tables(pg_cur, file_list, resume):
+    parent_dict = dict()
+
+    for file_dict in file_list:
+        if file_dict.get("parent_table") is not None:
+            parent_dict.setdefault(file_dict["parent_table"], (file_dict["fields"], list()))[1].append(
+                file_dict["boundary"])
+
+    if len(parent_dict) == 0:
+        utils.drop_relations(pg_cur, settings.load_schema, [file_dict["table_name"] for file_dict in file_list], ["v"])
+        utils.drop_relations(pg_cur, settings.load_schema, [file_dict["table"] for file_dict in file_list], ["p"])
+        return
+
+    for parent_table, (field_list, boundary_list) in parent_dict.items():
+        utils.drop_relations(pg_cur, settings.load_schema, [f"{boundary}_{parent_table}" for boundary in boundary_list],
+                             ["r"])
+        pg_cur.execute(utils.get_create_parent_table_sql(settings.load_schema, parent_table, field_list,
+                                                         sorted(set(boundary_list)), settings.region_id_field,
+                                                         settings.pg_user, resume))
+
+    logger.info(f"\t- {len(parent_dict)} partitioned tables created")
+
+
+# adds the fields of each data file's table, and where the server sees each file for server side COPY
+def add_data_file_fields(pg_cur, file_list):
+    # get each table's fields from the metadata once, instead of querying it for every file
+    table_fields = utils.get_table_fields(pg_cur, settings.load_schema)
+
+    # partitions must have the same column types as their parent table, so they keep the DataPack's types
+    infer_types = settings.infer_types if settings.table_layout == "table" else "off"
+
+    for file_dict in file_list:
+        file_dict["fields"] = utils.get_fields_for_table(table_fields, file_dict["table"])
+        file_dict["infer_types"] = infer_types
+
+    # where the server sees each file, for server side COPY (zipped files can't be read by the server)
+    if settings.server_side_copy != "off":
+        for file_dict in file_list:
+            if file_dict.get("member") is None:
+                file_dict["server_path"] = utils.get_server_path(file_dict["path"], settings.data_directory,
+                                                                 settings.local_server_dir)
+
+
+# add primary keys, physically cluster the tables on them and update stats using multiprocessing
+def post_load_data_tables(table_list, partitions):
+    start_time = datetime.now()
+
+    if len(table_list) == 0:
+        logger.warning("\t- No data tables to index, cluster & analyze")
+        return list()
+
+    result_list = utils.multiprocess_post_load(table_list, settings.max_post_load_processes,
+                                               settings.maintenance_work_mem, settings.staging,
+                                               settings.pg_connect_string, settings.load_schema,
+                                               settings.region_id_field, settings.work_timeout, logger,
+                                               partitions=partitions)
+
+    # report the time spent on each step (summed across all processes)
+    steps = ["index", "cluster", "logged", "analyze"] if settings.staging else ["index", "cluster", "analyze"]
+
+    if len(partitions) > 0:
+        steps.insert(-1, "attach")
+
+        # partitioned tables aren't analyzed automatically - their stats are needed to plan queries across partitions
+        parent_list = sorted(set([parent_table for parent_table, boundary in partitions.values()]))
+        sql_list = [f"ANALYZE {settings.load_schema}.{parent_table}" for parent_table in parent_list]
+        utils.multiprocess_list("sql", sql_list, settings.max_post_load_processes, settings.pg_connect_string, logger,
+                                timeout=settings.work_timeout)
+
+    for step in steps:
+        step_time = timedelta(seconds=sum([result[step] for result in result_list]))
+        logger.info(f"\t- {step} time : {step_time} (total across all processes)")
+
+    logger.info(f"\t- {len(table_list)} tables indexed, clustered & analyzed : {datetime.now() - start_time}")
+
+    return result_list
+
+
+# builds the analysis ready views in the --analysis-views file - a materialised view for each view & boundary, built in
+#   parallel (biggest boundary first). With refresh, views that already exist are refreshed concurrently instead, so
+#   they can be queried throughout
+def build_analysis_views(pg_cur, refresh):
+    start_time = datetime.now()
+
+    view_list = get_analysis_views(pg_cur)
+
+    if len(view_list) == 0:
+        logger.fatal("No analysis views to build\nACTION: Check your '--analysis-views' file & that its data & "
+                     "boundary tables have been loaded")
+        return False
+
+    pg_cur.execute(f"CREATE SCHEMA IF NOT EXISTS {settings.analysis_schema} AUTHORIZATION {settings.pg_user}")
+
+    existing_views = set()
+
+    if refresh:
+        pg_cur.execute("SELECT matviewname FROM pg_matviews WHERE schemaname = %s", (settings.analysis_schema,))
+        existing_views = set([row[0] for row in pg_cur.fetchall()])
+
+    sql_list = list()
+
+    for view_dict in view_list:
+        if view_dict["view_name"] in existing_views:
+            sql_list.append(utils.get_refresh_analysis_view_sql(settings.analysis_schema, view_dict["view_name"]))
+        else:
+            sql_list.append(utils.get_create_analysis_view_sql(settings.analysis_schema, view_dict["view_name"],
+                                                               settings.data_schema, view_dict["tables"],
+                                                               view_dict["bdy_schema"], view_dict["bdy_table"],
+                                                               view_dict["bdy_code_field"], settings.region_id_field,
+                                                               settings.pg_user))
+
+    result_list = utils.multiprocess_list("sql", sql_list, settings.max_concurrent_processes,
+                                          settings.pg_connect_string, logger,
+                                          names=[f"{settings.analysis_schema}.{view_dict['view_name']}"
+                                                 for view_dict in view_list],
+                                          timeout=settings.work_timeout)
+
+    num_built = len([result for result in result_list if utils.get_result_message(result) == "SUCCESS"])
+    num_refreshed = len(existing_views.intersection([view_dict["view_name"] for view_dict in view_list]))
+
+    logger.info(f"\t- {num_built} of {len(sql_list)} analysis views built ({num_refreshed} refreshed) : "
+                f"{datetime.now() - start_time}")
+
+    return num_built == len(sql_list)
+
+
+# returns the analysis views to build from the --analysis-views file, one for each view & boundary: its data tables &
+#   fields, and the boundary table its geometry comes from. Views whose stats or tables don't exist are skipped
+def get_analysis_views(pg_cur):
+    table_fields = utils.get_table_fields(pg_cur, settings.data_schema)
+
+    pg_cur.execute("SELECT relname FROM pg_class WHERE relnamespace = to_regnamespace(%s)", (settings.data_schema,))
+    data_tables = set([row[0] for row in pg_cur.fetchall()])
+
+    # the boundary tables' code fields & row counts (to build the biggest views first)
+    bdy_schema = settings.bdy_schemas[settings.analysis_datum]
+
+    pg_cur.execute("""SELECT table_name, column_name
+                      FROM information_schema.columns
+                      WHERE table_schema = %s""", (bdy_schema,))
+    bdy_columns = set(pg_cur.fetchall())
+
+    pg_cur.execute("SELECT relname, reltuples FROM pg_class WHERE relnamespace = to_regnamespace(%s)", (bdy_schema,))
+    bdy_rows = dict(pg_cur.fetchall())
+
+    view_list = list()
+
+    for view_config in settings.analysis_view_list:
+        for bdy in [bdy.lower() for bdy in view_config["boundaries"]]:
+            view_name = f"{bdy}_{view_config['name'].lower()}"
+
+            bdy_table = settings.analysis_bdy_table_name.format(bdy=bdy, datum=settings.analysis_datum.lower())
+            bdy_code_field = settings.analysis_bdy_code_field_exceptions.get(
+                bdy, settings.analysis_bdy_code_field.format(bdy=bdy))
+
+            if (bdy_table, bdy_code_field) not in bdy_columns:
+                logger.warning(f"\t- {view_name} : boundary table {bdy_schema}.{bdy_table} with a {bdy_code_field} "
+                               f"field doesn't exist - skipped")
+                continue
+
+            # a stat list of "*" gets all of a table's stats
+            table_list = list()
+            missing_list = list()
+
+            for table, fields in view_config["stats"].items():
+                table_name = f"{bdy}_{table.lower()}"
+                all_fields = utils.get_fields_for_table(table_fields, table.lower())
+                field_list = all_fields if fields == "*" else [field.lower() for field in fields]
+
+                if table_name not in data_tables:
+                    missing_list.append(table_name)
+
+                missing_list.extend([field for field in field_list if field not in all_fields])
+                table_list.append((table_name, field_list))
+
+            if len(missing_list) > 0:
+                logger.warning(f"\t- {view_name} : {', '.join(missing_list)} don't exist - skipped")
+                continue
+
+            view_list.append({
+                "view_name": view_name,
+                "tables": table_list,
+                "bdy_schema": bdy_schema,
+                "bdy_table": bdy_table,
+                "bdy_code_field": bdy_code_field,
+                "rows": bdy_rows.get(bdy_table, 0.0)
+            })
+
+    view_list.sort(key=lambda view_dict: view_dict["rows"], reverse=True)
+
+    return view_list
+
+
+# checks the staging schema is complete before it's published: all files loaded & indexed, no empty or unlogged tables
+def validate_staging_schema(pg_cur):
+    is_valid = True
+
+    pg_cur.execute(f"""SELECT file_path, status, row_count
+                       FROM {settings.load_schema}.load_manifest
+                       WHERE table_name <> 'metadata'
+                           AND (status <> 'loaded' OR coalesce(row_count, 0) = 0)""")
+    bad_files = pg_cur.fetchall()
+
+    for file_path, status, row_count in bad_files:
+        logger.warning(f"\t- {file_path} : status {status} : {row_count} rows")
+        is_valid = False
+
+    # data tables are everything but the metadata tables & the load manifest
+    pg_cur.execute(f"""SELECT count(*) FILTER (WHERE relpersistence = 'u'),
+                              count(*) FILTER (WHERE relname NOT LIKE 'metadata\\_%' AND relname <> 'load_manifest')
+                       FROM pg_class
+                       WHERE relnamespace = '{settings.load_schema}'::regnamespace
+                           AND relkind = 'r'""")
+    num_unlogged, num_data_tables = pg_cur.fetchone()
+
+    if num_unlogged > 0:
+        logger.warning(f"\t- {num_unlogged} tables are still unlogged")
+        is_valid = False
+
+    pg_cur.execute(f"SELECT count(*) FROM {settings.load_schema}.metadata_stats")
+
+    if num_data_tables == 0 or pg_cur.fetchone()[0] == 0:
+        logger.warning(f"\t- no metadata or data tables were loaded")
+        is_valid = False
+
+    return is_valid
+
+
+# swaps the staging schema into place in one transaction, keeping the current data schema for rollback. The old
+#   rollback schema is only dropped once the swap has worked, and not at all if objects in other schemas depend on it
+#   (e.g. views that followed their tables into it when it was swapped out) - dropping it would drop them too
+def publish_staging_schema(pg_cur):
+    previous_schema = f"{settings.data_schema}_previous"
+    replaced_schema = f"{settings.data_schema}_replaced"
+
+    pg_cur.execute(f"SELECT to_regnamespace('{settings.data_schema}') IS NOT NULL, "
+                   f"to_regnamespace('{previous_schema}') IS NOT NULL, "
+                   f"to_regnamespace('{replaced_schema}') IS NOT NULL")
+    live_schema_exists, previous_schema_exists, replaced_schema_exists = pg_cur.fetchone()
+
+    for schema, schema_exists in [(previous_schema, previous_schema_exists), (replaced_schema, replaced_schema_exists)]:
+        dependent_list = get_dependent_objects(pg_cur, schema) if schema_exists else list()
+
+        if len(dependent_list) > 0:
+            logger.fatal(f"\t- {schema} can't be dropped to make way for the new data - objects in other schemas "
+                         f"depend on it : {', '.join(dependent_list)}\nACTION: Move or drop them (or drop {schema} "
+                         f"yourself) and rerun - {settings.data_schema} hasn't changed")
+            return False
+
+    with pg_cur.connection.transaction():
+        # don't queue up behind long running queries, holding up everyone else
+        pg_cur.execute("SET LOCAL lock_timeout = '10s'")
+
+        # a replaced schema left by a publish that couldn't drop it
+        if replaced_schema_exists:
+            pg_cur.execute(f"DROP SCHEMA {replaced_schema} CASCADE")
+
+        # set the old rollback schema aside - renaming keeps the swap near instant
+        if previous_schema_exists:
+            pg_cur.execute(f"ALTER SCHEMA {previous_schema} RENAME TO {replaced_schema}")
+
+        if live_schema_exists:
+            pg_cur.execute(f"ALTER SCHEMA {settings.data_schema} RENAME TO {previous_schema}")
+
+        pg_cur.execute(f"ALTER SCHEMA {settings.load_schema} RENAME TO {settings.data_schema}")
+
+    if live_schema_exists:
+        logger.info(f"\t- {settings.data_schema} published : previous data kept in {previous_schema}")
+    else:
+        logger.info(f"\t- {settings.data_schema} published")
+
+    # the new data's live, so failing to drop the old rollback schema only leaves it behind until the next publish
+    if previous_schema_exists:
+        try:
+            pg_cur.execute(f"DROP SCHEMA {replaced_schema} CASCADE")
+        except psycopg.Error as ex:
+            logger.warning(f"\t- couldn't drop the old rollback schema {replaced_schema} : {ex}")
+
+    return True
+
+
+# returns the views, materialised views & foreign keys in other schemas that depend on a schema's tables
+def get_dependent_objects(pg_cur, schema):
+    pg_cur.execute(f"""SELECT DISTINCT coalesce(dep_view.oid::regclass::text,
+                                                pg_describe_object(dep.classid, dep.objid, dep.objsubid))
+                       FROM pg_depend AS dep
+                       INNER JOIN pg_class AS ref ON ref.oid = dep.refobjid
+                       LEFT OUTER JOIN pg_rewrite AS dep_rule ON dep.classid = 'pg_rewrite'::regclass
+                           AND dep_rule.oid = dep.objid
+                       LEFT OUTER JOIN pg_class AS dep_view ON dep_view.oid = dep_rule.ev_class
+                       LEFT OUTER JOIN pg_constraint AS dep_con ON dep.classid = 'pg_constraint'::regclass
+                           AND dep_con.oid = dep.objid
+                       WHERE dep.refclassid = 'pg_class'::regclass
+                           AND ref.relnamespace = '{schema}'::regnamespace
+                           AND coalesce(dep_view.relnamespace, dep_con.connamespace) <> '{schema}'::regnamespace
+                       ORDER BY 1""")
+
+    return [row[0] for row in pg_cur.fetchall()]
+
+
+# swaps the previous data schema back into place - the rolled back schema becomes the previous schema
+def rollback_data_schema(pg_cur):
+    previous_schema = f"{settings.data_schema}_previous"
+    temp_schema = f"{settings.data_schema}_rollback"
+
+    pg_cur.execute(f"SELECT to_regnamespace('{previous_schema}') IS NOT NULL")
+
+    if not pg_cur.fetchone()[0]:
+        logger.fatal(f"No {previous_schema} schema to roll back to")
+        return False
+
+    with pg_cur.connection.transaction():
+        pg_cur.execute("SET LOCAL lock_timeout = '10s'")
+        pg_cur.execute(f"ALTER SCHEMA {settings.data_schema} RENAME TO {temp_schema}")
+        pg_cur.execute(f"ALTER SCHEMA {previous_schema} RENAME TO {settings.data_schema}")
+        pg_cur.execute(f"ALTER SCHEMA {temp_schema} RENAME TO {previous_schema}")
+
+    logger.info(f"\t- {settings.data_schema} rolled back : rolled back data kept in {previous_schema}")
+
+    return True
+
 
 if __name__ == '__main__':
-    logger = logging.getLogger()
+    # parse the arguments before logging anything - --help (or a bad argument) exits without starting a load
+    settings.args
 
     # set logger
-    log_file = os.path.abspath(__file__).replace(".py", ".log")
-    logging.basicConfig(filename=log_file, level=logging.DEBUG, format="%(asctime)s %(message)s",
+    logging.basicConfig(filename=settings.log_file, level=logging.DEBUG, format="%(asctime)s %(message)s",
                         datefmt="%m/%d/%Y %I:%M:%S %p")
 
     # setup logger to write to screen as well as writing to log file
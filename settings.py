@@ -2,11 +2,17 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import functools
+import json
 import platform
 import psycopg
 import os
 import sys
 
+# settings are evaluated lazily - the command line isn't parsed and the database isn't queried until a setting is
+# first used. Importing this module has no side effects, and the settings can be set in code using configure()
+#   e.g. settings.configure(census_data_path="/data/census", max_processes=8)
+
 # default census year
 census_year = '2021'
 
@@ -15,15 +21,104 @@ python_version = sys.version.split("(")[0].strip()
 psycopg_version = psycopg.__version__.split("(")[0].strip()
 os_version = platform.system() + " " + platform.version().strip()
 
+
+# --max-processes is a number, or 'auto' to size it from the Postgres server & this machine
+def max_processes_type(value):
+    if value == "auto":
+        return value
+
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"must be a number or 'auto' : {value}")
+
+
 # set the command line arguments for the script
 parser = argparse.ArgumentParser(
     description='A quick way to load the complete ABS 2021 Census into Postgres, '
                 'ready to use as reference data for analysis and visualisation.')
 
 parser.add_argument(
-    '--max-processes', type=int, default=4,
+    '--max-processes', type=max_processes_type, default=4,
     help='Maximum number of parallel processes to use for the data load. (Set it to the number of cores on the '
-         'Postgres server minus 2, limit to 12 if 16+ cores - there is minimal benefit beyond 12). Defaults to 4.')
+         'Postgres server minus 2, limit to 12 if 16+ cores - there is minimal benefit beyond 12). \'auto\' sets '
+         'the maximum from the server\'s CPUs & free connections and this machine\'s CPUs & memory, then tunes the '
+         'number of processes during the load using the measured COPY throughput. Defaults to 4.')
+parser.add_argument(
+    '--engine', choices=['process', 'async'], default='process',
+    help='How the CSV files are loaded in parallel: \'process\' uses a pool of --max-processes Python processes; '
+         '\'async\' runs --max-processes COPYs at once from a single process using asyncio, with a connection per '
+         'COPY stream that\'s reused for each file. Defaults to \'process\'.')
+parser.add_argument(
+    '--copy-buffer-mb', type=int, default=64,
+    help='Maximum megabytes of CSV data held in memory across all parallel processes while streaming files into '
+         'Postgres. Processes wait for buffer space before reading more data. Defaults to 64.')
+parser.add_argument(
+    '--copy-format', choices=['text', 'binary'], default='text',
+    help='Format used to COPY data into Postgres. \'binary\' parses the CSV values into numbers in the parallel '
+         'processes, taking the parsing work off the Postgres server. Defaults to \'text\'.')
+parser.add_argument(
+    '--server-side-copy', choices=['off', 'file', 'program'], default='off',
+    help='Have the Postgres server read the CSV files directly, when it can see them. \'file\' copies each file as is '
+         '(needs pg_read_server_files); \'program\' runs it through a filter on the server that removes the same '
+         'characters the loader does (needs pg_execute_server_program). Files the server can\'t see, and zipped '
+         'files, are sent from this machine. Defaults to \'off\'.')
+parser.add_argument(
+    '--local-server-dir',
+    help='The path of the --census-data-path directory as the Postgres server sees it, when it\'s different (e.g. a '
+         'Docker volume). Used by --server-side-copy.')
+parser.add_argument(
+    '--resume', '--incremental', dest='resume', action='store_true',
+    help='Only reload tables whose source file has changed, or failed or didn\'t finish loading last time. '
+         'Uses the load_manifest table in the data schema. All tables are reloaded if the metadata has changed.')
+parser.add_argument(
+    '--staging', action='store_true',
+    help='Load into a staging schema using unlogged tables, then swap it with the data schema in one transaction '
+         'once it\'s validated. Readers of the data schema aren\'t affected during the load. The replaced data '
+         'is kept in a \'<data schema>_previous\' schema.')
+parser.add_argument(
+    '--rollback', action='store_true',
+    help='Swap the \'<data schema>_previous\' schema back into place and exit. No data is loaded.')
+parser.add_argument(
+    '--table-layout', choices=['table', 'partitioned'], default='table',
+    help='How the data tables are stored: \'table\' creates a table for each boundary & census table (e.g. '
+         'sa1_g01); \'partitioned\' creates a table for each census table (e.g. g01), list partitioned by boundary, '
+         'with views that keep the \'table\' layout names. Defaults to \'table\'.')
+parser.add_argument(
+    '--infer-types', choices=['off', 'sample', 'full'], default='off',
+    help='Store each stat in the smallest type that holds its values (smallint, integer, real or double precision), '
+         'instead of the DataPack\'s own types: \'sample\' infers the types from the first rows of each file, '
+         'falling back to \'full\' if a later value doesn\'t fit; \'full\' reads each file twice. Chosen types are '
+         'recorded in the metadata_column_types table. Defaults to \'off\'.')
+parser.add_argument(
+    '--cost-model', choices=['size', 'size-columns'], default='size',
+    help='How to estimate the relative load time of each CSV file, used to load the biggest files first: '
+         '\'size\' (file size) or \'size-columns\' (file size x number of columns). Defaults to \'size\'.')
+parser.add_argument(
+    '--telemetry-file',
+    help='JSON Lines file to write each data file\'s load timings & throughput to. '
+         'Defaults to load-census-telemetry.jsonl in the census-loader directory.')
+parser.add_argument(
+    '--log-file',
+    help='File to write the load\'s log to. Set it when loads run at the same time, so they don\'t write to the '
+         'same log. Defaults to load-census.log in the census-loader directory.')
+parser.add_argument(
+    '--metadata-cache-dir',
+    help='Directory to cache the parsed metadata workbooks in (as Parquet files, keyed by each workbook\'s hash), '
+         'so they\'re only parsed once. Requires pyarrow. Defaults to metadata-cache in the census-loader directory.')
+parser.add_argument(
+    '--work-timeout', type=int, default=3600,
+    help='Seconds a data file load or post load step can run before it\'s treated as hung and started again. '
+         'Failed files & tables are retried twice before being reported. Defaults to 3600.')
+parser.add_argument(
+    '--post-load-processes', type=int,
+    help='Number of parallel processes used to add primary keys, cluster and analyze the tables after all data is '
+         'loaded. Index builds are memory hungry, so this can be set lower than --max-processes. '
+         'Defaults to the --max-processes value.')
+parser.add_argument(
+    '--maintenance-work-mem', default='256MB',
+    help='Postgres maintenance_work_mem used by each post load process for building indexes & clustering. '
+         'Defaults to 256MB.')
 
 # PG Options
 parser.add_argument(
@@ -51,36 +146,60 @@ parser.add_argument(
 
 # input directories
 parser.add_argument(
-    '--census-data-path', help='Path to source census data tables (*.csv files).', required=True)
-
-# global var containing all input parameters
-args = parser.parse_args()
-
-# create the dictionary of settings
-census_data_path = args.census_data_path or ""
-
-max_concurrent_processes = args.max_processes
-states = ["ACT", "NSW", "NT", "OT", "QLD", "SA", "TAS", "VIC", "WA"]
-data_schema = args.data_schema or 'census_' + census_year + '_data'
-data_directory = census_data_path.replace("\\", "/")
-
-# create postgres connect string
-pg_host = args.pghost or os.getenv("PGHOST", "localhost")
-pg_port = args.pgport or os.getenv("PGPORT", 5432)
-pg_db = args.pgdb or os.getenv("POSTGRES_USER", "geo")
-pg_user = args.pguser or os.getenv("POSTGRES_USER", "postgres")
-pg_password = args.pgpassword or os.getenv("POSTGRES_PASSWORD", "password")
+    '--census-data-path', required=True,
+    help='Path to source census data tables (*.csv files), or to the zipped DataPacks (*.zip files). Zipped files '
+         'are read directly, they don\'t need to be extracted.')
+parser.add_argument(
+    '--datapack-source',
+    help='Download the zipped DataPacks into --census-data-path from this web address (e.g. '
+         'https://www.abs.gov.au/census/find-census-data/datapacks/download) or local directory, and load each '
+         'DataPack\'s files as soon as it\'s downloaded - the load runs alongside the downloads.')
+parser.add_argument(
+    '--datapacks', default='GCP,IP,TSP,PEP,WPP',
+    help='Comma separated list of the DataPacks to download with --datapack-source. Defaults to GCP,IP,TSP,PEP,WPP.')
+parser.add_argument(
+    '--boundary-path',
+    help='Path to the ABS boundary GeoPackages (*.gpkg files) for either or both datums. Every layer is imported '
+         'into the boundary schema for its datum, in parallel, before the census data is loaded.')
+parser.add_argument(
+    '--boundaries-only', action='store_true',
+    help='Only import the boundary GeoPackages in --boundary-path - the census data isn\'t loaded.')
+parser.add_argument(
+    '--setup-only', action='store_true',
+    help='Only add PostGIS to the database and create the data & boundary schemas, so loads run at the same time '
+         'don\'t race to create them - nothing is loaded.')
 
-pg_connect_string = f"dbname='{pg_db}' host='{pg_host}' port='{pg_port}' user='{pg_user}' password='{pg_password}'"
+# analysis ready views
+parser.add_argument(
+    '--analysis-views',
+    help='JSON file of the analysis ready views to build once the data is loaded (e.g. '
+         'supporting-files/analysis-views.json). Each view is a materialised view for each of its boundaries, with '
+         'its stats, a normalised region code & the boundary geometry, so queries don\'t need to join the data & '
+         'boundary tables. The views are built in parallel.')
+parser.add_argument(
+    '--analysis-schema',
+    help='Schema name to store the analysis ready views in. Defaults to \'census_' + census_year + '_analysis\'.')
+parser.add_argument(
+    '--analysis-datum', choices=['GDA2020', 'GDA94'], default='GDA2020',
+    help='Datum of the boundaries the analysis ready views get their geometries from. Defaults to GDA2020.')
+parser.add_argument(
+    '--refresh-analysis-views', action='store_true',
+    help='Only refresh the --analysis-views views, using REFRESH MATERIALIZED VIEW CONCURRENTLY so they can be '
+         'queried while they refresh - the census data isn\'t loaded. Views that don\'t exist yet are created.')
 
 # set postgres script directory
 sql_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "postgres-scripts")
 
 # set file name and field name defaults based on census year
+states = ["ACT", "NSW", "NT", "OT", "QLD", "SA", "TAS", "VIC", "WA"]
+
 metadata_file_prefix = "Metadata_"
 metadata_file_type = ".xlsx"
-census_metadata_dicts = [{"table": "metadata_tables", "first_row": "table number"},
-                         {"table": "metadata_stats", "first_row": "sequential"}]
+census_metadata_dicts = [{"table": "metadata_tables", "first_row": "table number", "num_columns": 3},
+                         {"table": "metadata_stats", "first_row": "sequential", "num_columns": 6}]
+
+# zipped DataPack file name, for downloading them
+datapack_file_name = "2021_{datapack}_all_for_AUS_short-header.zip"
 
 data_file_prefix = "2021Census_"
 data_file_type = ".csv"
@@ -88,43 +207,366 @@ table_name_part = 1  # position in the data file name that equals its destinatio
 bdy_name_part = 3  # position in the data file name that equals its census boundary name
 region_id_field = "region_id"
 
-# get Postgres, PostGIS & GEOS versions and flag if ST_Subdivide is supported
+# boundary datums - a GeoPackage's datum is the one in its file name
+bdy_datums = ["GDA2020", "GDA94"]
+
+# analysis ready views - the boundary table & code field each boundary's geometry comes from ({datum} is lower case).
+#   Boundaries not in the code field exceptions use {bdy}_code_2021
+analysis_bdy_table_name = "{bdy}_2021_aust_{datum}"
+analysis_bdy_code_field = "{bdy}_code_2021"
+analysis_bdy_code_field_exceptions = {"ste": "state_code_2021"}
+
+# estimated memory used by each load process (excluding the shared CSV buffer) - limits --max-processes=auto
+process_memory_mb = 200
+
+
+class Settings:
+    # argv is a list of command line arguments (defaults to the script's command line); overrides are argument
+    # values using their Python names (e.g. census_data_path="/data", max_processes=8)
+    def __init__(self, argv=None, **overrides):
+        self._argv = argv
+        self._overrides = overrides
+
+    # all input parameters
+    @functools.cached_property
+    def args(self):
+        argv = self._argv
+
+        # settings created in code don't need a command line - just the required arguments
+        if argv is None and self._overrides:
+            if self._overrides.get("census_data_path") is None:
+                raise ValueError("census_data_path is required")
+
+            argv = ["--census-data-path", self._overrides["census_data_path"]]
+
+        args = parser.parse_args(argv)
+
+        for name, value in self._overrides.items():
+            if not hasattr(args, name):
+                raise ValueError(f"Unknown setting : {name}")
+
+            setattr(args, name, value)
+
+        return args
+
+    @property
+    def census_data_path(self):
+        return self.args.census_data_path or ""
+
+    @property
+    def auto_tune_processes(self):
+        return self.args.max_processes == "auto"
+
+    @property
+    def max_concurrent_processes(self):
+        if self.auto_tune_processes:
+            return self.process_capacity["max_processes"]
+
+        return self.args.max_processes
+
+    # the most processes the Postgres server & this machine can run the load with - used by --max-processes=auto.
+    #   Queried once, when first used
+    @functools.cached_property
+    def process_capacity(self):
+        capacity = {
+            "server_cpus": None,
+            "server_cpus_source": None,
+            "free_connections": None,
+            "local_cpus": os.cpu_count() or 1,
+            "memory_processes": None
+        }
+
+        with psycopg.connect(self.pg_connect_string, autocommit=True) as temp_pg_conn:
+            with temp_pg_conn.cursor() as temp_pg_cur:
+                # free connection slots - this check's own connection is counted as used, leaving a spare
+                temp_pg_cur.execute("SELECT current_setting('max_connections')::integer "
+                                    "- current_setting('superuser_reserved_connections')::integer "
+                                    "- (SELECT count(*) FROM pg_stat_activity WHERE backend_type = 'client backend'), "
+                                    "current_setting('max_parallel_workers')::integer")
+                free_connections, max_parallel_workers = temp_pg_cur.fetchone()
+                capacity["free_connections"] = max(free_connections, 1)
+
+                # Postgres doesn't report the server's CPUs - read them from the server if allowed, otherwise use
+                #   this machine's if the server is local, otherwise the max parallel workers it's configured for
+                try:
+                    temp_pg_cur.execute("SELECT pg_read_file('/proc/cpuinfo')")
+                    cpu_info = temp_pg_cur.fetchone()[0]
+                    capacity["server_cpus"] = len([line for line in cpu_info.split("\n")
+                                                   if line.startswith("processor")])
+                    capacity["server_cpus_source"] = "/proc/cpuinfo"
+                except psycopg.Error:
+                    pass
+
+        if not capacity["server_cpus"]:
+            if self.pg_host in ("localhost", "127.0.0.1", "::1"):
+                capacity["server_cpus"] = capacity["local_cpus"]
+                capacity["server_cpus_source"] = "local"
+            else:
+                capacity["server_cpus"] = max(max_parallel_workers, 1)
+                capacity["server_cpus_source"] = "max_parallel_workers"
+
+        # available memory on this machine, less the shared CSV buffer
+        available_mb = None
+
+        try:
+            with open("/proc/meminfo", "r") as meminfo_file:
+                for line in meminfo_file:
+                    if line.startswith("MemAvailable:"):
+                        available_mb = int(line.split()[1]) / 1024.0
+        except OSError:
+            try:
+                available_mb = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1048576.0
+            except (ValueError, OSError, AttributeError):
+                pass
+
+        if available_mb is not None:
+            capacity["memory_processes"] = max(int((available_mb - self.max_copy_buffer_mb) / process_memory_mb), 1)
+
+        limits = [capacity["server_cpus"], capacity["free_connections"], capacity["local_cpus"],
+                  capacity["memory_processes"]]
+        capacity["max_processes"] = max(min([limit for limit in limits if limit is not None]), 1)
+
+        return capacity
+
+    @property
+    def engine(self):
+        return self.args.engine
+
+    @property
+    def max_copy_buffer_mb(self):
+        return self.args.copy_buffer_mb
+
+    @property
+    def copy_format(self):
+        return self.args.copy_format
+
+    @property
+    def server_side_copy(self):
+        return self.args.server_side_copy
+
+    @property
+    def local_server_dir(self):
+        return (self.args.local_server_dir or "").replace("\\", "/")
+
+    @property
+    def table_layout(self):
+        return self.args.table_layout
+
+    @property
+    def infer_types(self):
+        return self.args.infer_types
+
+    @property
+    def cost_model(self):
+        return self.args.cost_model
+
+    @property
+    def resume(self):
+        return self.args.resume
+
+    @property
+    def telemetry_file(self):
+        return self.args.telemetry_file or os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                        "load-census-telemetry.jsonl")
+
+    @property
+    def log_file(self):
+        return self.args.log_file or os.path.join(os.path.dirname(os.path.realpath(__file__)), "load-census.log")
+
+    @property
+    def metadata_cache_dir(self):
+        return self.args.metadata_cache_dir or os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                            "metadata-cache")
+
+    @property
+    def work_timeout(self):
+        return self.args.work_timeout
+
+    @property
+    def max_post_load_processes(self):
+        return self.args.post_load_processes or self.max_concurrent_processes
+
+    @property
+    def maintenance_work_mem(self):
+        return self.args.maintenance_work_mem
+
+    @property
+    def data_schema(self):
+        return self.args.data_schema or 'census_' + census_year + '_data'
+
+    @property
+    def staging(self):
+        return self.args.staging
+
+    @property
+    def rollback(self):
+        return self.args.rollback
+
+    @property
+    def load_schema(self):
+        return self.data_schema + "_staging" if self.staging else self.data_schema
+
+    @property
+    def data_directory(self):
+        return self.census_data_path.replace("\\", "/")
+
+    @property
+    def datapack_source(self):
+        return self.args.datapack_source
+
+    @property
+    def datapack_list(self):
+        return [datapack.strip().upper() for datapack in self.args.datapacks.split(",") if datapack.strip()]
+
+    @property
+    def boundary_directory(self):
+        return (self.args.boundary_path or "").replace("\\", "/")
+
+    @property
+    def boundaries_only(self):
+        return self.args.boundaries_only
+
+    @property
+    def setup_only(self):
+        return self.args.setup_only
+
+    # boundary schema names for each datum
+    @property
+    def bdy_schemas(self):
+        return dict([(datum, 'census_' + census_year + '_bdys_' + datum.lower()) for datum in bdy_datums])
+
+    # the analysis ready views in the --analysis-views file
+    @functools.cached_property
+    def analysis_view_list(self):
+        if self.args.analysis_views is None:
+            return list()
+
+        with open(self.args.analysis_views, "r") as input_file:
+            return json.load(input_file)["views"]
+
+    @property
+    def analysis_schema(self):
+        return self.args.analysis_schema or 'census_' + census_year + '_analysis'
+
+    @property
+    def analysis_datum(self):
+        return self.args.analysis_datum
+
+    @property
+    def refresh_analysis_views(self):
+        return self.args.refresh_analysis_views
+
+    # postgres connection parameters
+    @property
+    def pg_host(self):
+        return self.args.pghost or os.getenv("PGHOST", "localhost")
+
+    @property
+    def pg_port(self):
+        return self.args.pgport or os.getenv("PGPORT", 5432)
+
+    @property
+    def pg_db(self):
+        return self.args.pgdb or os.getenv("POSTGRES_USER", "geo")
+
+    @property
+    def pg_user(self):
+        return self.args.pguser or os.getenv("POSTGRES_USER", "postgres")
+
+    @property
+    def pg_password(self):
+        return self.args.pgpassword or os.getenv("POSTGRES_PASSWORD", "password")
+
+    @property
+    def pg_connect_string(self):
+        return (f"dbname='{self.pg_db}' host='{self.pg_host}' port='{self.pg_port}' "
+                f"user='{self.pg_user}' password='{self.pg_password}'")
+
+    # get Postgres, PostGIS & GEOS versions and flag if ST_Subdivide is supported - queried once, when first used
+    @functools.cached_property
+    def server_versions(self):
+        versions = {
+            "pg_version": "UNKNOWN",
+            "postgis_version": "UNKNOWN",
+            "postgis_version_num": 0.0,
+            "geos_version": "UNKNOWN",
+            "geos_version_num": 0.0
+        }
+
+        # get Postgres connection & cursor
+        with psycopg.connect(self.pg_connect_string) as temp_pg_conn:
+            with temp_pg_conn.cursor() as temp_pg_cur:
+                # get Postgres version
+                temp_pg_cur.execute("SELECT version()")
+                versions["pg_version"] = temp_pg_cur.fetchone()[0].replace("PostgreSQL ", "").split(",")[0]
+
+                # get PostGIS version
+                temp_pg_cur.execute("SELECT PostGIS_full_version()")
+                lib_strings = temp_pg_cur.fetchone()[0].replace("\"", "").split(" ")
+
+        for lib_string in lib_strings:
+            if lib_string[:8] == "POSTGIS=":
+                versions["postgis_version"] = lib_string.replace("POSTGIS=", "")
+                versions["postgis_version_num"] = float(versions["postgis_version"][:3])
+            if lib_string[:5] == "GEOS=":
+                versions["geos_version"] = lib_string.replace("GEOS=", "")
+                versions["geos_version_num"] = float(versions["geos_version"][:3])
+
+        return versions
+
+    @property
+    def pg_version(self):
+        return self.server_versions["pg_version"]
+
+    @property
+    def postgis_version(self):
+        return self.server_versions["postgis_version"]
+
+    @property
+    def postgis_version_num(self):
+        return self.server_versions["postgis_version_num"]
+
+    @property
+    def geos_version(self):
+        return self.server_versions["geos_version"]
+
+    @property
+    def geos_version_num(self):
+        return self.server_versions["geos_version_num"]
+
+    @property
+    def st_subdivide_supported(self):
+        return self.postgis_version_num >= 2.2 and self.geos_version_num >= 3.5
+
+    @property
+    def st_clusterkmeans_supported(self):
+        return self.postgis_version_num >= 2.3
+
+
+# the settings used by the loader - created from the command line when a setting is first used
+current_settings = None
+
 
-# get Postgres connection & cursor
-temp_pg_conn = psycopg.connect(pg_connect_string)
-temp_pg_cur = temp_pg_conn.cursor()
+def get_settings():
+    global current_settings
 
-# get Postgres version
-temp_pg_cur.execute("SELECT version()")
-pg_version = temp_pg_cur.fetchone()[0].replace("PostgreSQL ", "").split(",")[0]
+    if current_settings is None:
+        current_settings = Settings()
 
-# get PostGIS version
-temp_pg_cur.execute("SELECT PostGIS_full_version()")
-lib_strings = temp_pg_cur.fetchone()[0].replace("\"", "").split(" ")
+    return current_settings
 
-temp_pg_cur.close()
-temp_pg_cur = None
-temp_pg_conn.close()
-temp_pg_conn = None
 
-postgis_version = "UNKNOWN"
-postgis_version_num = 0.0
-geos_version = "UNKNOWN"
-geos_version_num = 0.0
+# use settings created in code, instead of the command line
+def configure(argv=None, **overrides):
+    global current_settings
+    current_settings = Settings(argv, **overrides)
 
-st_subdivide_supported = False
-st_clusterkmeans_supported = False
+    return current_settings
 
-for lib_string in lib_strings:
-    if lib_string[:8] == "POSTGIS=":
-        postgis_version = lib_string.replace("POSTGIS=", "")
-        postgis_version_num = float(postgis_version[:3])
-    if lib_string[:5] == "GEOS=":
-        geos_version = lib_string.replace("GEOS=", "")
-        geos_version_num = float(geos_version[:3])
 
-if postgis_version_num >= 2.2 and geos_version_num >= 3.5:
-    st_subdivide_supported = True
+# module level access to the current settings (e.g. settings.pg_connect_string)
+def __getattr__(name):
+    if name.startswith("__"):
+        raise AttributeError(name)
 
-if postgis_version_num >= 2.3:
-    st_clusterkmeans_supported = True
+    return getattr(get_settings(), name)
@@ -4,6 +4,8 @@
 #
 # Arguments:
 #   1. The datum of the boundary files: valid values are GDA94 or GDA2020
+#   2. Optional: download-only - downloads the files to ${BDYS_PATH}/<datum> without importing them
+#      (load-census.py --boundary-path imports both datums in parallel)
 #
 # Sample command line: . /Users/$(whoami)/git/minus34/census-loader/02_download_boundaries.sh 2021 GDA94
 #
@@ -27,6 +29,7 @@ PG_CONNECT_STRING="PG:host=localhost user=postgres dbname=geo password=password
 
 # get datum
 DATUM=$(echo $1 | tr '[:lower:]' '[:upper:]')
+DATUM_PATH="${BDYS_PATH}/${DATUM}"
 BDY_SCHEMA_SUFFIX=$(echo ${DATUM} | tr '[:upper:]' '[:lower:]')
 
 BDYS_SCHEMA="census_${CENSUS_YEAR}_bdys_${BDY_SCHEMA_SUFFIX}"
@@ -42,16 +45,24 @@ echo "-------------------------------------------------------------------------"
 echo "Downloading ${DATUM} boundary files"
 echo "-------------------------------------------------------------------------"
 
-## WARNING: deletes the bdy directory
-rm -rf "${BDYS_PATH}"
-mkdir -p "${BDYS_PATH}"
-cd "${BDYS_PATH}"
+## WARNING: deletes the datum's bdy directory
+rm -rf "${DATUM_PATH}"
+mkdir -p "${DATUM_PATH}"
+cd "${DATUM_PATH}"
 
-getfile "${MAINBDYFILE}" "${BDYS_PATH}"
-getfile "${INDIGENOUSBDYFILE}" "${BDYS_PATH}"
-getfile "${NONABSBDYFILE}" "${BDYS_PATH}"
-getfile "${SUAUCLBDYFILE}" "${BDYS_PATH}"
-getfile "${RABDYFILE}" "${BDYS_PATH}"
+getfile "${MAINBDYFILE}" "${DATUM_PATH}"
+getfile "${INDIGENOUSBDYFILE}" "${DATUM_PATH}"
+getfile "${NONABSBDYFILE}" "${DATUM_PATH}"
+getfile "${SUAUCLBDYFILE}" "${DATUM_PATH}"
+getfile "${RABDYFILE}" "${DATUM_PATH}"
+
+cd - > /dev/null
+
+if [ "$2" = "download-only" ]; then
+  duration=$SECONDS
+  echo "${DATUM} Boundaries downloaded in $((duration / 60)) mins"
+  return 0 2>/dev/null || exit 0
+fi
 
 echo "-------------------------------------------------------------------------"
 echo "Importing ${DATUM} files into Postgres"
@@ -60,18 +71,17 @@ echo "-------------------------------------------------------------------------"
 # requires GDAL to be installed
 psql -d geo -c "create schema if not exists ${BDYS_SCHEMA};alter schema ${BDYS_SCHEMA} owner to postgres"
 
-find ${BDYS_PATH} -name "*_${DATUM}*.gpkg" > ${BDYS_PATH}/temp.txt
+find ${DATUM_PATH} -name "*_${DATUM}*.gpkg" > ${DATUM_PATH}/temp.txt
 
 while read f;
   do
     echo "  - Importing ${f}"
     $CONDA_PREFIX/bin/ogr2ogr -f "PostgreSQL" "${PG_CONNECT_STRING}" -lco OVERWRITE=YES -lco GEOMETRY_NAME=geom -lco SCHEMA=${BDYS_SCHEMA} ${f}
-  done < ${BDYS_PATH}/temp.txt
+  done < ${DATUM_PATH}/temp.txt
 
 
-## WARNING: deletes the bdy directory
-rm -rf "${BDYS_PATH}"
-rm ${BDYS_PATH}/temp.txt
+## WARNING: deletes the datum's bdy directory
+rm -rf "${DATUM_PATH}"
 
 
 duration=$SECONDS
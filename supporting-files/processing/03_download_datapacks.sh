@@ -3,6 +3,8 @@
 #
 # downloads ABS Census DataPacks and unzips them
 #
+# set UNZIP_DATAPACKS=false to keep the zip files - load-census.py can read them without extracting them
+#
 
 # function to download, unzip, and delete file
 function getfile {
@@ -10,8 +12,11 @@ function getfile {
 #  echo "  - Downloading ${filename}"
   # use insecure to enable downloading through man-in-the-middle proxy servers
   curl -O -L -s --insecure "https://www.abs.gov.au/census/find-census-data/datapacks/download/${filename}"
-  unzip -o -q "${filename}" -d "$2"
-  rm "${filename}"
+
+  if [ "${UNZIP_DATAPACKS}" != "false" ]; then
+    unzip -o -q "${filename}" -d "$2"
+    rm "${filename}"
+  fi
 }
 
 SECONDS=0*
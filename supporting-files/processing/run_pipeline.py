@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# run_pipeline.py
+# *********************************************************************************************************************
+#
+# Runs the census-loader build as a graph of stages, starting each stage as soon as the stages it depends on are done.
+#   The boundary downloads & import don't depend on the DataPacks, so they run alongside the data download & load
+#
+# Process:
+#   1. downloads the GDA94 & GDA2020 boundaries and the DataPacks at the same time, while adding PostGIS & the schemas
+#   2. imports the boundaries and loads the census data as soon as their downloads finish
+#   3. optionally dumps the schemas, builds the Docker images and exports GeoParquet files
+#   4. logs the time of each stage and the critical path - the chain of stages that set the total time
+#
+# Each stage writes a checkpoint file to <output folder>/pipeline when it finishes. A rerun skips the finished stages,
+#   unless a stage they depend on has been rerun since
+#
+# Sample command line:
+#   python supporting-files/processing/run_pipeline.py --output-folder="/Users/$(whoami)/tmp/census_2021" --dump
+#
+# *********************************************************************************************************************
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+from datetime import datetime, timedelta
+
+# the directory the processing scripts are in
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+# the census-loader directory
+loader_dir = os.path.join(script_dir, "..", "..")
+
+# stages that only run when asked for
+optional_stages = ["dump", "docker", "geoparquet"]
+
+# where the ABS DataPacks are downloaded from
+datapack_url = "https://www.abs.gov.au/census/find-census-data/datapacks/download"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the census-loader build, with independent stages in parallel.")
+    parser.add_argument("--output-folder", default=os.path.join(os.path.expanduser("~"), "tmp", "census_2021"),
+                        help="Folder to download the boundaries & DataPacks to, and write the checkpoints, stage logs "
+                             "& dump files to. Defaults to ~/tmp/census_2021.")
+    parser.add_argument("--census-year", default="2021", help="Census year. Defaults to 2021.")
+    parser.add_argument("--dump", action="store_true", help="Dump the data & boundary schemas once they're loaded.")
+    parser.add_argument("--docker", action="store_true", help="Build & push the Docker images (needs --dump).")
+    parser.add_argument("--geoparquet", action="store_true",
+                        help="Export GeoParquet versions of the boundaries (needs the 'sedona' Conda environment).")
+    parser.add_argument("--stream-datapacks", action="store_true",
+                        help="Have load-census.py download the DataPacks itself, loading each one while the next one "
+                             "downloads, instead of downloading them all first.")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoints and run every stage.")
+    parser.add_argument("--rerun", default="",
+                        help="Comma separated list of stages to run again even if they're done - the stages that "
+                             "depend on them are run again too.")
+    parser.add_argument("--loader-args", default="",
+                        help="Extra arguments for load-census.py (e.g. Postgres connection parameters).")
+    args = parser.parse_args()
+
+    if args.docker and not args.dump:
+        logger.fatal("--docker needs --dump - the Docker images are built from the dump files")
+        return False
+
+    stages = get_stages(args)
+
+    checkpoint_dir = os.path.join(args.output_folder, "pipeline")
+
+    if args.restart and os.path.isdir(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    for name in [name for name in args.rerun.split(",") if name]:
+        if name not in stages:
+            logger.fatal(f"Unknown stage : {name} - valid stages are {', '.join(stages)}")
+            return False
+
+        if os.path.isfile(get_checkpoint_file(checkpoint_dir, name)):
+            os.remove(get_checkpoint_file(checkpoint_dir, name))
+
+    # the environment the shell scripts expect
+    env = dict(os.environ)
+    env.update({
+        "CENSUS_YEAR": args.census_year,
+        "OUTPUT_FOLDER": args.output_folder,
+        "DATA_PATH": os.path.join(args.output_folder, "data"),
+        "BDYS_PATH": os.path.join(args.output_folder, "bdys"),
+        "SCRIPT_DIR": script_dir
+    })
+
+    start_time = datetime.now()
+    timings = run_stages(stages, checkpoint_dir, env)
+    elapsed = (datetime.now() - start_time).total_seconds()
+
+    log_critical_path(stages, timings, elapsed)
+
+    failed_stages = [name for name, timing in timings.items() if timing["result"] != "SUCCESS"]
+
+    if len(failed_stages) > 0:
+        logger.warning(f"{len(failed_stages)} stages didn't finish : {', '.join(failed_stages)} - "
+                       f"fix the problem and rerun to carry on from where it stopped")
+        return False
+
+    return True
+
+
+# the pipeline stages: the command each one runs & the stages it depends on. Shell scripts are run from this directory
+def get_stages(args):
+    # the load-census.py stages run at the same time, so each writes its own log file
+    def load_census(name, extra_args):
+        log_file = os.path.join(args.output_folder, "pipeline", f"{name}-load-census.log")
+
+        return [sys.executable, os.path.join(loader_dir, "load-census.py"),
+                f"--census-data-path={os.path.join(args.output_folder, 'data')}",
+                f"--log-file={log_file}"] + extra_args + args.loader_args.split()
+
+    bdy_schema = f"census_{args.census_year}_bdys_gda94"
+
+    stages = {
+        "boundaries_gda94": {
+            "command": ["bash", "-c", ". ./02_download_boundaries.sh GDA94 download-only"],
+            "depends": []
+        },
+        "boundaries_gda2020": {
+            "command": ["bash", "-c", ". ./02_download_boundaries.sh GDA2020 download-only"],
+            "depends": []
+        },
+        "datapacks": {
+            "command": ["bash", "-c", ". ./03_download_datapacks.sh"],
+            "depends": []
+        },
+        # adds PostGIS & creates the schemas once, before the boundary & data loads run at the same time
+        "setup_database": {
+            "command": load_census("setup_database", ["--setup-only"]),
+            "depends": []
+        },
+        "load_boundaries": {
+            "command": load_census("load_boundaries", [f"--boundary-path={os.path.join(args.output_folder, 'bdys')}",
+                                                      "--boundaries-only"]),
+            "depends": ["setup_database", "boundaries_gda94", "boundaries_gda2020"]
+        },
+        "load_data": {
+            "command": load_census("load_data", []),
+            "depends": ["setup_database", "datapacks"]
+        },
+        "dump": {
+            "command": ["bash", os.path.join(script_dir, "..", "dump-census-schemas.sh")],
+            "depends": ["load_boundaries", "load_data"]
+        },
+        "docker": {
+            "command": ["bash", "./04_create_docker_images.sh"],
+            "depends": ["dump"]
+        },
+        "geoparquet": {
+            "command": ["bash", "-c", f"rm -rf '{os.path.join(args.output_folder, 'geoparquet')}' && "
+                                      f"conda run -n sedona python {os.path.join(loader_dir, 'spark')}"
+                                      f"/xx_export_to_geoparquet.py --bdy-schema={bdy_schema} "
+                                      f"--output-path='{os.path.join(args.output_folder, 'geoparquet')}'"],
+            "depends": ["load_boundaries"]
+        }
+    }
+
+    for name in optional_stages:
+        if not getattr(args, name):
+            del stages[name]
+
+    # the data load downloads the DataPacks as it goes
+    if args.stream_datapacks:
+        del stages["datapacks"]
+        stages["load_data"] = {
+            "command": load_census("load_data", [f"--datapack-source={datapack_url}"]),
+            "depends": ["setup_database"]
+        }
+
+    return stages
+
+
+def get_checkpoint_file(checkpoint_dir, name):
+    return os.path.join(checkpoint_dir, f"{name}.done")
+
+
+# a stage is done if it's checkpointed after all the stages it depends on (i.e. none have been rerun since)
+def is_stage_done(stages, checkpoint_dir, name):
+    checkpoint_file = get_checkpoint_file(checkpoint_dir, name)
+
+    if not os.path.isfile(checkpoint_file):
+        return False
+
+    for depends_name in stages[name]["depends"]:
+        if not is_stage_done(stages, checkpoint_dir, depends_name):
+            return False
+
+        if os.path.getmtime(get_checkpoint_file(checkpoint_dir, depends_name)) > os.path.getmtime(checkpoint_file):
+            return False
+
+    return True
+
+
+# runs the stages in a thread pool, each starting as soon as the stages it depends on have finished. A failed stage
+#   stops the stages that depend on it, the others carry on
+def run_stages(stages, checkpoint_dir, env):
+    timings = dict()
+    pipeline_start = datetime.now()
+
+    for name in stages:
+        if is_stage_done(stages, checkpoint_dir, name):
+            timings[name] = {"result": "SUCCESS", "start": 0.0, "seconds": 0.0, "skipped": True}
+            logger.info(f"\t- {name} : done in a previous run - skipped")
+
+    running = dict()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        while True:
+            # start every stage whose dependencies are done
+            for name, stage in stages.items():
+                if name in timings or name in running.values():
+                    continue
+
+                depends_results = [timings.get(depends_name, dict()).get("result") for depends_name in stage["depends"]]
+
+                if any([result is not None and result != "SUCCESS" for result in depends_results]):
+                    timings[name] = {"result": "NOT RUN", "start": 0.0, "seconds": 0.0, "skipped": True}
+                    logger.warning(f"\t- {name} : not run - a stage it depends on didn't finish")
+                elif all([result == "SUCCESS" for result in depends_results]):
+                    logger.info(f"\t- {name} : started")
+                    future = executor.submit(run_stage, name, stage["command"], checkpoint_dir, env)
+                    running[future] = name
+
+            if len(running) == 0:
+                break
+
+            done, not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                name = running.pop(future)
+                timing = future.result()
+                timing["start"] = (timing.pop("start_time") - pipeline_start).total_seconds()
+                timings[name] = timing
+
+                if timing["result"] == "SUCCESS":
+                    logger.info(f"\t- {name} : done : {timedelta(seconds=int(timing['seconds']))}")
+                else:
+                    logger.warning(f"\t- {name} : FAILED : {timing['result']} : see {timing['log_file']}")
+
+    return timings
+
+
+# runs a stage's command, writing its output to a log file, and checkpoints the stage if it succeeds
+def run_stage(name, command, checkpoint_dir, env):
+    start_time = datetime.now()
+    log_file = os.path.join(checkpoint_dir, f"{name}.log")
+
+    try:
+        with open(log_file, "w") as output_file:
+            return_code = subprocess.call(command, cwd=script_dir, env=env, stdout=output_file,
+                                          stderr=subprocess.STDOUT)
+        result = "SUCCESS" if return_code == 0 else f"exit code {return_code}"
+    except OSError as ex:
+        result = f"couldn't run : {ex}"
+
+    seconds = (datetime.now() - start_time).total_seconds()
+
+    if result == "SUCCESS":
+        with open(get_checkpoint_file(checkpoint_dir, name), "w") as output_file:
+            json.dump({"finished": datetime.now().isoformat(timespec="seconds"), "seconds": seconds}, output_file)
+
+    return {"result": result, "start_time": start_time, "seconds": seconds, "skipped": False, "log_file": log_file}
+
+
+# logs each stage's time & the critical path - the longest chain of dependent stages, which sets the pipeline's
+#   total time. Stages off the critical path have slack: they could take that much longer without slowing the pipeline
+def log_critical_path(stages, timings, elapsed):
+    finish = dict()
+    previous = dict()
+
+    # stages are defined after the stages they depend on, so one pass in order works
+    for name, stage in stages.items():
+        depends_finish = [(finish[depends_name], depends_name) for depends_name in stage["depends"]]
+        latest_finish, latest_name = max(depends_finish) if len(depends_finish) > 0 else (0.0, None)
+
+        finish[name] = latest_finish + timings[name]["seconds"]
+        previous[name] = latest_name
+
+    # walk back from the stage that finishes last
+    name = max(finish, key=finish.get)
+    critical_path = list()
+
+    while name is not None:
+        critical_path.insert(0, name)
+        name = previous[name]
+
+    # the latest each stage could finish without delaying the stages after it (backwards pass)
+    latest_finish = dict()
+
+    for name in reversed(list(stages)):
+        successor_starts = [latest_finish[successor] - timings[successor]["seconds"]
+                            for successor, stage in stages.items() if name in stage["depends"]]
+        latest_finish[name] = min(successor_starts) if len(successor_starts) > 0 else max(finish.values())
+
+    logger.info("")
+    logger.info("Stage times")
+
+    for name in stages:
+        timing = timings[name]
+
+        if timing["skipped"]:
+            logger.info(f"\t- {name} : {timing['result'] if timing['result'] != 'SUCCESS' else 'skipped'}")
+        else:
+            slack = latest_finish[name] - finish[name]
+            logger.info(f"\t- {name} : {timedelta(seconds=int(timing['seconds']))} : started after "
+                        f"{timedelta(seconds=int(timing['start']))} : slack {timedelta(seconds=int(slack))}")
+
+    total_seconds = sum([timing["seconds"] for timing in timings.values()])
+
+    logger.info(f"\t- critical path : {' -> '.join(critical_path)} : {timedelta(seconds=int(max(finish.values())))}")
+    logger.info(f"\t- total time : {timedelta(seconds=int(elapsed))} vs {timedelta(seconds=int(total_seconds))} "
+                f"running the stages one after another")
+
+
+if __name__ == "__main__":
+    logger = logging.getLogger()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p")
+
+    if not main():
+        sys.exit(1)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# benchmark_copy_format.py
+# *********************************************************************************************************************
+#
+# Compares text and binary COPY throughput for the same Census DataPack CSV files
+#
+# Process:
+#   1. creates a scratch table for each CSV file, with a double precision column for each stat
+#   2. loads each file using text COPY, then binary COPY, for a number of runs
+#   3. reports MB/s and rows/s for each format
+#
+# Sample command line:
+#   python testing/benchmark/benchmark_copy_format.py --runs=3 --csv-path="/Users/$(whoami)/tmp/census_2021/data"
+#
+# *********************************************************************************************************************
+
+import argparse
+import logging
+import os
+import psycopg
+import sys
+
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", ".."))
+import utils  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares text and binary COPY throughput for Census CSV files.")
+    parser.add_argument("--csv-path", required=True,
+                        help="A Census CSV file, or a directory of them (the largest 10 files are used).")
+    parser.add_argument("--runs", type=int, default=3, help="Number of times each file is loaded. Defaults to 3.")
+    parser.add_argument("--scratch-schema", default="census_copy_benchmark",
+                        help="Schema for the scratch tables - it's dropped at the end. "
+                             "Defaults to 'census_copy_benchmark'.")
+    parser.add_argument("--pghost", default=os.getenv("PGHOST", "localhost"))
+    parser.add_argument("--pgport", default=os.getenv("PGPORT", 5432))
+    parser.add_argument("--pgdb", default=os.getenv("PGDATABASE", "geo"))
+    parser.add_argument("--pguser", default=os.getenv("PGUSER", "postgres"))
+    parser.add_argument("--pgpassword", default=os.getenv("PGPASSWORD", "password"))
+    args = parser.parse_args()
+
+    pg_connect_string = (f"dbname='{args.pgdb}' host='{args.pghost}' port='{args.pgport}' "
+                         f"user='{args.pguser}' password='{args.pgpassword}'")
+
+    # get the files to test - the largest files are the ones that matter
+    if os.path.isdir(args.csv_path):
+        file_list = [os.path.join(root, file_name)
+                     for root, dirs, files in os.walk(args.csv_path)
+                     for file_name in files if file_name.lower().endswith(".csv")]
+        file_list = sorted(file_list, key=os.path.getsize, reverse=True)[:10]
+    else:
+        file_list = [args.csv_path]
+
+    total_bytes = sum(os.path.getsize(file_path) for file_path in file_list)
+
+    pg_conn = psycopg.connect(pg_connect_string)
+    pg_conn.autocommit = True
+    pg_cur = pg_conn.cursor()
+
+    pg_cur.execute(f"CREATE SCHEMA IF NOT EXISTS {args.scratch_schema}")
+
+    results = dict()
+
+    for copy_format in ["text", "binary"]:
+        elapsed = 0.0
+        total_rows = 0
+
+        for run in range(args.runs):
+            for i, file_path in enumerate(file_list):
+                table = f"{args.scratch_schema}.copy_test_{i}"
+                num_columns = create_scratch_table(pg_cur, table, file_path)
+
+                start_time = datetime.now()
+
+                with open(file_path, "rb") as csv_file:
+                    if copy_format == "binary":
+                        utils.copy_csv_binary(pg_cur, table, csv_file, num_columns)
+                    else:
+                        utils.copy_csv_text(pg_cur, table, csv_file)
+
+                elapsed += (datetime.now() - start_time).total_seconds()
+
+                pg_cur.execute(f"SELECT count(*) FROM {table}")
+                total_rows += pg_cur.fetchone()[0]
+
+        results[copy_format] = (elapsed, total_rows)
+
+        logger.info(f"{copy_format} COPY : {args.runs} runs of {len(file_list)} files : {elapsed:.2f}s : "
+                    f"{total_bytes * args.runs / 1048576.0 / elapsed:.1f} MB/s : {total_rows / elapsed:.0f} rows/s")
+
+    if results["binary"][1] != results["text"][1]:
+        logger.warning("Row counts don't match between text and binary COPY!")
+
+    logger.info(f"binary COPY is {results['text'][0] / results['binary'][0]:.2f}x the speed of text COPY")
+
+    pg_cur.execute(f"DROP SCHEMA {args.scratch_schema} CASCADE")
+    pg_cur.close()
+    pg_conn.close()
+
+
+# creates an unlogged table with a text region id and a double precision column for each stat in the CSV file
+def create_scratch_table(pg_cur, table, file_path):
+    with open(file_path, "rb") as csv_file:
+        header = csv_file.readline().decode("utf-8").strip().replace(" ", "")
+
+    num_columns = len(header.split(","))
+    fields_string = ",".join([f"stat_{i} double precision" for i in range(1, num_columns)])
+
+    pg_cur.execute(f"DROP TABLE IF EXISTS {table}")
+    pg_cur.execute(f"CREATE UNLOGGED TABLE {table} (region_id text, {fields_string})")
+
+    return num_columns
+
+
+if __name__ == "__main__":
+    logger = logging.getLogger()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p")
+
+    main()
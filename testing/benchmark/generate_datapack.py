@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# generate_datapack.py
+# *********************************************************************************************************************
+#
+# Generates a synthetic Census DataPack for benchmarking load-census.py, in the same layout as the ABS DataPacks
+#
+# Process:
+#   1. creates a Metadata_*.xlsx workbook with the table & stats (cell descriptor) worksheets
+#   2. creates a 2021Census_G??_AUST_<boundary>.csv file for each table and boundary type (and an AUS file per table)
+#   3. optionally zips the lot, like a downloaded DataPack
+#
+# Sample command line:
+#   python testing/benchmark/generate_datapack.py --tables=20 --regions=10000 --columns=100
+#       --output-path="/Users/$(whoami)/tmp/census_benchmark"
+#
+# *********************************************************************************************************************
+
+import argparse
+import json
+import logging
+import os
+import pandas  # module needs to be installed, along with openpyxl (for Excel file output)
+import random
+import shutil
+
+# boundary types & the number of regions in each, relative to the number of regions in the smallest boundary type
+boundary_scales = {"sa1": 1.0, "sa2": 0.2, "sa3": 0.05, "lga": 0.05, "poa": 0.2, "ste": 0.001}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a synthetic Census DataPack for benchmarking.")
+    parser.add_argument("--output-path", required=True,
+                        help="Directory to write the DataPack to - it's deleted if it already exists.")
+    parser.add_argument("--tables", type=int, default=10, help="Number of G tables. Defaults to 10.")
+    parser.add_argument("--regions", type=int, default=10000,
+                        help="Number of regions (rows) in the largest boundary type (SA1). Defaults to 10000.")
+    parser.add_argument("--columns", type=int, default=50,
+                        help="Average number of stats (columns) per table. Defaults to 50.")
+    parser.add_argument("--null-fraction", type=float, default=0.01,
+                        help="Fraction of values that are NULL ('..'). Defaults to 0.01.")
+    parser.add_argument("--seed", type=int, default=2021, help="Random seed, for repeatable data. Defaults to 2021.")
+    parser.add_argument("--zip", action="store_true", help="Zip the DataPack, like the ABS downloads.")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    if os.path.isdir(args.output_path):
+        shutil.rmtree(args.output_path)
+
+    datapack_path = os.path.join(args.output_path, "2021_GCP_all_for_AUS_short-header")
+    metadata_path = os.path.join(datapack_path, "Metadata")
+    os.makedirs(metadata_path)
+
+    # tables vary in width, like the real DataPack
+    table_list = list()
+    sequential_num = 1
+
+    for i in range(1, args.tables + 1):
+        table_number = f"G{i:02d}"
+        num_columns = max(int(random.uniform(0.2, 1.8) * args.columns), 1)
+
+        table_list.append({
+            "table_number": table_number,
+            "fields": [f"G{sequential_num + j}" for j in range(num_columns)]
+        })
+
+        sequential_num += num_columns
+
+    create_metadata_workbook(os.path.join(metadata_path, "Metadata_2021_GCP_DataPack_R1_R2.xlsx"), table_list)
+    logger.info(f"\t- metadata workbook created : {len(table_list)} tables, {sequential_num - 1} stats")
+
+    total_bytes = 0
+    num_files = 0
+
+    # add an Australia wide file for each table
+    boundaries = dict([(bdy, max(int(args.regions * scale), 1)) for bdy, scale in boundary_scales.items()])
+    boundaries["aus"] = 1
+
+    for bdy, num_regions in boundaries.items():
+        bdy_path = os.path.join(datapack_path, "2021 Census GCP All Geographies for AUS", bdy.upper(), "AUS")
+        os.makedirs(bdy_path)
+
+        for table_dict in table_list:
+            if bdy == "aus":
+                file_name = f"2021Census_{table_dict['table_number']}_AUS_AUS.csv"
+            else:
+                file_name = f"2021Census_{table_dict['table_number']}_AUST_{bdy.upper()}.csv"
+
+            file_path = os.path.join(bdy_path, file_name)
+            create_data_file(file_path, bdy, num_regions, table_dict["fields"], args.null_fraction)
+
+            total_bytes += os.path.getsize(file_path)
+            num_files += 1
+
+    logger.info(f"\t- {num_files} data files created : {total_bytes / 1048576.0:.1f}MB")
+
+    if args.zip:
+        shutil.make_archive(datapack_path, "zip", datapack_path)
+        shutil.rmtree(datapack_path)
+        logger.info(f"\t- DataPack zipped")
+
+    # describe the DataPack, so benchmark results can be compared like for like
+    with open(os.path.join(args.output_path, "datapack.json"), "w") as output_file:
+        json.dump({"tables": args.tables, "regions": args.regions, "columns": args.columns,
+                   "stats": sequential_num - 1, "files": num_files, "bytes": total_bytes,
+                   "null_fraction": args.null_fraction, "seed": args.seed, "zipped": args.zip}, output_file, indent=2)
+
+
+# creates a metadata workbook with the same layout as the ABS one - title rows above each worksheet's header row
+def create_metadata_workbook(file_path, table_list):
+    tables_rows = [["Australian Bureau of Statistics", None, None],
+                   ["2021 Census of Population and Housing - Synthetic DataPack", None, None],
+                   [None, None, None],
+                   ["Table Number", "Table Name", "Table Population"]]
+
+    stats_rows = [["Australian Bureau of Statistics", None, None, None, None, None],
+                  ["Cell Descriptors Information", None, None, None, None, None],
+                  [None, None, None, None, None, None],
+                  ["Sequential", "Short", "Long", "DataPack file", "Profile table",
+                   "Column heading description in profile"]]
+
+    for table_dict in table_list:
+        table_number = table_dict["table_number"]
+        tables_rows.append([table_number, f"Synthetic table {table_number}", "Persons"])
+
+        for field in table_dict["fields"]:
+            stats_rows.append([field, f"{field}_short", f"{field}_long_description", table_number, table_number,
+                               "Persons"])
+
+    with pandas.ExcelWriter(file_path) as writer:
+        pandas.DataFrame(tables_rows).to_excel(writer, sheet_name="Table Number, Name, Population",
+                                               header=False, index=False)
+        pandas.DataFrame(stats_rows).to_excel(writer, sheet_name="Cell Descriptors Information",
+                                              header=False, index=False)
+
+
+# creates a data file of small whole numbers (like most Census counts), with the occasional NULL ('..')
+def create_data_file(file_path, bdy, num_regions, fields, null_fraction):
+    with open(file_path, "w") as output_file:
+        output_file.write(f"{bdy.upper()}_CODE_2021," + ",".join([f"{field}_short" for field in fields]) + "\n")
+
+        for i in range(num_regions):
+            values = [".." if random.random() < null_fraction else str(random.randint(0, 500)) for field in fields]
+            output_file.write(f"{bdy.upper()}{i + 10000000}," + ",".join(values) + "\n")
+
+
+if __name__ == "__main__":
+    logger = logging.getLogger()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p")
+
+    main()
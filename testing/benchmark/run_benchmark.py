@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# run_benchmark.py
+# *********************************************************************************************************************
+#
+# Benchmarks load-census.py against a local Postgres database, across a range of --max-processes values and
+# loader modes
+#
+# Process:
+#   1. runs load-census.py for each combination of max processes & loader mode, into a scratch schema
+#   2. reads each run's load telemetry
+#   3. appends a result record for each run to a JSON Lines results file, for comparing runs over time
+#
+# Sample command line:
+#   python testing/benchmark/generate_datapack.py --output-path="/Users/$(whoami)/tmp/census_benchmark"
+#   python testing/benchmark/run_benchmark.py --processes=2,4,8 --modes=text,binary
+#       --census-data-path="/Users/$(whoami)/tmp/census_benchmark"
+#
+# *********************************************************************************************************************
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+
+from datetime import datetime
+
+# the census-loader directory
+loader_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..")
+
+# loader modes & the load-census.py arguments for each
+loader_modes = {
+    "text": ["--copy-format=text"],
+    "binary": ["--copy-format=binary"],
+    "async": ["--engine=async", "--copy-format=text"],
+    "async-binary": ["--engine=async", "--copy-format=binary"],
+    "staging": ["--staging"]
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks load-census.py across max processes & loader modes.")
+    parser.add_argument("--census-data-path", required=True,
+                        help="Path to the DataPack to load (e.g. created by generate_datapack.py).")
+    parser.add_argument("--processes", default="1,2,4,8",
+                        help="Comma separated list of --max-processes values to test. Defaults to 1,2,4,8.")
+    parser.add_argument("--modes", default="text,binary,async",
+                        help=f"Comma separated list of loader modes to test: {', '.join(loader_modes)}. "
+                             f"Defaults to text,binary,async.")
+    parser.add_argument("--runs", type=int, default=1,
+                        help="Number of times to run each combination. Defaults to 1.")
+    parser.add_argument("--results-file", default=os.path.join(loader_dir, "benchmark-results.jsonl"),
+                        help="JSON Lines file the results are appended to. "
+                             "Defaults to benchmark-results.jsonl in the census-loader directory.")
+    parser.add_argument("--data-schema", default="census_benchmark_data",
+                        help="Scratch schema to load into - it's overwritten. Defaults to 'census_benchmark_data'.")
+    parser.add_argument("--loader-args", default="",
+                        help="Extra arguments for load-census.py (e.g. Postgres connection parameters).")
+    args = parser.parse_args()
+
+    # describe the data & machine, so results are only compared like for like
+    datapack_file = os.path.join(args.census_data_path, "datapack.json")
+
+    if os.path.isfile(datapack_file):
+        with open(datapack_file, "r") as input_file:
+            datapack = json.load(input_file)
+    else:
+        datapack = {"path": args.census_data_path}
+
+    git_commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=loader_dir,
+                                capture_output=True, text=True).stdout.strip()
+
+    telemetry_file = os.path.join(loader_dir, "benchmark-telemetry.jsonl")
+
+    for mode in args.modes.split(","):
+        if mode not in loader_modes:
+            logger.fatal(f"Unknown loader mode : {mode}")
+            return False
+
+        for processes in [int(value) for value in args.processes.split(",")]:
+            for run in range(1, args.runs + 1):
+                cmd = [sys.executable, os.path.join(loader_dir, "load-census.py"),
+                       f"--census-data-path={args.census_data_path}",
+                       f"--max-processes={processes}",
+                       f"--data-schema={args.data_schema}",
+                       f"--telemetry-file={telemetry_file}"] + loader_modes[mode] + args.loader_args.split()
+
+                if os.path.isfile(telemetry_file):
+                    os.remove(telemetry_file)
+
+                start_time = datetime.now()
+                process = subprocess.run(cmd, capture_output=True, text=True)
+                elapsed = (datetime.now() - start_time).total_seconds()
+
+                result = {
+                    "timestamp": start_time.isoformat(timespec="seconds"),
+                    "git_commit": git_commit,
+                    "host": platform.node(),
+                    "cpu_count": os.cpu_count(),
+                    "datapack": datapack,
+                    "mode": mode,
+                    "engine": "async" if "--engine=async" in loader_modes[mode] else "process",
+                    "max_processes": processes,
+                    "run": run,
+                    "exit_code": process.returncode,
+                    "seconds": elapsed
+                }
+                result.update(summarise_telemetry(telemetry_file, elapsed))
+
+                with open(args.results_file, "a") as output_file:
+                    output_file.write(json.dumps(result) + "\n")
+
+                logger.info(f"{mode} ({result['engine']} engine) : {processes} processes : run {run} : "
+                            f"{elapsed:.1f}s : {result['mb_per_second']:.1f} MB/s : "
+                            f"{result['failed_files']} failed files")
+
+                if process.returncode != 0:
+                    logger.warning(process.stderr[-2000:])
+
+    if os.path.isfile(telemetry_file):
+        os.remove(telemetry_file)
+
+    logger.info(f"Results appended to {args.results_file}")
+
+    return True
+
+
+# summarises a run's load telemetry file
+def summarise_telemetry(telemetry_file, elapsed):
+    summary = {"files": 0, "failed_files": 0, "bytes": 0, "rows": 0, "mb_per_second": 0.0}
+
+    if not os.path.isfile(telemetry_file):
+        return summary
+
+    with open(telemetry_file, "r") as input_file:
+        record_list = [json.loads(line) for line in input_file if line.strip()]
+
+    summary["files"] = len(record_list)
+    summary["failed_files"] = len([record for record in record_list if record["result"] != "SUCCESS"])
+    summary["bytes"] = sum([record["bytes"] for record in record_list])
+    summary["rows"] = sum([record["rows"] for record in record_list])
+
+    # throughput of the whole run, including metadata & post load processing
+    if elapsed > 0.0:
+        summary["mb_per_second"] = summary["bytes"] / 1048576.0 / elapsed
+
+    for step in ["copy", "index", "cluster", "analyze"]:
+        summary[f"{step}_seconds"] = sum([record.get(f"{step}_seconds", 0.0) for record in record_list])
+
+    return summary
+
+
+if __name__ == "__main__":
+    logger = logging.getLogger()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p")
+
+    if not main():
+        sys.exit(1)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# *********************************************************************************************************************
+# test_run_pool_work.py
+# *********************************************************************************************************************
+#
+# Tests that a CSV load pool carries on when a hung worker process is ended while it holds a CSV buffer slot
+#
+# Run from the census-loader directory:
+#   python -m pytest testing
+#
+# *********************************************************************************************************************
+
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import utils  # noqa: E402
+
+
+# takes a buffer slot like a CSV chunk read - the first item to run hangs while holding it, until its process is ended
+def read_in_slot(args):
+    hang_file = args[0]
+
+    with utils.copy_buffer_slot():
+        if not os.path.exists(hang_file):
+            open(hang_file, "w").close()
+            time.sleep(120)
+
+    return "SUCCESS"
+
+
+def test_pool_finishes_after_ending_a_worker_holding_a_buffer_slot(tmp_path):
+    # a single slot - if the ended process's slot isn't given back, the other items can never take it
+    buffer_semaphore = multiprocessing.Semaphore(1)
+    manager = multiprocessing.Manager()
+    worker_states = manager.dict()
+
+    pool = multiprocessing.Pool(processes=2, initializer=utils.init_csv_import_worker,
+                                initargs=(buffer_semaphore, worker_states, dict()))
+
+    args_list = [[str(tmp_path / "hung")] for _ in range(4)]
+
+    result_list = utils.run_pool_work(
+        pool, read_in_slot, args_list, "test items", logging.getLogger(), 2, timeout=3,
+        worker_ended=lambda pid: utils.release_worker_slot(buffer_semaphore, worker_states, pid))
+
+    manager.shutdown()
+
+    assert os.path.exists(tmp_path / "hung")
+    assert result_list == ["SUCCESS"] * 4
+
+    # every slot has been given back
+    assert buffer_semaphore.acquire(timeout=1)
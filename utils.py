@@ -1,14 +1,123 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import io
+import asyncio
+import contextlib
+import hashlib
+import heapq
+import json
 import multiprocessing
+import multiprocessing.util
 import math
+import numpy  # installed with pandas
+import openpyxl  # module needs to be installed (for Excel file load)
 import os
 # import platform
 import psycopg
+import queue
+import re
+import shlex
+import shutil
+import sqlite3
+import struct
 import subprocess
 # import sys
+import tempfile
+import time
+import urllib.request
+import zipfile
+
+from datetime import datetime, timedelta
+
+# caching parsed metadata needs pyarrow - without it the metadata workbooks are parsed on every run
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# version of the metadata workbook parser - bump it when the parsing changes, so workbooks cached by the old parser
+#   are parsed again
+metadata_parser_version = 1
+
+# number of bytes read from a CSV file at a time when streaming it into Postgres
+csv_chunk_size = 1024 * 1024
+
+# blank lines (including whitespace only lines) inside a CSV file - removed when streaming it into Postgres
+blank_lines_regex = re.compile(rb"\n\s*\n")
+
+# limits the number of CSV chunks held in memory across all processes (set by the pool initializer)
+copy_buffer_semaphore = None
+
+# each worker process's Postgres connection - kept open for the life of the process and reused for every work item
+worker_pg_conn = None
+
+# total seconds the worker process has spent connecting - only grows when it connects for the first time or reconnects
+worker_connect_seconds = 0.0
+
+# settings applied to each worker process's connection when it connects (set by the pool initializer)
+worker_session_settings = dict()
+
+# session settings for the connections that load data - the load can be rerun, so commits don't wait for the WAL
+load_session_settings = {
+    "application_name": "census-loader",
+    "synchronous_commit": "off",
+    "statement_timeout": "0"
+}
+
+# number of times a work item is retried when its connection breaks, with an exponential backoff between them
+connection_retries = 3
+
+# how many times a failed work item is retried (with an exponential backoff), how long a work item can run before
+#   it's treated as hung & requeued, and how often progress is logged. Only errors that can clear up on their own are
+#   retried - a failed result (e.g. a CSV file with the wrong number of columns) would just fail again
+work_item_retries = 2
+work_item_timeout = 3600
+work_item_retry_errors = (psycopg.OperationalError, ConnectionError, TimeoutError)
+progress_seconds = 30.0
+
+# bytes of CSV data read by each process & whether it's waiting for or holding a CSV buffer slot, by process ID (set
+#   by the pool initializer) - measures throughput for auto tuning. A managed dictionary rather than a locked counter,
+#   so a hung process that's ended can't leave a lock held, and the parent can give back a buffer slot it held
+copy_worker_states = None
+
+# bytes of CSV data this process has read
+worker_bytes_read = 0
+
+# how often the number of load processes is tuned when auto tuning, and the change in throughput that counts as
+#   better or worse
+auto_tune_seconds = 10.0
+auto_tune_tolerance = 0.05
+
+# zip archives opened by this process - saves re-reading an archive's directory for every file in it
+zip_file_cache = dict()
+
+# the column a partitioned census table is partitioned on, holding each row's boundary type (e.g. sa1)
+partition_key_field = "boundary"
+
+# the Postgres types a stat column can be narrowed to by type inference, and their binary COPY encodings
+column_type_encodings = {
+    "smallint": ">i2",
+    "integer": ">i4",
+    "real": ">f4",
+    "double precision": ">f8"
+}
+
+# rows read from each CSV file to infer its column types in sample mode
+type_sample_rows = 10000
+
+# COPY statements for streaming CSV data into a table, for each COPY format
+copy_from_stdin_sql = {
+    "text": "COPY {table} FROM stdin WITH CSV HEADER DELIMITER as ',' NULL as '..'",
+    "binary": "COPY {table} FROM stdin WITH (FORMAT binary)"
+}
+
+# the size of a file the Postgres server can read (NULL if it can't find it)
+server_file_size_sql = "SELECT size FROM pg_stat_file(%s, true)"
+
+# Postgres binary COPY file header (signature, flags & header extension length) and trailer
+pg_copy_binary_header = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+pg_copy_binary_trailer = struct.pack(">h", -1)
 
 
 # calculates the area tolerance (in m2) for vector simplification using the Visvalingam-Whyatt algorithm
@@ -56,250 +165,1973 @@ def get_decimal_places(zoom_level):
     return places
 
 
-# takes a list of sql queries or command lines and runs them using multiprocessing
-def multiprocess_csv_import(work_list, max_concurrent_processes, pg_connect_string,
-                            data_schema, pg_user, region_id_field, logger):
+# runs a function for each item in a list of work item arguments using a multiprocessing pool, then closes the pool.
+#   Results are collected as they finish, with progress, throughput & ETA logged as it goes:
+#     - items are started in list order (e.g. biggest first), with up to max_running running at once. max_running is
+#       a number, or a function of the number of items waiting that returns one (e.g. to tune it during the run)
+#     - items that fail with a transient exception (e.g. a dropped connection) are retried after an exponential
+#       backoff. Failed results & other exceptions are final
+#     - items running longer than the timeout are treated as hung - their process is ended & they're requeued. An item
+#       whose process can't be ended isn't requeued, so it can't run twice at once
+#     - items that still fail are listed at the end
+#   names identify each item in the log; sizes (in bytes) are used to report throughput. failed_result converts an
+#   item's arguments & error message to a failed result, for items that end with an exception or timeout.
+#   feed is an optional queue of lists of work to add while running, ended with None - get_feed_item converts each
+#   one to its arguments, name & size. worker_ended is called with the process ID of each hung item's process once
+#   it's ended (e.g. to give back what it held). Returns the final result of each item, in the order they finished
+def run_pool_work(pool, function, args_list, description, logger, max_running, names=None, sizes=None,
+                  failed_result=None, timeout=work_item_timeout, retries=work_item_retries, feed=None,
+                  get_feed_item=None, worker_ended=None):
+    args_list = list(args_list)
+    num_items = len(args_list)
+    names = list(names) if names else [str(args)[:100] for args in args_list]
+    sizes = list(sizes) if sizes is not None else None
+    done_queue = queue.Queue()
+
+    # each item's worker process & start time, so a hung item's process can be found & ended
+    manager = multiprocessing.Manager()
+    started_items = manager.dict()
+
+    waiting = list(range(num_items))
+    ready_times = dict()
+    attempts = [0] * num_items
+    running = dict()
+    submission_items = dict()
+    final_results = dict()
+    result_list = list()
+    hung_items = False
+
+    start_time = time.monotonic()
+    progress_time = start_time
+    done_bytes = 0
+
+    while len(final_results) < num_items or feed is not None:
+        # add the work fed in while running (e.g. files as they're downloaded) - a None batch ends the feed
+        while feed is not None:
+            try:
+                batch = feed.get_nowait()
+            except queue.Empty:
+                break
+
+            if batch is None:
+                feed = None
+                break
+
+            for work in batch:
+                args, name, size = get_feed_item(work)
+
+                args_list.append(args)
+                names.append(name)
+                attempts.append(0)
+                waiting.append(num_items)
+                num_items += 1
+
+                if sizes is not None:
+                    sizes.append(size)
+
+        now = time.monotonic()
+        limit = max_running(len(waiting)) if callable(max_running) else max_running
+
+        # start items in list order, skipping retries that are still backing off
+        while len(running) < limit:
+            index = next((i for i in waiting if ready_times.get(i, 0.0) <= now), None)
+
+            if index is None:
+                break
+
+            waiting.remove(index)
+            attempts[index] += 1
+
+            submission = len(submission_items)
+            submission_items[submission] = index
+            running[submission] = now
+
+            pool.apply_async(run_pool_item, ((function, args_list[index], started_items, submission),),
+                             callback=lambda result, sub=submission: done_queue.put((sub, result)),
+                             error_callback=lambda ex, sub=submission: done_queue.put((sub, ex)))
+
+        # wait for an item to finish, waking up regularly to check for hung items & log progress
+        try:
+            submission, result = done_queue.get(timeout=1.0)
+        except queue.Empty:
+            submission, result = None, None
+
+        finished = list()
+
+        if submission is not None:
+            running.pop(submission, None)
+            finished.append((submission_items[submission], result))
+
+        # end the processes of hung items & requeue them - items still waiting in the pool aren't hung
+        if timeout and len(running) > 0:
+            started_dict = dict(started_items)
+
+            for submission in list(running):
+                pid, start = started_dict.get(submission, (None, None))
+
+                if start is not None and time.time() - start > timeout:
+                    del running[submission]
+                    hung_items = True
+
+                    if end_worker_process(pid):
+                        result = TimeoutError(f"no result after {timeout}s - its process was ended")
+
+                        if worker_ended is not None:
+                            worker_ended(pid)
+                    else:
+                        result = RuntimeError(f"no result after {timeout}s and its process couldn't be ended")
 
-    pool = multiprocessing.Pool(processes=max_concurrent_processes)
+                    finished.append((submission_items[submission], result))
 
-    num_jobs = len(work_list)
+        for index, result in finished:
+            # the item's already finished (e.g. a hung item whose process couldn't be ended turned up later)
+            if index in final_results:
+                continue
 
-    results = pool.imap_unordered(run_csv_import_multiprocessing,
-                                  [[w, pg_connect_string, data_schema, pg_user, region_id_field] for w in work_list])
+            message = get_result_message(result)
+
+            if message == "SUCCESS":
+                final_results[index] = result
+
+                if index in waiting:
+                    waiting.remove(index)
+            elif index in waiting or index in [submission_items[sub] for sub in running]:
+                # already requeued, or being retried
+                pass
+            elif isinstance(result, work_item_retry_errors) and attempts[index] <= retries:
+                backoff = 2 ** attempts[index]
+                ready_times[index] = time.monotonic() + backoff
+                waiting.append(index)
+
+                logger.warning(f"\t- {names[index]} failed - retrying in {backoff}s : {message}")
+            else:
+                if isinstance(result, Exception) and failed_result is not None:
+                    result = failed_result(args_list[index], message)
+
+                final_results[index] = result
+
+            if index in final_results:
+                result_list.append(final_results[index])
+
+                if sizes is not None:
+                    done_bytes += sizes[index]
+
+        # log progress, throughput & the estimated time left
+        now = time.monotonic()
+
+        if now - progress_time >= progress_seconds and len(final_results) < num_items:
+            progress_time = now
+            elapsed = now - start_time
+
+            if sizes is not None and done_bytes > 0:
+                rate = done_bytes / elapsed
+                eta = (sum(sizes) - done_bytes) / rate
+                throughput = f"{rate / 1048576.0:.1f} MB/s"
+            elif len(final_results) > 0:
+                rate = len(final_results) / elapsed
+                eta = (num_items - len(final_results)) / rate
+                throughput = f"{rate * 60.0:.1f} per minute"
+            else:
+                eta = None
+                throughput = "-"
+
+            logger.info(f"\t- {description} : {len(final_results)} of {num_items} done : {throughput} : ETA "
+                        f"{timedelta(seconds=int(eta)) if eta is not None else '-'}")
+
+    # hung processes would stop the pool closing
+    if hung_items:
+        pool.terminate()
+    else:
+        pool.close()
 
-    pool.close()
     pool.join()
+    manager.shutdown()
 
-    result_list = list(results)
-    num_results = len(result_list)
+    log_work_failures(description, [(names[index], get_result_message(result))
+                                    for index, result in final_results.items()
+                                    if get_result_message(result) != "SUCCESS"], num_items, logger)
 
-    if num_jobs > num_results:
-        logger.warning("\t- A MULTIPROCESSING PROCESS FAILED WITHOUT AN ERROR\nACTION: Check the record counts")
+    return result_list
 
-    for result in result_list:
-        if result != "SUCCESS":
-            logger.info(result)
 
+# runs a pool work item, after recording its worker process & start time so it can be ended if it hangs
+def run_pool_item(item):
+    function, args, started_items, submission = item
+    started_items[submission] = (os.getpid(), time.time())
 
-def run_csv_import_multiprocessing(args):
-    file_dict = args[0]
-    pg_connect_string = args[1]
-    data_schema = args[2]
-    pg_user = args[3]
-    region_id_field = args[4]
+    return function(args)
 
-    pg_conn = psycopg.connect(pg_connect_string)
-    pg_conn.autocommit = True
-    pg_cur = pg_conn.cursor()
 
-    # CREATE TABLE
+# ends a hung work item's worker process - the pool starts a new one in its place. Returns whether it's ended
+def end_worker_process(pid, wait_seconds=10.0):
+    process = next((process for process in multiprocessing.active_children() if process.pid == pid), None)
+
+    if process is None:
+        return True
+
+    process.terminate()
+    process.join(wait_seconds)
+
+    return not process.is_alive()
+
+
+# a work item's result message - results are a message, a dictionary with a result message, or an exception
+def get_result_message(result):
+    if isinstance(result, Exception):
+        return f"{type(result).__name__} : {result}"
+    elif isinstance(result, dict):
+        return result["result"]
+    else:
+        return result
+
+
+# logs the work items that failed, so it's clear what needs attention
+def log_work_failures(description, failure_list, num_items, logger):
+    if len(failure_list) == 0:
+        return
+
+    logger.warning(f"\t- {len(failure_list)} of {num_items} {description} FAILED :")
+
+    for name, message in failure_list:
+        logger.warning(f"\t\t- {name} : {message}")
+
+
+# loads a list of CSV files using multiprocessing. With auto_tune, max_concurrent_processes is a ceiling - the number of
+#   files loading at once is tuned during the load using the measured throughput across all processes. Files can also
+#   be added during the load by putting lists of them on a feed queue (ended with None)
+def multiprocess_csv_import(work_list, max_concurrent_processes, auto_tune, max_buffer_mb, copy_format,
+                            server_side_copy, unlogged, pg_connect_string, data_schema, pg_user, region_id_field,
+                            timeout, logger, feed=None):
+
+    # backpressure - the number of chunks that can be in flight across all processes at any one time
+    buffer_slots = max(int(max_buffer_mb * 1024 * 1024 / csv_chunk_size), 1)
+    buffer_semaphore = multiprocessing.Semaphore(buffer_slots)
+
+    # each process's bytes read & buffer slot state - see copy_worker_states
+    manager = multiprocessing.Manager()
+    worker_states = manager.dict()
+
+    if buffer_slots < max_concurrent_processes:
+        logger.warning(f"\t- NOTICE: CSV buffer limit of {max_buffer_mb}MB is less than 1MB per process "
+                       f"- processes will wait on each other")
+
+    pool = multiprocessing.Pool(processes=max_concurrent_processes,
+                                initializer=init_csv_import_worker,
+                                initargs=(buffer_semaphore, worker_states, load_session_settings))
+
+    # auto tuning starts halfway to the ceiling & climbs (or backs off) from there
+    tuning = {
+        "num_processes": max(max_concurrent_processes // 2, 1) if auto_tune else max_concurrent_processes,
+        "direction": 1,
+        "previous_rate": None,
+        "bytes": 0,
+        "time": time.monotonic()
+    }
+
+    # tunes the number of processes while there are files waiting - the throughput drops as the last files finish
+    def get_num_processes(num_waiting):
+        now = time.monotonic()
+
+        if auto_tune and num_waiting > 0 and now - tuning["time"] >= auto_tune_seconds:
+            bytes_read = sum([state[0] for state in worker_states.values()])
+            rate = (bytes_read - tuning["bytes"]) / 1048576.0 / (now - tuning["time"])
+
+            num_processes, tuning["direction"], tuning["previous_rate"] = tune_process_count(
+                tuning["num_processes"], tuning["direction"], rate, tuning["previous_rate"], max_concurrent_processes)
+
+            if num_processes != tuning["num_processes"]:
+                logger.info(f"\t- auto tune : {rate:.1f} MB/s with {tuning['num_processes']} processes "
+                            f"- changing to {num_processes}")
+
+            tuning["num_processes"] = num_processes
+            tuning["bytes"] = bytes_read
+            tuning["time"] = now
+
+        return tuning["num_processes"]
+
+    # a file's worker arguments, name & size
+    def get_work_item(w):
+        return ([w, copy_format, server_side_copy, unlogged, pg_connect_string, data_schema, pg_user,
+                 region_id_field], w["table_name"], w["bytes"])
+
+    # hand out one file at a time so the work list order (e.g. biggest first) is kept
+    result_list = run_pool_work(pool, run_csv_import_multiprocessing, [get_work_item(w)[0] for w in work_list],
+                                "CSV files", logger, get_num_processes,
+                                names=[w["table_name"] for w in work_list], sizes=[w["bytes"] for w in work_list],
+                                failed_result=get_failed_load_record, timeout=timeout, feed=feed,
+                                get_feed_item=get_work_item,
+                                worker_ended=lambda pid: release_worker_slot(buffer_semaphore, worker_states, pid))
+
+    manager.shutdown()
+
+    if auto_tune:
+        logger.info(f"\t- auto tune : finished with {tuning['num_processes']} of a maximum "
+                    f"{max_concurrent_processes} processes")
+
+    return result_list
+
+
+# gives back the buffer slot a hung file's process was waiting for or holding when it was ended. Giving back a slot it
+#   was still waiting for only adds a slot - losing one would leave the other processes waiting for it
+def release_worker_slot(buffer_semaphore, worker_states, pid):
+    bytes_read, holding_slot = worker_states.get(pid, (0, False))
+
+    if holding_slot:
+        worker_states[pid] = (bytes_read, False)
+        buffer_semaphore.release()
+
+
+# a telemetry record for a CSV file that failed to load without a result (e.g. its process was killed)
+def get_failed_load_record(args, message):
+    record = get_load_record(args[0])
+    record["result"] = f"IMPORT CSV INTO POSTGRES FAILED! : {args[0]['path']} : {message}"
+
+    return record
+
+
+# hill climbs the number of processes towards the best throughput: keeps adding (or removing) processes while
+#   throughput improves, undoes the last change if it made throughput worse and holds when throughput doesn't change.
+#   A direction of 0 is holding. Returns the new number of processes & direction, and the throughput to compare the
+#   next measurement with
+def tune_process_count(num_processes, direction, rate, previous_rate, max_processes):
+    if previous_rate is None:
+        direction = 1
+    elif rate > previous_rate * (1.0 + auto_tune_tolerance):
+        # better - keep going, or start adding processes again if holding (e.g. onto files that load faster)
+        direction = direction or 1
+    elif rate < previous_rate * (1.0 - auto_tune_tolerance):
+        # worse after a change - undo it, back to the previous throughput
+        if direction != 0:
+            return min(max(num_processes - direction, 1), max_processes), 0, previous_rate
+
+        # worse while holding (e.g. other work on the server) - try fewer processes
+        direction = -1
+    else:
+        return num_processes, 0, rate
+
+    return min(max(num_processes + direction, 1), max_processes), direction, rate
+
+
+# creates the table that records each loaded file - used to resume a failed load or only reload changed files
+def create_manifest_table(pg_cur, data_schema, pg_user):
+    pg_cur.execute(f"""CREATE TABLE IF NOT EXISTS {data_schema}.load_manifest (
+                           file_path text PRIMARY KEY,
+                           file_size bigint,
+                           file_mtime double precision,
+                           file_hash text,
+                           table_name text,
+                           row_count bigint,
+                           status text,
+                           loaded_at timestamp with time zone
+                       ) WITH (OIDS=FALSE);
+                       ALTER TABLE {data_schema}.load_manifest OWNER TO {pg_user}""")
+
+
+# creates the table that records the column types inferred for each data table's stats (if it doesn't exist)
+def create_column_types_table(pg_cur, data_schema, pg_user):
+    pg_cur.execute(f"""CREATE TABLE IF NOT EXISTS {data_schema}.metadata_column_types (
+                           table_name text,
+                           field text,
+                           data_type text,
+                           PRIMARY KEY (table_name, field)
+                       ) WITH (OIDS=FALSE);
+                       ALTER TABLE {data_schema}.metadata_column_types OWNER TO {pg_user}""")
+
+
+# returns the manifest as a dictionary of manifest entries keyed by file path
+def get_manifest(pg_cur, data_schema):
+    pg_cur.execute(f"""SELECT file_path, file_size, file_mtime, file_hash, table_name, row_count, status
+                       FROM {data_schema}.load_manifest""")
+
+    manifest = dict()
+
+    for row in pg_cur.fetchall():
+        manifest[row[0]] = {
+            "file_size": row[1],
+            "file_mtime": row[2],
+            "file_hash": row[3],
+            "table_name": row[4],
+            "row_count": row[5],
+            "status": row[6]
+        }
+
+    return manifest
+
+
+# adds or updates a file's manifest entry
+def update_manifest(pg_cur, data_schema, file_dict, status, file_hash=None, row_count=None):
+    pg_cur.execute(*get_manifest_update(data_schema, file_dict, status, file_hash, row_count))
+
+
+# returns the SQL & parameters to add or update a file's manifest entry
+def get_manifest_update(data_schema, file_dict, status, file_hash=None, row_count=None):
+    return (f"""INSERT INTO {data_schema}.load_manifest AS man
+                    (file_path, file_size, file_mtime, file_hash, table_name, row_count, status, loaded_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, now())
+                ON CONFLICT (file_path) DO UPDATE
+                    SET file_size = EXCLUDED.file_size,
+                        file_mtime = EXCLUDED.file_mtime,
+                        file_hash = EXCLUDED.file_hash,
+                        table_name = EXCLUDED.table_name,
+                        row_count = EXCLUDED.row_count,
+                        status = EXCLUDED.status,
+                        loaded_at = EXCLUDED.loaded_at""",
+            (file_dict["path"], file_dict["bytes"], file_dict["mtime"], file_hash, file_dict["table_name"],
+             row_count, status))
+
+
+# returns a list of the files in a directory (or a zip file), including the files inside any zip files
+#   - files inside a zip file are read directly from the zip file; they don't need to be extracted
+def get_source_files(source_path):
+    file_list = list()
+
+    if os.path.isfile(source_path):
+        path_list = [source_path]
+    else:
+        path_list = [os.path.join(root, file_name)
+                     for root, dirs, files in os.walk(source_path) for file_name in files]
+
+    for file_path in path_list:
+        if file_path.lower().endswith(".zip"):
+            with zipfile.ZipFile(file_path) as zip_file:
+                for zip_info in zip_file.infolist():
+                    if not zip_info.is_dir():
+                        file_list.append({
+                            "name": os.path.basename(zip_info.filename),
+                            "path": os.path.join(file_path, zip_info.filename),
+                            "zip_path": file_path,
+                            "member": zip_info.filename,
+                            "bytes": zip_info.file_size,
+                            "mtime": time.mktime(zip_info.date_time + (0, 0, -1))
+                        })
+        else:
+            file_stats = os.stat(file_path)
+
+            file_list.append({
+                "name": os.path.basename(file_path),
+                "path": file_path,
+                "bytes": file_stats.st_size,
+                "mtime": file_stats.st_mtime
+            })
+
+    return file_list
+
+
+# downloads a file from a web server, or copies it from a local directory (e.g. for testing offline), into the target
+#   directory. It's written to a temporary file first, so a part downloaded file is never mistaken for a whole one
+def download_file(source, file_name, target_directory):
+    file_path = os.path.join(target_directory, file_name)
+    part_file_path = file_path + ".part"
+
+    if source.lower().startswith(("http://", "https://")):
+        with urllib.request.urlopen(f"{source.rstrip('/')}/{file_name}") as response:
+            with open(part_file_path, "wb") as output_file:
+                shutil.copyfileobj(response, output_file, csv_chunk_size)
+    else:
+        shutil.copyfile(os.path.join(source, file_name), part_file_path)
+
+    os.replace(part_file_path, file_path)
+
+    return file_path
+
+
+# maps a local data file's path to the path the Postgres server sees it at (e.g. a Docker volume mount)
+def get_server_path(file_path, data_directory, server_directory):
+    if not server_directory:
+        return file_path
+
+    relative_path = os.path.relpath(file_path, data_directory).replace("\\", "/")
+
+    return server_directory.rstrip("/\\") + "/" + relative_path
+
+
+# opens a source file, or a file inside a zip file, for reading bytes
+@contextlib.contextmanager
+def open_source_file(file_dict):
+    if file_dict.get("member") is None:
+        with open(file_dict["path"], "rb") as source_file:
+            yield source_file
+    else:
+        zip_file = zip_file_cache.get(file_dict["zip_path"])
+
+        if zip_file is None:
+            zip_file = zipfile.ZipFile(file_dict["zip_path"])
+            zip_file_cache[file_dict["zip_path"]] = zip_file
+
+        with zip_file.open(file_dict["member"]) as source_file:
+            yield source_file
+
+
+def get_file_hash(file_dict):
+    file_hash = hashlib.sha256()
+
+    with open_source_file(file_dict) as source_file:
+        while chunk := source_file.read(csv_chunk_size):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+# has a file been fully loaded and not changed since? The hash is only checked if the file's been touched - if it
+#   matches, the new modified time is saved in the manifest so the file isn't hashed again next time
+def is_file_unchanged(pg_cur, data_schema, file_dict, manifest_entry):
+    if manifest_entry is None or manifest_entry["status"] != "loaded":
+        return False
+
+    if manifest_entry["file_size"] != file_dict["bytes"]:
+        return False
+
+    if manifest_entry["file_mtime"] == file_dict["mtime"]:
+        return True
+
+    if manifest_entry["file_hash"] is None or manifest_entry["file_hash"] != get_file_hash(file_dict):
+        return False
+
+    pg_cur.execute(f"UPDATE {data_schema}.load_manifest SET file_mtime = %s WHERE file_path = %s",
+                   (file_dict["mtime"], file_dict["path"]))
+    manifest_entry["file_mtime"] = file_dict["mtime"]
+
+    return True
+
+
+# reads the metadata worksheets from a Census metadata workbook - returns a list of rows for each metadata table.
+#   Only the worksheets needed are parsed, a row at a time. Rows above each worksheet's header row, the header row,
+#   empty rows and excess columns are dropped
+def read_metadata_workbook(workbook_file, metadata_dicts):
+    workbook = openpyxl.load_workbook(workbook_file, read_only=True, data_only=True)
+    metadata = dict()
+
+    for worksheet, table_dict in zip(workbook.worksheets, metadata_dicts):
+        num_columns = table_dict["num_columns"]
+        rows = list()
+        found_first_row = False
+
+        for row in worksheet.iter_rows(values_only=True):
+            if not found_first_row:
+                found_first_row = len(row) > 0 and str(row[0]).lower() == table_dict["first_row"]
+            elif any([value is not None for value in row]):
+                row = [None if value is None else str(value) for value in row[:num_columns]]
+                rows.append(row + [None] * (num_columns - len(row)))
+
+        metadata[table_dict["table"]] = rows
+
+    workbook.close()
+
+    return metadata
 
-    # get the census fields to use in the create table statement
+
+# returns the parsed metadata for a workbook from the Parquet cache, or None if it isn't cached (with the same parser
+#   version & parse settings)
+def get_cached_metadata(cache_dir, file_hash, metadata_dicts):
+    if pyarrow is None or not cache_dir:
+        return None
+
+    metadata = dict()
+
+    for table_dict in metadata_dicts:
+        cache_file = get_metadata_cache_file(cache_dir, file_hash, metadata_dicts, table_dict)
+
+        if not os.path.isfile(cache_file):
+            return None
+
+        table = pyarrow.parquet.read_table(cache_file)
+        metadata[table_dict["table"]] = [list(row) for row in zip(*[column.to_pylist() for column in table.columns])]
+
+    return metadata
+
+
+# returns the Parquet cache file for a metadata table parsed from a workbook. It's keyed by the workbook's hash, the
+#   parser version & the parse settings (each worksheet's table, header row & number of columns), so changing any of
+#   them parses the workbook again instead of using a stale cache
+def get_metadata_cache_file(cache_dir, file_hash, metadata_dicts, table_dict):
+    parse_config = json.dumps([metadata_parser_version, metadata_dicts], sort_keys=True)
+    config_hash = hashlib.sha256(parse_config.encode("utf-8")).hexdigest()[:12]
+
+    return os.path.join(cache_dir, f"{file_hash}_{config_hash}_{table_dict['table']}.parquet")
+
+
+# saves parsed metadata to the Parquet cache, keyed by the workbook's hash & parse settings - written to a temp file
+#   & renamed so a failed write doesn't leave a corrupt cache file
+def cache_metadata(cache_dir, file_hash, metadata, metadata_dicts):
+    if pyarrow is None or not cache_dir:
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    for table_dict in metadata_dicts:
+        rows = metadata[table_dict["table"]]
+        columns = dict([(f"column_{i}", pyarrow.array([row[i] for row in rows], type=pyarrow.string()))
+                        for i in range(table_dict["num_columns"])])
+
+        cache_file = get_metadata_cache_file(cache_dir, file_hash, metadata_dicts, table_dict)
+        pyarrow.parquet.write_table(pyarrow.table(columns), cache_file + ".tmp")
+        os.replace(cache_file + ".tmp", cache_file)
+
+
+# returns a dictionary of each census table number and its fields, ordered by sequential_id (required to match
+#   field names with the right data)
+def get_table_fields(pg_cur, data_schema):
+    pg_cur.execute(f"""SELECT lower(table_number), lower(sequential_id)
+                       FROM {data_schema}.metadata_stats
+                       ORDER BY table_number, right(sequential_id, length(sequential_id) - 1)::integer""")
+
+    table_fields = dict()
+
+    for table_number, field in pg_cur.fetchall():
+        table_fields.setdefault(table_number, list()).append(field)
+
+    return table_fields
+
+
+# returns the fields for a data file's table - includes all of its parts (e.g. G04 = G04A + G04B)
+def get_fields_for_table(table_fields, table):
     field_list = list()
 
-    # select the field ordered by sequential_id (required to match field names with the right data)
-    sql = f"""SELECT sequential_id || ' double precision' AS field
-              FROM {data_schema}.metadata_stats
-              WHERE lower(table_number) LIKE '{file_dict["table"]}%'
-              ORDER BY table_number, right(sequential_id, length(sequential_id) - 1)::integer"""
-    pg_cur.execute(sql)
+    for table_number, fields in table_fields.items():
+        if table_number.startswith(table):
+            field_list.extend(fields)
+
+    return field_list
+
+
+# returns the column names in the header row of a CSV file
+def read_csv_header(file_dict):
+    with open_source_file(file_dict) as csv_file:
+        header = csv_file.readline()
+
+    return header.decode("utf-8").strip().replace(" ", "").split(",")
+
+
+# load cost estimators - return the relative cost of loading a file (only the ratios between files matter)
+def estimate_cost_by_size(file_dict):
+    return file_dict["bytes"]
+
+
+def estimate_cost_by_size_and_columns(file_dict):
+    return file_dict["bytes"] * (len(file_dict["fields"]) + 1)
+
+
+cost_estimators = {
+    "size": estimate_cost_by_size,
+    "size-columns": estimate_cost_by_size_and_columns
+}
+
+
+# simulates the jobs being handed out, in order, to the next free process and returns the total cost of the
+#   busiest process (i.e. the makespan)
+def get_makespan(cost_list, max_concurrent_processes):
+    process_costs = [0.0] * max_concurrent_processes
+
+    for cost in cost_list:
+        heapq.heapreplace(process_costs, process_costs[0] + cost)
+
+    return max(process_costs)
+
+
+# pool initializer - sets the session settings for the worker process's connection & closes it when the process ends
+def init_worker(session_settings):
+    global worker_session_settings
+    worker_session_settings = session_settings
+
+    multiprocessing.util.Finalize(None, close_worker_connection, exitpriority=10)
+
+
+# returns this worker process's connection - connects if it isn't connected yet or the connection has broken
+def get_worker_connection(pg_connect_string):
+    global worker_pg_conn
+    global worker_connect_seconds
+
+    if worker_pg_conn is None or worker_pg_conn.closed or worker_pg_conn.broken:
+        worker_pg_conn = None
+        start_time = datetime.now()
+        pg_conn = psycopg.connect(pg_connect_string, autocommit=True)
+
+        with pg_conn.cursor() as pg_cur:
+            for name, value in worker_session_settings.items():
+                pg_cur.execute("SELECT set_config(%s, %s, false)", (name, str(value)))
+
+        worker_pg_conn = pg_conn
+        worker_connect_seconds += (datetime.now() - start_time).total_seconds()
+
+    return worker_pg_conn
+
+
+def close_worker_connection():
+    global worker_pg_conn
+
+    if worker_pg_conn is not None:
+        worker_pg_conn.close()
+        worker_pg_conn = None
+
+
+# runs function(pg_conn, *args) using this worker process's connection. If the connection breaks (e.g. a network
+#   drop or a server restart) it reconnects & runs the function again, after a backoff. Errors that don't break
+#   the connection aren't retried
+def run_with_worker_connection(pg_connect_string, function, *args):
+    for attempt in range(connection_retries + 1):
+        try:
+            return function(get_worker_connection(pg_connect_string), *args)
+        except psycopg.OperationalError:
+            if attempt == connection_retries or (worker_pg_conn is not None and not worker_pg_conn.broken):
+                raise
+
+        time.sleep(2 ** attempt)
+
+
+# shares the CSV buffer semaphore & the processes' bytes read & buffer slot states with each process in the pool
+def init_csv_import_worker(buffer_semaphore, worker_states, session_settings):
+    global copy_buffer_semaphore
+    global copy_worker_states
+    copy_buffer_semaphore = buffer_semaphore
+    copy_worker_states = worker_states
+
+    init_worker(session_settings)
+
+
+# reads a CSV file in fixed size chunks, removing spaces, blank lines and rogue non-ascii characters on the fly
+#   - memory use is limited to a chunk or two, regardless of the size of the file
+#   - leading & trailing whitespace of the whole file is removed; whitespace at the end of a chunk is held back
+#     until the next chunk shows whether it's inside the data or at the end of the file (or a blank line)
+def clean_csv_chunks(csv_file, chunk_size=csv_chunk_size, file_hash=None, count_bytes=True):
+    global worker_bytes_read
+
+    held_back = b""
+    at_start = True
+
+    while chunk := csv_file.read(chunk_size):
+        # hash the raw bytes for the load manifest
+        if file_hash is not None:
+            file_hash.update(chunk)
+
+        # counted for auto tuning - shared with the pool's parent when the buffer slot is given back
+        if count_bytes:
+            worker_bytes_read += len(chunk)
+
+        chunk = chunk.translate(None, b" \x1A")
 
-    fields = pg_cur.fetchall()
+        if at_start:
+            chunk = chunk.lstrip()
 
-    for field in fields:
-        field_list.append(field[0].lower())
+            if not chunk:
+                continue
 
-    fields_string = ",".join(field_list)
+            at_start = False
 
-    # create the table
-    table_name = file_dict["boundary"] + "_" + file_dict["table"]
+        data = chunk.rstrip()
+
+        if data:
+            yield blank_lines_regex.sub(b"\n", held_back + data)
+            held_back = chunk[len(data):]
+        else:
+            held_back += chunk
 
-    create_table_sql = f"""DROP TABLE IF EXISTS {data_schema}.{table_name} CASCADE;
-                           CREATE TABLE {data_schema}.{table_name} (
-                               {region_id_field} text,
-                               {fields_string}
-                           ) WITH (OIDS=FALSE);
-                           ALTER TABLE {data_schema}.{table_name} OWNER TO {pg_user}"""
-    pg_cur.execute(create_table_sql)
 
-    # IMPORT CSV FILE
+# waits for space in the shared CSV buffer & holds it while a chunk's read (no limit when running outside a pool). The
+#   slot's marked as taken before waiting for it & unmarked after it's given back, so if a hung process is ended
+#   while it's reading, the pool's parent can always give its slot back
+@contextlib.contextmanager
+def copy_buffer_slot():
+    if copy_buffer_semaphore is None:
+        yield
+        return
+
+    set_copy_worker_state(True)
 
     try:
-        # read CSV into a string
-        raw_string = open(file_dict["path"], 'r').read()
+        with copy_buffer_semaphore:
+            yield
+    finally:
+        set_copy_worker_state(False)
 
-        # clean whitespace and rogue non-ascii characters
-        clean_string = raw_string.lstrip().rstrip().replace(" ", "").replace("\x1A", "")
 
-        # convert to in memory stream
-        csv_file = io.StringIO(clean_string)
-        csv_file.seek(0)  # move position back to beginning of file before reading
+# shares this process's bytes read & whether it's waiting for or holding a buffer slot with the pool's parent
+def set_copy_worker_state(holding_slot):
+    if copy_worker_states is not None:
+        copy_worker_states[os.getpid()] = (worker_bytes_read, holding_slot)
 
-        # import into Postgres
-        sql = f"COPY {data_schema}.{table_name} FROM stdin WITH CSV HEADER DELIMITER as ',' NULL as '..'"
-        with pg_cur.copy(sql) as copy:
-            while data := csv_file.read():
-                copy.write(data)
 
-    except Exception as ex:
-        return f"IMPORT CSV INTO POSTGRES FAILED! : {file_dict['path']} : {ex}"
+# counts a file the Postgres server read itself as read by this process, for auto tuning
+def count_server_copy_bytes(num_bytes):
+    global worker_bytes_read
+    worker_bytes_read += num_bytes
 
-    # add primary key and vacuum index
-    sql = f"""ALTER TABLE {data_schema}.{table_name} ADD CONSTRAINT {table_name}_pkey PRIMARY KEY ({region_id_field});
-              ALTER TABLE {data_schema}.{table_name} CLUSTER ON {table_name}_pkey"""
-    pg_cur.execute(sql)
+    set_copy_worker_state(False)
+
+
+# splits cleaned CSV chunks into lists of complete lines
+def csv_line_batches(chunks):
+    partial = b""
+
+    for data in chunks:
+        lines = (partial + data).split(b"\n")
+        partial = lines.pop()
+
+        if lines:
+            yield lines
+
+    if partial:
+        yield [partial]
+
+
+# parses a list of CSV lines into a 2D array of cells (as bytes)
+def csv_lines_to_cells(lines, num_columns):
+    text = b",".join(lines).replace(b"\r", b"")
+
+    if b'"' in text:
+        raise ValueError("quoted CSV values aren't supported by binary COPY")
+
+    cells = numpy.array(text.split(b","))
+
+    if cells.size != len(lines) * num_columns:
+        raise ValueError(f"CSV rows don't all have {num_columns} columns")
+
+    return cells.reshape(len(lines), num_columns)
+
+
+# parses a list of CSV lines into an array of region ids and a 2D float64 array of stats (NULL stats are NaN)
+def csv_lines_to_arrays(lines, num_columns):
+    cells = csv_lines_to_cells(lines, num_columns)
+
+    region_ids = numpy.ascontiguousarray(cells[:, 0])
+    nulls = (cells[:, 1:] == b"..") | (cells[:, 1:] == b"")
+    values = numpy.where(nulls, b"nan", cells[:, 1:]).astype(numpy.float64)
+
+    return region_ids, values, nulls
+
+
+# encodes rows of a text region id and float8 stats as Postgres binary COPY tuples without looping over rows
+#   - each row is built at a fixed width, then the padding after the region id and the value bytes of NULL
+#     stats are masked out
+def encode_pg_copy_binary(region_ids, values, nulls):
+    num_rows, num_values = values.shape
+    id_width = region_ids.dtype.itemsize
+    id_lengths = numpy.char.str_len(region_ids)
+    values_start = 6 + id_width
+    row_width = values_start + num_values * 12
+
+    rows = numpy.zeros((num_rows, row_width), dtype=numpy.uint8)
+    rows[:, 0:2] = numpy.frombuffer(struct.pack(">h", num_values + 1), dtype=numpy.uint8)
+    rows[:, 2:6] = id_lengths.astype(">i4").view(numpy.uint8).reshape(num_rows, 4)
+    rows[:, 6:values_start] = region_ids.view(numpy.uint8).reshape(num_rows, id_width)
+
+    fields = numpy.empty((num_rows, num_values), dtype=[("length", ">i4"), ("value", ">f8")])
+    fields["length"] = numpy.where(nulls, -1, 8)
+    fields["value"] = values
+    rows[:, values_start:] = fields.view(numpy.uint8).reshape(num_rows, num_values * 12)
+
+    value_mask = numpy.ones((num_rows, num_values, 12), dtype=bool)
+    value_mask[:, :, 4:] = ~nulls[:, :, numpy.newaxis]
+
+    mask = numpy.ones((num_rows, row_width), dtype=bool)
+    mask[:, 6:values_start] = numpy.arange(id_width) < id_lengths[:, numpy.newaxis]
+    mask[:, values_start:] = value_mask.reshape(num_rows, num_values * 12)
+
+    return rows[mask].tobytes()
+
+
+# encodes rows of a text region id and stats of the given Postgres types as binary COPY tuples. Values that don't fit
+#   their column's type raise a ValueError, instead of being silently truncated or wrapped
+def encode_pg_copy_binary_typed(region_ids, values, nulls, column_types):
+    num_rows, num_values = values.shape
+    id_width = region_ids.dtype.itemsize
+    id_lengths = numpy.char.str_len(region_ids)
+    values_start = 6 + id_width
+
+    dtype_list = list()
+
+    for i, column_type in enumerate(column_types):
+        dtype_list.extend([(f"l{i}", ">i4"), (f"v{i}", column_type_encodings[column_type])])
+
+    fields = numpy.zeros(num_rows, dtype=dtype_list)
+    row_width = values_start + fields.dtype.itemsize
+
+    rows = numpy.zeros((num_rows, row_width), dtype=numpy.uint8)
+    rows[:, 0:2] = numpy.frombuffer(struct.pack(">h", num_values + 1), dtype=numpy.uint8)
+    rows[:, 2:6] = id_lengths.astype(">i4").view(numpy.uint8).reshape(num_rows, 4)
+    rows[:, 6:values_start] = region_ids.view(numpy.uint8).reshape(num_rows, id_width)
+
+    mask = numpy.ones((num_rows, row_width), dtype=bool)
+    mask[:, 6:values_start] = numpy.arange(id_width) < id_lengths[:, numpy.newaxis]
+
+    for i, column_type in enumerate(column_types):
+        encoding = numpy.dtype(column_type_encodings[column_type])
+        column_values = numpy.where(nulls[:, i], 0.0, values[:, i])
+
+        if encoding.kind == "i":
+            limits = numpy.iinfo(encoding)
+
+            if numpy.any((column_values != numpy.floor(column_values)) | (column_values < limits.min)
+                         | (column_values > limits.max)):
+                raise ValueError(f"stat {i + 1} has values that don't fit its {column_type} column")
+
+        fields[f"l{i}"] = numpy.where(nulls[:, i], -1, encoding.itemsize)
+        fields[f"v{i}"] = column_values
+
+        # NULLs are a length of -1 & no value
+        value_start = values_start + fields.dtype.fields[f"v{i}"][1]
+        mask[:, value_start:value_start + encoding.itemsize] = ~nulls[:, i, numpy.newaxis]
+
+    rows[:, values_start:] = fields.view(numpy.uint8).reshape(num_rows, fields.dtype.itemsize)
+
+    return rows[mask].tobytes()
+
+
+# infers the smallest type each stat column in a CSV file can be stored as without losing anything: smallint or
+#   integer for whole numbers in their range, real for values a float4 holds exactly, otherwise double precision.
+#   'sample' only reads the first rows, and doesn't use real - a later value real couldn't hold would be silently
+#   rounded, where a later value that doesn't fit an integer column fails the load. Returns None if the file can't be
+#   parsed (e.g. it has quoted values)
+def infer_column_types(file_dict, num_columns, mode):
+    num_values = num_columns - 1
+    is_whole = numpy.ones(num_values, dtype=bool)
+    is_float4 = numpy.full(num_values, mode == "full")
+    min_values = numpy.zeros(num_values)
+    max_values = numpy.zeros(num_values)
+    num_rows = 0
+    is_header = True
+
+    try:
+        with open_source_file(file_dict) as csv_file:
+            for lines in csv_line_batches(clean_csv_chunks(csv_file, count_bytes=False)):
+                # skip the header row
+                if is_header:
+                    lines = lines[1:]
+                    is_header = False
+
+                if not lines:
+                    continue
+
+                cells = csv_lines_to_cells(lines, num_columns)[:, 1:]
+                nulls = (cells == b"..") | (cells == b"")
+                values = numpy.where(nulls, b"0", cells).astype(numpy.float64)
+
+                # whole numbers are written without a decimal point or exponent (Postgres won't read "1.0" as an
+                #   integer)
+                is_whole &= numpy.all(nulls | numpy.char.isdigit(numpy.char.lstrip(cells, b"-")), axis=0)
+                is_float4 &= numpy.all(values.astype(numpy.float32).astype(numpy.float64) == values, axis=0)
+                min_values = numpy.minimum(min_values, values.min(axis=0))
+                max_values = numpy.maximum(max_values, values.max(axis=0))
+
+                num_rows += len(lines)
+
+                if mode == "sample" and num_rows >= type_sample_rows:
+                    break
+    except ValueError:
+        return None
+
+    column_types = list()
+
+    for i in range(num_values):
+        if is_whole[i] and min_values[i] >= -32768 and max_values[i] <= 32767:
+            column_types.append("smallint")
+        elif is_whole[i] and min_values[i] >= -2147483648 and max_values[i] <= 2147483647:
+            column_types.append("integer")
+        elif is_float4[i]:
+            column_types.append("real")
+        else:
+            column_types.append("double precision")
+
+    return column_types
+
+
+# is a load error caused by a value that doesn't fit its column's inferred type?
+def is_column_type_error(ex):
+    return isinstance(ex, (psycopg.errors.NumericValueOutOfRange, psycopg.errors.InvalidTextRepresentation,
+                           ValueError))
+
+
+# returns the SQL & parameters to record the types chosen for a table's stat columns
+def get_column_types_update(data_schema, table_name, field_list, column_types):
+    return (f"""INSERT INTO {data_schema}.metadata_column_types (table_name, field, data_type)
+                SELECT %s, unnest(%s::text[]), unnest(%s::text[])
+                ON CONFLICT (table_name, field) DO UPDATE SET data_type = EXCLUDED.data_type""",
+            (table_name, list(field_list), list(column_types)))
+
+
+# streams an open CSV file into a Postgres table as cleaned CSV text - Postgres parses the values
+#   returns the number of rows copied
+def copy_csv_text(pg_cur, table, csv_file, file_hash=None):
+    with pg_cur.copy(copy_from_stdin_sql["text"].format(table=table)) as copy:
+        chunks = clean_csv_chunks(csv_file, file_hash=file_hash)
+
+        while True:
+            # wait for space in the shared buffer before reading the next chunk - it's given back before the chunk's
+            #   sent, so a process ended while it's stuck sending isn't holding it
+            with copy_buffer_slot():
+                data = next(chunks, None)
+
+            if data is None:
+                break
+
+            copy.write(data)
+
+    return pg_cur.rowcount
+
+
+# converts an open CSV file to Postgres binary COPY data, a batch of lines at a time
+def csv_binary_blocks(csv_file, num_columns, file_hash=None, column_types=None):
+    yield pg_copy_binary_header
 
-    pg_cur.execute(f"VACUUM ANALYSE {data_schema}.{table_name}")
+    is_header = True
 
-    result = "SUCCESS"
+    for lines in csv_line_batches(clean_csv_chunks(csv_file, file_hash=file_hash)):
+        # skip the header row
+        if is_header:
+            lines = lines[1:]
+            is_header = False
+
+        if lines:
+            if column_types is not None:
+                yield encode_pg_copy_binary_typed(*csv_lines_to_arrays(lines, num_columns), column_types)
+            else:
+                yield encode_pg_copy_binary(*csv_lines_to_arrays(lines, num_columns))
+
+    yield pg_copy_binary_trailer
+
+
+# can the Postgres server read the file at this path, and is it the same size as ours? False if the server can't see
+#   it or this user isn't allowed to check (needs superuser or pg_read_server_files)
+def is_file_visible_to_server(pg_cur, server_path, num_bytes):
+    try:
+        pg_cur.execute(server_file_size_sql, (server_path,))
+        return pg_cur.fetchone()[0] == num_bytes
+    except psycopg.Error:
+        return False
+
+
+# is_file_visible_to_server for an async connection
+async def async_is_file_visible_to_server(pg_cur, server_path, num_bytes):
+    try:
+        await pg_cur.execute(server_file_size_sql, (server_path,))
+        return (await pg_cur.fetchone())[0] == num_bytes
+    except psycopg.Error:
+        return False
+
+
+# has the Postgres server read a CSV file into a table directly - nothing goes through this process. 'file' copies
+#   the file as is; 'program' runs it through a filter on the server that cleans it like clean_csv_chunks (removes
+#   spaces, rogue end of file characters and blank lines). Returns the number of rows copied
+def copy_csv_server(pg_cur, table, server_path, server_side_copy):
+    pg_cur.execute(get_server_copy_sql(table, server_path, server_side_copy))
+
+    return pg_cur.rowcount
+
+
+# returns the COPY statement for the Postgres server to read a CSV file itself
+def get_server_copy_sql(table, server_path, server_side_copy):
+    if server_side_copy == "program":
+        command = f"tr -d ' \\032' < {shlex.quote(server_path)} | sed '/^[[:space:]]*$/d'"
+        source = "PROGRAM '" + command.replace("'", "''") + "'"
+    else:
+        source = "'" + server_path.replace("'", "''") + "'"
+
+    return f"COPY {table} FROM {source} WITH CSV HEADER DELIMITER as ',' NULL as '..'"
+
+
+# streams an open CSV file into a Postgres table using binary COPY - values are parsed here instead of on the
+#   server. Returns the number of rows copied
+def copy_csv_binary(pg_cur, table, csv_file, num_columns, file_hash=None, column_types=None):
+    with pg_cur.copy(copy_from_stdin_sql["binary"].format(table=table)) as copy:
+        blocks = csv_binary_blocks(csv_file, num_columns, file_hash, column_types)
+
+        while True:
+            # wait for space in the shared buffer before reading the next batch of lines - given back before it's sent
+            with copy_buffer_slot():
+                data = next(blocks, None)
+
+            if data is None:
+                break
+
+            copy.write(data)
+
+    return pg_cur.rowcount
+
+
+# returns the SQL to (re)create a data table with a text region id and a column for each stat (double precision, unless
+#   narrower types have been inferred)
+def get_create_table_sql(data_schema, table_name, field_list, unlogged, region_id_field, pg_user, boundary=None,
+                         column_types=None):
+    column_types = column_types or ["double precision"] * len(field_list)
+    fields_string = ",".join([f"{field} {column_type}" for field, column_type in zip(field_list, column_types)])
+
+    # unlogged tables skip writing the data to the WAL - they're set to logged after the load
+    table_type = "UNLOGGED TABLE" if unlogged else "TABLE"
+
+    # a future partition gets its boundary column, with a check constraint that matches its partition bound - so
+    #   attaching it doesn't need to scan it
+    if boundary is not None:
+        boundary_string = (f"{partition_key_field} text NOT NULL DEFAULT '{boundary}' "
+                           f"CHECK ({partition_key_field} = '{boundary}'),")
+    else:
+        boundary_string = ""
+
+    return f"""DROP TABLE IF EXISTS {data_schema}.{table_name} CASCADE;
+               CREATE {table_type} {data_schema}.{table_name} (
+                   {boundary_string}
+                   {region_id_field} text,
+                   {fields_string}
+               ) WITH (OIDS=FALSE);
+               ALTER TABLE {data_schema}.{table_name} OWNER TO {pg_user}"""
+
+
+# returns the SQL to create a census table's parent table, list partitioned by boundary, and a view for each boundary
+#   with the name & fields of its table in the table per boundary layout (e.g. sa1_g01)
+def get_create_parent_table_sql(data_schema, table, field_list, boundary_list, region_id_field, pg_user,
+                                keep_existing):
+    fields_string = ",".join([f"{field} double precision" for field in field_list])
+
+    if keep_existing:
+        sql = f"CREATE TABLE IF NOT EXISTS {data_schema}.{table} ("
+    else:
+        sql = f"DROP TABLE IF EXISTS {data_schema}.{table} CASCADE; CREATE TABLE {data_schema}.{table} ("
+
+    sql += f"""{partition_key_field} text NOT NULL,
+                  {region_id_field} text,
+                  {fields_string}
+              ) PARTITION BY LIST ({partition_key_field});
+              ALTER TABLE {data_schema}.{table} OWNER TO {pg_user}"""
+
+    for boundary in boundary_list:
+        sql += f""";CREATE OR REPLACE VIEW {data_schema}.{boundary}_{table} AS
+                        SELECT {region_id_field}, {",".join(field_list)}
+                        FROM {data_schema}.{table}
+                        WHERE {partition_key_field} = '{boundary}';
+                    ALTER VIEW {data_schema}.{boundary}_{table} OWNER TO {pg_user}"""
+
+    return sql
+
+
+# returns the table to COPY into, with its columns - a partition's boundary column is left to its default
+def get_copy_table(data_schema, table_name, field_list, region_id_field):
+    return f"{data_schema}.{table_name} ({region_id_field},{','.join(field_list)})"
+
+
+# drops the tables or views (by relkind - 'r', 'p' or 'v') in a schema with any of the given names, e.g. tables in
+#   the way of views after the table layout has changed
+def drop_relations(pg_cur, data_schema, name_list, relkind_list):
+    pg_cur.execute(f"""SELECT relname, relkind::text
+                       FROM pg_class
+                       WHERE relnamespace = '{data_schema}'::regnamespace
+                           AND relname = ANY(%s)
+                           AND relkind::text = ANY(%s)""", (list(name_list), list(relkind_list)))
+
+    for relname, relkind in pg_cur.fetchall():
+        pg_cur.execute(f"DROP {'VIEW' if relkind == 'v' else 'TABLE'} IF EXISTS {data_schema}.{relname} CASCADE")
+
+
+# returns the SQL for a region code as the key shared by the data & boundary tables - the data prefixes some codes with
+#   their boundary type (e.g. LGA10050) where the boundaries don't (e.g. 10050), and some boundary codes aren't text
+def get_normalised_code_sql(code_sql):
+    return f"coalesce(nullif(regexp_replace(upper({code_sql}::text), '^[A-Z]+', ''), ''), upper({code_sql}::text))"
+
+
+# returns the SQL to create an analysis ready materialised view: a boundary's stats from one or more data tables, with
+#   a normalised region code & the boundary geometry. table_list is a list of (table name, field list) - the first table
+#   has a row for every region. The unique index on the region ID lets the view be refreshed concurrently
+def get_create_analysis_view_sql(analysis_schema, view_name, data_schema, table_list, bdy_schema, bdy_table,
+                                 bdy_code_field, region_id_field, pg_user):
+    view = f"{analysis_schema}.{view_name}"
+
+    select_list = [f"s0.{region_id_field}",
+                   f"{get_normalised_code_sql(f's0.{region_id_field}')} AS region_code"]
+    join_list = list()
+
+    for i, (table_name, field_list) in enumerate(table_list):
+        select_list.extend([f"s{i}.{field}" for field in field_list])
+
+        if i > 0:
+            join_list.append(f"LEFT OUTER JOIN {data_schema}.{table_name} AS s{i} "
+                             f"ON s{i}.{region_id_field} = s0.{region_id_field}")
+
+    # one boundary per code (preferring one with a geometry), so duplicated codes can't break the unique index
+    select_list.append("bdy.geom")
+    join_list.append(f"LEFT OUTER JOIN (SELECT DISTINCT ON (region_code) "
+                     f"{get_normalised_code_sql(bdy_code_field)} AS region_code, geom "
+                     f"FROM {bdy_schema}.{bdy_table} ORDER BY region_code, geom IS NULL) AS bdy "
+                     f"ON bdy.region_code = {get_normalised_code_sql(f's0.{region_id_field}')}")
+
+    join_sql = "\n                   ".join(join_list)
+
+    return f"""DROP MATERIALIZED VIEW IF EXISTS {view} CASCADE;
+               CREATE MATERIALIZED VIEW {view} AS
+               SELECT {", ".join(select_list)}
+               FROM {data_schema}.{table_list[0][0]} AS s0
+                   {join_sql}
+               WITH DATA;
+               ALTER MATERIALIZED VIEW {view} OWNER TO {pg_user};
+               CREATE UNIQUE INDEX {view_name}_{region_id_field}_idx ON {view} ({region_id_field});
+               CREATE INDEX {view_name}_region_code_idx ON {view} (region_code);
+               CREATE INDEX {view_name}_geom_idx ON {view} USING gist (geom);
+               ANALYZE {view}"""
+
+
+# returns the SQL to refresh an analysis ready materialised view without blocking the queries reading it
+def get_refresh_analysis_view_sql(analysis_schema, view_name):
+    view = f"{analysis_schema}.{view_name}"
+
+    return f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}; ANALYZE {view}"
+
+
+# returns a new telemetry record for a CSV file load
+def get_load_record(file_dict):
+    return {
+        "file": file_dict["path"],
+        "table": file_dict["table_name"],
+        "bytes": file_dict["bytes"],
+        "rows": 0,
+        "columns": len(file_dict["fields"]) + 1,
+        "connect_seconds": 0.0,
+        "infer_seconds": 0.0,
+        "create_seconds": 0.0,
+        "copy_seconds": 0.0,
+        "seconds": 0.0,
+        "mb_per_second": 0.0,
+        "copy_method": "client",
+        "parent_table": file_dict.get("parent_table"),
+        "boundary": file_dict.get("boundary"),
+        "pid": os.getpid(),
+        "result": "SUCCESS"
+    }
+
+
+# returns the error message for a CSV file that doesn't match its table's fields in the metadata, or None if it does
+def check_csv_columns(file_dict, num_columns):
+    field_list = file_dict["fields"]
+
+    if len(field_list) == 0 or num_columns != len(field_list) + 1:
+        return (f"IMPORT CSV INTO POSTGRES FAILED! : {file_dict['path']} : CSV has {num_columns} "
+                f"columns, metadata has {len(field_list)} fields for table {file_dict['table']} plus the region id")
+
+    return None
+
+
+# loads a CSV file into a new table using the worker process's connection - returns a telemetry record of the load
+def run_csv_import_multiprocessing(args):
+    file_dict = args[0]
+    copy_format = args[1]
+    server_side_copy = args[2]
+    unlogged = args[3]
+    pg_connect_string = args[4]
+    data_schema = args[5]
+    pg_user = args[6]
+    region_id_field = args[7]
+
+    start_time = datetime.now()
+    start_connect_seconds = worker_connect_seconds
+
+    try:
+        record = run_with_worker_connection(pg_connect_string, import_csv_file, file_dict, copy_format,
+                                            server_side_copy, unlogged, data_schema, pg_user, region_id_field)
+
+        # only takes time for the first file a process loads, or after a connection breaks
+        record["connect_seconds"] = worker_connect_seconds - start_connect_seconds
+    except psycopg.OperationalError as ex:
+        record = get_load_record(file_dict)
+        record["result"] = f"IMPORT CSV INTO POSTGRES FAILED! : {file_dict['path']} : {ex}"
+
+    record["seconds"] = (datetime.now() - start_time).total_seconds()
+
+    return record
+
+
+# loads a CSV file into a new table - returns a telemetry record of the load. The steps are shared with the async
+#   engine's async_import_csv_file, which awaits the same I/O
+def import_csv_file(pg_conn, file_dict, copy_format, server_side_copy, unlogged, data_schema, pg_user,
+                    region_id_field):
+    record = get_load_record(file_dict)
+    load = get_load_state(file_dict, server_side_copy)
+
+    with pg_conn.cursor() as pg_cur:
+        pg_cur.execute(*start_csv_load(file_dict, data_schema, record))
+
+        if record["result"] != "SUCCESS":
+            return record
+
+        while True:
+            # INFER COLUMN TYPES
+            column_types = infer_load_column_types(file_dict, load, record)
+
+            # CREATE TABLE
+            step_start_time = datetime.now()
+            pg_cur.execute(get_load_table_sql(file_dict, column_types, unlogged, data_schema, pg_user,
+                                              region_id_field))
+            record["create_seconds"] = (datetime.now() - step_start_time).total_seconds()
+
+            # IMPORT CSV FILE
+            step_start_time = datetime.now()
+
+            file_hash = hashlib.sha256()
+            table = get_copy_table(data_schema, file_dict["table_name"], file_dict["fields"], region_id_field)
+
+            if load["server_path"] is not None and is_file_visible_to_server(pg_cur, load["server_path"],
+                                                                             file_dict["bytes"]):
+                record["copy_method"] = f"server {server_side_copy}"
+
+            try:
+                if record["copy_method"].startswith("server"):
+                    row_count = copy_csv_server(pg_cur, table, load["server_path"], server_side_copy)
+                    file_hash = None
+                else:
+                    with open_source_file(file_dict) as csv_file:
+                        if copy_format == "binary":
+                            row_count = copy_csv_binary(pg_cur, table, csv_file, len(file_dict["fields"]) + 1,
+                                                        file_hash, column_types)
+                        else:
+                            row_count = copy_csv_text(pg_cur, table, csv_file, file_hash)
+
+                for sql, params in finish_csv_copy(file_dict, data_schema, record, step_start_time, row_count,
+                                                   column_types, file_hash):
+                    pg_cur.execute(sql, params)
+            except Exception as ex:
+                # a broken connection is retried (the manifest can't be updated anyway)
+                if pg_conn.broken:
+                    raise
+
+                if retry_csv_load(ex, load, record):
+                    continue
+
+                pg_cur.execute(*fail_csv_load(ex, file_dict, data_schema, record))
+
+            break
+
+    return record
+
+
+# the state of a CSV file load that changes as it's retried: how its column types are inferred & the path the Postgres
+#   server can read it from (None when it can't be tried, e.g. for zipped files, which always go through this process)
+def get_load_state(file_dict, server_side_copy):
+    return {
+        "infer_types": file_dict.get("infer_types", "off"),
+        "server_path": file_dict.get("server_path") if server_side_copy != "off" else None
+    }
+
+
+# checks the CSV has the expected number of columns before its table's created, so a mismatch fails fast. Returns the
+#   manifest update that flags the file as failed, or as being loaded (it stays this way if the load crashes)
+def start_csv_load(file_dict, data_schema, record):
+    error = check_csv_columns(file_dict, len(read_csv_header(file_dict)))
+
+    if error is not None:
+        record["result"] = error
+
+        return get_manifest_update(data_schema, file_dict, "failed")
+
+    return get_manifest_update(data_schema, file_dict, "loading")
+
+
+# infers the column types of a CSV file load, if it's inferring them - returns None if it isn't
+def infer_load_column_types(file_dict, load, record):
+    if load["infer_types"] == "off":
+        return None
+
+    start_time = datetime.now()
+    column_types = infer_column_types(file_dict, len(file_dict["fields"]) + 1, load["infer_types"])
+    record["infer_seconds"] += (datetime.now() - start_time).total_seconds()
+
+    return column_types
+
+
+# returns the SQL to (re)create a CSV file's table - a partition is created with its boundary
+def get_load_table_sql(file_dict, column_types, unlogged, data_schema, pg_user, region_id_field):
+    boundary = file_dict["boundary"] if file_dict.get("parent_table") else None
+
+    return get_create_table_sql(data_schema, file_dict["table_name"], file_dict["fields"], unlogged, region_id_field,
+                                pg_user, boundary, column_types)
+
+
+# records a CSV file's COPY in its telemetry record (counting a file the server read as read here, for auto tuning).
+#   Returns the SQL & parameters to record the inferred column types & flag the file as copied - the table is flagged
+#   as loaded once it's been indexed in the post load step. Files read by the server aren't hashed, so a changed
+#   modified time means they're reloaded
+def finish_csv_copy(file_dict, data_schema, record, copy_start_time, row_count, column_types, file_hash):
+    record["copy_seconds"] = (datetime.now() - copy_start_time).total_seconds()
+    record["rows"] = row_count
+
+    if record["copy_seconds"] > 0.0:
+        record["mb_per_second"] = file_dict["bytes"] / 1048576.0 / record["copy_seconds"]
+
+    if record["copy_method"].startswith("server"):
+        count_server_copy_bytes(file_dict["bytes"])
+
+    sql_list = list()
+
+    if column_types is not None:
+        sql_list.append(get_column_types_update(data_schema, file_dict["table_name"], file_dict["fields"],
+                                                column_types))
+
+    sql_list.append(get_manifest_update(data_schema, file_dict, "copied",
+                                        file_hash.hexdigest() if file_hash is not None else None, row_count))
+
+    return sql_list
+
+
+# can a failed CSV file load be tried again a different way? Changes the load's state if it can
+def retry_csv_load(ex, load, record):
+    # a value after the sampled rows doesn't fit its column - infer the types from the whole file
+    if load["infer_types"] == "sample" and is_column_type_error(ex):
+        load["infer_types"] = "full"
+        return True
+
+    # the server couldn't read the file (e.g. permissions or a rogue character) - send it from here instead
+    if record["copy_method"].startswith("server"):
+        load["server_path"] = None
+        record["copy_method"] = "client (server copy failed)"
+        return True
+
+    return False
+
+
+# records a CSV file load's failure - returns the manifest update that flags the file as failed
+def fail_csv_load(ex, file_dict, data_schema, record):
+    record["result"] = f"IMPORT CSV INTO POSTGRES FAILED! : {file_dict['path']} : {ex}"
+
+    return get_manifest_update(data_schema, file_dict, "failed")
+
+
+# loads a list of CSV files using asyncio - runs max_concurrent_streams COPYs at once from this process, each on its
+#   own connection that's reused for every file it loads. Files are read & cleaned in threads, so one file being
+#   read doesn't hold up the others' COPYs
+def async_csv_import(work_list, max_concurrent_streams, max_buffer_mb, copy_format, server_side_copy, unlogged,
+                     pg_connect_string, data_schema, pg_user, region_id_field, timeout, logger):
+
+    result_list = asyncio.run(run_async_csv_import(work_list, max_concurrent_streams, max_buffer_mb, copy_format,
+                                                   server_side_copy, unlogged, pg_connect_string, data_schema,
+                                                   pg_user, region_id_field, timeout, logger))
+
+    log_work_failures("CSV files", [(result["table"], result["result"]) for result in result_list
+                                    if result["result"] != "SUCCESS"], len(work_list), logger)
+
+    return result_list
+
+
+async def run_async_csv_import(work_list, max_concurrent_streams, max_buffer_mb, copy_format, server_side_copy,
+                               unlogged, pg_connect_string, data_schema, pg_user, region_id_field, timeout, logger):
+
+    # backpressure - the number of chunks that can be in flight across all streams at any one time
+    buffer_semaphore = asyncio.Semaphore(max(int(max_buffer_mb * 1024 * 1024 / csv_chunk_size), 1))
+
+    # the streams share the work list, so its order (e.g. biggest first) is kept
+    work_iterator = iter(work_list)
+    result_list = list()
+
+    async def run_stream():
+        pg_conn = None
+
+        # like run_with_worker_connection - if the connection breaks, it reconnects & loads the file again after a
+        #   backoff. Any other error fails the file, not the whole load
+        async def load_file(file_dict):
+            nonlocal pg_conn
+
+            for attempt in range(connection_retries + 1):
+                try:
+                    if pg_conn is None or pg_conn.closed or pg_conn.broken:
+                        pg_conn = await connect_async_stream(pg_connect_string)
+
+                    return await async_import_csv_file(pg_conn, buffer_semaphore, file_dict, copy_format,
+                                                       server_side_copy, unlogged, data_schema, pg_user,
+                                                       region_id_field)
+                except psycopg.OperationalError as ex:
+                    if attempt == connection_retries or (pg_conn is not None and not pg_conn.broken):
+                        return get_failed_load_record([file_dict], get_result_message(ex))
+                except Exception as ex:
+                    return get_failed_load_record([file_dict], get_result_message(ex))
+
+                await asyncio.sleep(2 ** attempt)
+
+        try:
+            for file_dict in work_iterator:
+                # like run_pool_work - a file that's still loading after the timeout is treated as hung, cancelled &
+                #   retried after a backoff
+                for attempt in range(1, work_item_retries + 2):
+                    try:
+                        record = await asyncio.wait_for(load_file(file_dict), timeout)
+                        break
+                    except asyncio.TimeoutError:
+                        message = f"TimeoutError : no result after {timeout}s"
+                        record = get_failed_load_record([file_dict], message)
+
+                        # the cancelled load leaves its connection mid COPY - the retry uses a new one
+                        if pg_conn is not None:
+                            try:
+                                await pg_conn.close()
+                            except psycopg.Error:
+                                pass
+
+                        if attempt <= work_item_retries:
+                            backoff = 2 ** attempt
+                            logger.warning(f"\t- {file_dict['table_name']} failed - retrying in {backoff}s : {message}")
+                            await asyncio.sleep(backoff)
+
+                result_list.append(record)
+        finally:
+            if pg_conn is not None:
+                await pg_conn.close()
+
+    await asyncio.gather(*[run_stream() for i in range(min(max_concurrent_streams, len(work_list)))])
+
+    return result_list
+
+
+# opens a connection for an async COPY stream, with the load's session settings
+async def connect_async_stream(pg_connect_string):
+    pg_conn = await psycopg.AsyncConnection.connect(pg_connect_string, autocommit=True)
+
+    for name, value in load_session_settings.items():
+        await pg_conn.execute("SELECT set_config(%s, %s, false)", (name, str(value)))
+
+    return pg_conn
+
+
+# loads a CSV file into a new table using an async connection - returns a telemetry record of the load. Runs the same
+#   steps as import_csv_file, awaiting their I/O (files are read in threads)
+async def async_import_csv_file(pg_conn, buffer_semaphore, file_dict, copy_format, server_side_copy, unlogged,
+                                data_schema, pg_user, region_id_field):
+    record = get_load_record(file_dict)
+    load = get_load_state(file_dict, server_side_copy)
+
+    start_time = datetime.now()
+
+    async with pg_conn.cursor() as pg_cur:
+        await pg_cur.execute(*await asyncio.to_thread(start_csv_load, file_dict, data_schema, record))
+
+        if record["result"] != "SUCCESS":
+            record["seconds"] = (datetime.now() - start_time).total_seconds()
+
+            return record
+
+        while True:
+            # INFER COLUMN TYPES
+            column_types = await asyncio.to_thread(infer_load_column_types, file_dict, load, record)
+
+            # CREATE TABLE
+            step_start_time = datetime.now()
+            await pg_cur.execute(get_load_table_sql(file_dict, column_types, unlogged, data_schema, pg_user,
+                                                    region_id_field))
+            record["create_seconds"] = (datetime.now() - step_start_time).total_seconds()
+
+            # IMPORT CSV FILE
+            step_start_time = datetime.now()
+
+            file_hash = hashlib.sha256()
+            table = get_copy_table(data_schema, file_dict["table_name"], file_dict["fields"], region_id_field)
+
+            if load["server_path"] is not None and await async_is_file_visible_to_server(pg_cur, load["server_path"],
+                                                                                         file_dict["bytes"]):
+                record["copy_method"] = f"server {server_side_copy}"
+
+            try:
+                if record["copy_method"].startswith("server"):
+                    await pg_cur.execute(get_server_copy_sql(table, load["server_path"], server_side_copy))
+                    file_hash = None
+                else:
+                    with open_source_file(file_dict) as csv_file:
+                        if copy_format == "binary":
+                            blocks = csv_binary_blocks(csv_file, len(file_dict["fields"]) + 1, file_hash,
+                                                       column_types)
+                        else:
+                            blocks = clean_csv_chunks(csv_file, file_hash=file_hash)
+
+                        async with pg_cur.copy(copy_from_stdin_sql[copy_format].format(table=table)) as copy:
+                            while True:
+                                # wait for space in the shared buffer before reading the next chunk
+                                async with buffer_semaphore:
+                                    data = await asyncio.to_thread(next, blocks, None)
+
+                                    if data is None:
+                                        break
+
+                                    await copy.write(data)
+
+                for sql, params in finish_csv_copy(file_dict, data_schema, record, step_start_time, pg_cur.rowcount,
+                                                   column_types, file_hash):
+                    await pg_cur.execute(sql, params)
+            except Exception as ex:
+                # a broken connection is retried (the manifest can't be updated anyway)
+                if pg_conn.broken:
+                    raise
+
+                if retry_csv_load(ex, load, record):
+                    continue
+
+                await pg_cur.execute(*fail_csv_load(ex, file_dict, data_schema, record))
+
+            break
+
+    record["seconds"] = (datetime.now() - start_time).total_seconds()
+
+    return record
+
+
+# writes the load telemetry records to a JSON Lines file & logs a summary of the load's performance
+def write_load_telemetry(record_list, telemetry_file, elapsed_seconds, logger):
+    with open(telemetry_file, "w") as output_file:
+        for record in record_list:
+            output_file.write(json.dumps(record) + "\n")
+
+    logger.info(f"\t- load telemetry written to {telemetry_file}")
+
+    loaded_list = [record for record in record_list if record["result"] == "SUCCESS"]
+
+    if len(loaded_list) == 0:
+        return
+
+    file_seconds = numpy.array([record["seconds"] for record in loaded_list])
+    total_mb = sum([record["bytes"] for record in loaded_list]) / 1048576.0
+    total_rows = sum([record["rows"] for record in loaded_list])
+
+    logger.info(f"\t- file load times : p50 {numpy.percentile(file_seconds, 50):.2f}s : "
+                f"p95 {numpy.percentile(file_seconds, 95):.2f}s : max {file_seconds.max():.2f}s")
+
+    if elapsed_seconds > 0.0:
+        logger.info(f"\t- overall throughput : {total_mb:.1f}MB & {total_rows} rows in {elapsed_seconds:.1f}s : "
+                    f"{total_mb / elapsed_seconds:.1f} MB/s")
+
+    logger.info("\t- slowest tables :")
+
+    for record in sorted(loaded_list, key=lambda record: record["seconds"], reverse=True)[:5]:
+        logger.info(f"\t\t- {record['table']} : {record['seconds']:.2f}s : {record['bytes'] / 1048576.0:.1f}MB : "
+                    f"{record['mb_per_second']:.1f} MB/s")
+
+
+# adds primary keys, physically clusters and analyzes tables using multiprocessing - run after all data is loaded
+#   so index builds don't compete with COPY traffic. Returns the time taken for each step, for each table
+def multiprocess_post_load(table_list, max_concurrent_processes, maintenance_work_mem, set_logged,
+                           pg_connect_string, data_schema, region_id_field, timeout, logger, partitions=None):
+
+    # do the biggest tables first so a large table isn't the last one running on its own
+    pg_conn = psycopg.connect(pg_connect_string)
+    pg_cur = pg_conn.cursor()
+
+    pg_cur.execute(f"""SELECT relname, pg_total_relation_size(oid)
+                       FROM pg_class
+                       WHERE relnamespace = '{data_schema}'::regnamespace
+                           AND relname = ANY(%s)""", (table_list,))
+    table_sizes = dict(pg_cur.fetchall())
 
     pg_cur.close()
     pg_conn.close()
 
-    return result
+    work_list = sorted(table_list, key=lambda table: table_sizes.get(table, 0), reverse=True)
 
+    # give index builds & clustering more memory than a normal session
+    session_settings = dict(load_session_settings, maintenance_work_mem=maintenance_work_mem)
 
-# takes a list of sql queries or command lines and runs them using multiprocessing
-def multiprocess_list(mp_type, work_list, max_concurrent_processes, pg_connect_string, logger):
-    pool = multiprocessing.Pool(processes=max_concurrent_processes)
+    pool = multiprocessing.Pool(processes=max_concurrent_processes, initializer=init_worker,
+                                initargs=(session_settings,))
 
-    num_jobs = len(work_list)
+    # tables that are partitions of a parent table are attached to it once they're indexed - (parent, boundary)
+    partitions = partitions or dict()
 
-    if mp_type == "sql":
-        results = pool.imap_unordered(run_sql_multiprocessing, [[w, pg_connect_string] for w in work_list])
-    else:
-        results = pool.imap_unordered(run_command_line, work_list)
+    return run_pool_work(pool, run_post_load_multiprocessing,
+                         [[w, set_logged, pg_connect_string, data_schema, region_id_field, partitions.get(w)]
+                          for w in work_list],
+                         "post load tables", logger, max_concurrent_processes, names=work_list,
+                         sizes=[table_sizes.get(w, 0) for w in work_list], failed_result=get_failed_post_load,
+                         timeout=timeout)
 
-    pool.close()
-    pool.join()
 
-    result_list = list(results)
-    num_results = len(result_list)
+# the post load timings for a table that failed without a result (e.g. its process was killed)
+def get_failed_post_load(args, message):
+    return {"table": args[0], "index": 0.0, "cluster": 0.0, "logged": 0.0, "attach": 0.0, "analyze": 0.0,
+            "result": f"POST LOAD PROCESSING FAILED! : {args[3]}.{args[0]} : {message}"}
 
-    if num_jobs > num_results:
-        logger.warning("\t- A MULTIPROCESSING PROCESS FAILED WITHOUT AN ERROR\nACTION: Check the record counts")
 
-    for result in result_list:
-        if result != "SUCCESS":
-            logger.info(result)
+def run_post_load_multiprocessing(args):
+    table_name = args[0]
+    set_logged = args[1]
+    pg_connect_string = args[2]
+    data_schema = args[3]
+    region_id_field = args[4]
+    partition = args[5]
+
+    try:
+        return run_with_worker_connection(pg_connect_string, post_load_table, table_name, set_logged, data_schema,
+                                          region_id_field, partition)
+    except psycopg.OperationalError as ex:
+        return get_failed_post_load(args, ex)
+
+
+# adds a table's primary key, clusters it on it & analyzes it - returns the time taken for each step. A partition
+#   (a parent table & boundary) is attached to its parent table before it's analyzed
+def post_load_table(pg_conn, table_name, set_logged, data_schema, region_id_field, partition=None):
+    timings = {"table": table_name, "index": 0.0, "cluster": 0.0, "logged": 0.0, "attach": 0.0, "analyze": 0.0}
+
+    steps = [("index", f"""ALTER TABLE {data_schema}.{table_name}
+                               ADD CONSTRAINT {table_name}_pkey PRIMARY KEY ({region_id_field})"""),
+             ("cluster", f"CLUSTER {data_schema}.{table_name} USING {table_name}_pkey"),
+             ("analyze", f"ANALYZE {data_schema}.{table_name}")]
+
+    # unlogged tables need to be logged before they're published (makes them crash safe & replicated)
+    if set_logged:
+        steps.insert(2, ("logged", f"ALTER TABLE {data_schema}.{table_name} SET LOGGED"))
+
+    if partition is not None:
+        parent_table, boundary = partition
+        steps.insert(-1, ("attach", f"""ALTER TABLE {data_schema}.{parent_table}
+                                            ATTACH PARTITION {data_schema}.{table_name}
+                                            FOR VALUES IN ('{boundary}')"""))
+
+    with pg_conn.cursor() as pg_cur:
+        try:
+            # a retry after a broken connection starts again - drop the primary key if it was added
+            pg_cur.execute(f"ALTER TABLE {data_schema}.{table_name} DROP CONSTRAINT IF EXISTS {table_name}_pkey")
+
+            # ...and don't attach it twice
+            if partition is not None:
+                pg_cur.execute(f"SELECT relispartition FROM pg_class "
+                               f"WHERE oid = '{data_schema}.{table_name}'::regclass")
+
+                if pg_cur.fetchone()[0]:
+                    steps = [step for step in steps if step[0] != "attach"]
+
+            for step, sql in steps:
+                start_time = datetime.now()
+                pg_cur.execute(sql)
+                timings[step] = (datetime.now() - start_time).total_seconds()
+
+            pg_cur.execute(f"UPDATE {data_schema}.load_manifest SET status = 'loaded' WHERE table_name = %s",
+                           (table_name,))
+
+            timings["result"] = "SUCCESS"
+        except Exception as ex:
+            if pg_conn.broken:
+                raise
+
+            timings["result"] = f"POST LOAD PROCESSING FAILED! : {data_schema}.{table_name} : {ex}"
+
+    return timings
+
+
+# takes a list of sql queries or command lines and runs them using multiprocessing
+def multiprocess_list(mp_type, work_list, max_concurrent_processes, pg_connect_string, logger, names=None,
+                      timeout=work_item_timeout):
+    pool = multiprocessing.Pool(processes=max_concurrent_processes, initializer=init_worker,
+                                initargs=(load_session_settings,))
+
+    if mp_type == "sql":
+        return run_pool_work(pool, run_sql_multiprocessing, [[w, pg_connect_string] for w in work_list],
+                             "SQL statements", logger, max_concurrent_processes,
+                             names=names or [" ".join(w.split())[:100] for w in work_list], timeout=timeout)
+    else:
+        return run_pool_work(pool, run_command_line_multiprocessing, work_list, "commands", logger,
+                             max_concurrent_processes, names=names, timeout=timeout)
 
 
 def run_sql_multiprocessing(args):
     the_sql = args[0]
     pg_connect_string = args[1]
 
-    pg_conn = psycopg.connect(pg_connect_string)
-    pg_conn.autocommit = True
-    pg_cur = pg_conn.cursor()
+    try:
+        return run_with_worker_connection(pg_connect_string, run_sql, the_sql)
+    except psycopg.OperationalError as ex:
+        return f"SQL FAILED! : {the_sql} : {ex}"
 
+
+def run_sql(pg_conn, the_sql):
     # # set raw gnaf database schema (it's needed for the primary and foreign key creation)
     # if raw_gnaf_schema != "public":
     #     pg_cur.execute(f"SET search_path = {raw_gnaf_schema}, public, pg_catalog")
 
-    try:
-        pg_cur.execute(the_sql)
-        result = "SUCCESS"
-    except Exception as ex:
-        result = f"SQL FAILED! : {the_sql} : {ex}"
+    with pg_conn.cursor() as pg_cur:
+        try:
+            pg_cur.execute(the_sql)
+            result = "SUCCESS"
+        except Exception as ex:
+            if pg_conn.broken:
+                raise
 
-    pg_cur.close()
-    pg_conn.close()
+            result = f"SQL FAILED! : {the_sql} : {ex}"
 
     return result
 
 
 def run_command_line(cmd):
-    # run the command line without any output (it'll still tell you if it fails miserably)
+    # run the command line without any output - returns the end of its error output if it fails
     try:
-        fnull = open(os.devnull, "w")
-        subprocess.call(cmd, shell=True, stdout=fnull, stderr=subprocess.STDOUT)
-        result = "SUCCESS"
+        process = subprocess.run(cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+        if process.returncode == 0:
+            result = "SUCCESS"
+        else:
+            error_message = process.stderr.decode("utf-8", errors="replace").strip()[-500:]
+            result = f"COMMAND FAILED! : exit code {process.returncode} : {error_message}"
     except Exception as ex:
-        result = f"COMMAND FAILED! : {cmd} : {ex}"
+        result = f"COMMAND FAILED! : {ex}"
 
     return result
 
 
-def split_sql_into_list(pg_cur, the_sql, table_schema, table_name, table_alias, table_gid,
-                        max_concurrent_processes, logger):
-    # get min max gid values from the table to split
-    min_max_sql = f"SELECT MIN({table_gid}) AS min, MAX({table_gid}) AS max FROM {table_schema}.{table_name}"
+# runs a command line for multiprocess_list & times it
+def run_command_line_multiprocessing(cmd):
+    start_time = time.monotonic()
+    result = run_command_line(cmd)
 
-    pg_cur.execute(min_max_sql)
+    return {"result": result, "command": cmd, "seconds": time.monotonic() - start_time}
 
-    try:
-        result = pg_cur.fetchone()
 
-        min_pkey = int(result[0])
-        max_pkey = int(result[1])
-        diff = max_pkey - min_pkey
+# lists the feature & attribute layers in a GeoPackage (a SQLite database), with their feature counts and the table
+#   names they're imported as
+def get_geopackage_layers(file_path):
+    with contextlib.closing(sqlite3.connect(file_path)) as gpkg_conn:
+        layer_list = [{"layer": row[0], "table": re.sub(r"[^a-z0-9_]", "_", row[0].lower()),
+                       "spatial": row[1] == "features"}
+                      for row in gpkg_conn.execute("SELECT table_name, data_type FROM gpkg_contents "
+                                                   "WHERE data_type IN ('features', 'attributes') "
+                                                   "ORDER BY table_name")]
 
-        # Number of records in each query
-        rows_per_request = int(math.floor(float(diff) / float(max_concurrent_processes))) + 1
+        # GDAL records the feature counts - count the rows if it didn't
+        feature_counts = dict()
 
-        # If less records than processes or rows per request,
-        # reduce both to allow for a minimum of 15 records each process
-        if float(diff) / float(max_concurrent_processes) < 10.0:
-            rows_per_request = 10
-            processes = int(math.floor(float(diff) / 10.0)) + 1
-            logger.info(f"\t\t- running {processes} processes (adjusted due to low row count in table to split)")
-        else:
-            processes = max_concurrent_processes
+        if gpkg_conn.execute("SELECT count(*) FROM sqlite_master "
+                             "WHERE type = 'table' AND name = 'gpkg_ogr_contents'").fetchone()[0] > 0:
+            feature_counts = dict(gpkg_conn.execute("SELECT table_name, feature_count FROM gpkg_ogr_contents"))
 
-        # create list of sql statements to run with multiprocessing
-        sql_list = []
-        start_pkey = min_pkey - 1
+        for layer_dict in layer_list:
+            feature_count = feature_counts.get(layer_dict["layer"])
 
-        for i in range(0, processes):
-            end_pkey = start_pkey + rows_per_request
+            if feature_count is None:
+                feature_count = gpkg_conn.execute(f'SELECT count(*) FROM "{layer_dict["layer"]}"').fetchone()[0]
 
-            where_clause = f""" WHERE {table_alias}.{table_gid} > {start_pkey} 
-                                    AND {table_alias}.{table_gid} <= {end_pkey}"""
+            layer_dict["features"] = feature_count
 
-            if "WHERE " in the_sql:
-                mp_sql = the_sql.replace(" WHERE ", where_clause + " AND ")
-            elif "GROUP BY " in the_sql:
-                mp_sql = the_sql.replace("GROUP BY ", where_clause + " GROUP BY ")
-            elif "ORDER BY " in the_sql:
-                mp_sql = the_sql.replace("ORDER BY ", where_clause + " ORDER BY ")
-            else:
-                if ";" in the_sql:
-                    mp_sql = the_sql.replace(";", where_clause + ";")
-                else:
-                    mp_sql = the_sql + where_clause
-                    logger.warning("\t\t- NOTICE: no ; found at the end of the SQL statement")
+    return layer_list
 
-            sql_list.append(mp_sql)
-            start_pkey = end_pkey
 
-        # logger.info('\n'.join(sql_list))
+# the ogr2ogr command that imports a GeoPackage layer into Postgres using COPY. The spatial index isn't created, so
+#   it can be built once all the data's in
+def get_ogr2ogr_command(pg_connect_string, file_path, layer, pg_schema, pg_table):
+    return (f"ogr2ogr -f PostgreSQL {shlex.quote('PG:' + pg_connect_string)} {shlex.quote(file_path)} "
+            f"{shlex.quote(layer)} -nln {pg_schema}.{pg_table} -overwrite -lco GEOMETRY_NAME=geom "
+            f"-lco SPATIAL_INDEX=NONE --config PG_USE_COPY YES")
 
-        return sql_list
+
+# splits a query into one query per process, each working on a range of the table's gids. The ranges are balanced
+#   using the data's distribution, so the queries finish at about the same time:
+#     - "ntile" : the same number of rows in each range (scans the gids)
+#     - "weighted" : the same total weight in each range, using a weight expression for each row (e.g. the geometry
+#       complexity - "ST_NPoints(geom)")
+#     - "histogram" : approximate equal row ranges from the gid column's pg_stats histogram (no scan - falls back to
+#       ntile if the table hasn't been analyzed)
+#     - "range" : equal ranges of gid values (gaps & skew in the gids unbalance the ranges)
+#   The table in the query (e.g. "FROM schema.table AS alias") is replaced with a subselect of each range's rows, so
+#   the rest of the query isn't touched
+def split_sql_into_list(pg_cur, the_sql, table_schema, table_name, table_alias, table_gid,
+                        max_concurrent_processes, logger, method="ntile", weight=None):
+
+    # find the one reference to the table in the query
+    table_pattern = re.compile(rf"\b{re.escape(table_schema)}\.{re.escape(table_name)}(\s+AS)?\s+"
+                               rf"{re.escape(table_alias)}\b", re.IGNORECASE)
+
+    if len(table_pattern.findall(the_sql)) != 1:
+        logger.fatal(f"Can't split query - {table_schema}.{table_name} {table_alias} needs to be in it once : "
+                     f"{the_sql}")
+        return None
+
+    try:
+        bounds = get_split_bounds(pg_cur, table_schema, table_name, table_gid, max_concurrent_processes, method,
+                                  weight)
     except Exception as ex:
-        logger.fatal(f"Looks like the table in this query is empty: {min_max_sql}\n{ex}")
+        logger.fatal(f"Can't get the {method} split ranges for {table_schema}.{table_name} : {ex}")
         return None
 
+    if len(bounds) == 0:
+        logger.fatal(f"Looks like the table in this query is empty: {table_schema}.{table_name}")
+        return None
 
-def multiprocess_shapefile_load(work_list, max_concurrent_processes, pg_connect_string, logger):
-    pool = multiprocessing.Pool(processes=max_concurrent_processes)
+    if len(bounds) < max_concurrent_processes:
+        logger.info(f"\t\t- running {len(bounds)} processes (adjusted due to low row count in table to split)")
 
-    num_jobs = len(work_list)
+    # create list of sql statements to run with multiprocessing - the last range is open ended
+    sql_list = []
+    start_gid = None
 
-    results = pool.imap_unordered(intermediate_shapefile_load_step,
-                                  [[w, pg_connect_string] for w in work_list])
+    for i, end_gid in enumerate(bounds):
+        where_list = list()
 
-    pool.close()
-    pool.join()
+        if start_gid is not None:
+            where_list.append(f"{table_gid} > {start_gid}")
+        if i < len(bounds) - 1:
+            where_list.append(f"{table_gid} <= {end_gid}")
+
+        where_clause = f" WHERE {' AND '.join(where_list)}" if where_list else ""
+        subselect = f"(SELECT * FROM {table_schema}.{table_name}{where_clause}) AS {table_alias}"
+
+        sql_list.append(table_pattern.sub(lambda match: subselect, the_sql))
+        start_gid = end_gid
+
+    return sql_list
+
+
+# returns the upper gid of each of up to num_ranges ranges, using the given split method
+def get_split_bounds(pg_cur, table_schema, table_name, table_gid, num_ranges, method, weight=None):
+    table = f"{table_schema}.{table_name}"
+
+    if method == "histogram":
+        pg_cur.execute("""SELECT histogram_bounds::text
+                          FROM pg_stats
+                          WHERE schemaname = %s AND tablename = %s AND attname = %s""",
+                       (table_schema, table_name, table_gid))
+        row = pg_cur.fetchone()
+
+        if row is not None and row[0] is not None:
+            histogram = [float(value) for value in row[0].strip("{}").split(",")]
+            histogram = [int(value) if value.is_integer() else value for value in histogram]
+
+            # pick evenly spaced histogram bounds - each histogram bucket holds about the same number of rows
+            bounds = [histogram[round(i * (len(histogram) - 1) / num_ranges)] for i in range(1, num_ranges)]
+            bounds.append(histogram[-1])
+
+            return sorted(set(bounds))
+
+        method = "ntile"
+
+    if method == "range":
+        pg_cur.execute(f"SELECT MIN({table_gid}), MAX({table_gid}) FROM {table}")
+        min_gid, max_gid = pg_cur.fetchone()
+
+        if min_gid is None:
+            return list()
+
+        if isinstance(min_gid, int):
+            bounds = [min_gid + (max_gid - min_gid) * i // num_ranges for i in range(1, num_ranges)]
+        else:
+            bounds = [min_gid + (max_gid - min_gid) * i / num_ranges for i in range(1, num_ranges)]
+
+        return sorted(set(bounds + [max_gid]))
+
+    if method == "weighted":
+        if weight is None:
+            raise ValueError("weighted splits need a weight expression")
+
+        # each row's range is its share of the total weight before it (a row weighs at least 1)
+        sql = f"""SELECT max({table_gid})
+                  FROM (
+                      SELECT {table_gid},
+                             floor((sum(row_weight) OVER (ORDER BY {table_gid}) - row_weight) * {num_ranges}
+                                   / sum(row_weight) OVER ()) AS split_range
+                      FROM (SELECT {table_gid}, greatest(coalesce({weight}, 0), 1) AS row_weight
+                            FROM {table}) AS weights
+                  ) AS ranges
+                  GROUP BY split_range
+                  ORDER BY 1"""
+    else:
+        sql = f"""SELECT max({table_gid})
+                  FROM (SELECT {table_gid}, ntile({num_ranges}) OVER (ORDER BY {table_gid}) AS split_range
+                        FROM {table}) AS ranges
+                  GROUP BY split_range
+                  ORDER BY 1"""
+
+    pg_cur.execute(sql)
 
-    result_list = list(results)
-    num_results = len(result_list)
+    return [row[0] for row in pg_cur.fetchall()]
 
-    if num_jobs > num_results:
-        logger.warning("\t- A MULTIPROCESSING PROCESS FAILED WITHOUT AN ERROR\nACTION: Check the record counts")
 
-    for result in result_list:
-        if result != "SUCCESS":
-            logger.info(result)
+def multiprocess_shapefile_load(work_list, max_concurrent_processes, pg_connect_string, logger):
+    pool = multiprocessing.Pool(processes=max_concurrent_processes, initializer=init_worker,
+                                initargs=(load_session_settings,))
+
+    run_pool_work(pool, intermediate_shapefile_load_step, [[w, pg_connect_string] for w in work_list],
+                  "Shapefiles", logger, max_concurrent_processes, names=[w["pg_table"] for w in work_list])
 
 
 def intermediate_shapefile_load_step(args):
@@ -313,77 +2145,106 @@ def intermediate_shapefile_load_step(args):
     delete_table = work_dict["delete_table"]
     spatial = work_dict["spatial"]
 
-    pg_conn = psycopg.connect(pg_connect_string)
-    pg_conn.autocommit = True
-    pg_cur = pg_conn.cursor()
+    try:
+        return run_with_worker_connection(pg_connect_string, import_shapefile_with_connection, file_path, pg_table,
+                                          pg_schema, delete_table, spatial)
+    except psycopg.OperationalError as ex:
+        return f"\tImporting {file_path} - Couldn't connect to Postgres : {ex}"
 
-    result = import_shapefile_to_postgres(pg_cur, file_path, pg_table, pg_schema, delete_table, spatial)
 
-    return result
+def import_shapefile_with_connection(pg_conn, file_path, pg_table, pg_schema, delete_table, spatial):
+    with pg_conn.cursor() as pg_cur:
+        return import_shapefile_to_postgres(pg_cur, file_path, pg_table, pg_schema, delete_table, spatial)
 
 
-# imports a Shapefile into Postgres in 2 steps: SHP > SQL; SQL > Postgres
+# imports a Shapefile into Postgres in 3 steps: creates the table using shp2pgsql's DDL; streams shp2pgsql's COPY
+#   format output into the table a line at a time (memory use doesn't grow with the size of the Shapefile); then adds
+#   the spatial index once the data is in
 # overcomes issues trying to use psql with PGPASSWORD set at runtime
 def import_shapefile_to_postgres(pg_cur, file_path, pg_table, pg_schema, delete_table, spatial):
 
-    # delete target table or append to it?
-    if delete_table:
-        delete_append_flag = "-d"
-    else:
-        delete_append_flag = "-a"
-
     # assign coordinate system if spatial, otherwise flag as non-spatial
     if spatial:
-        spatial_or_dbf_flags = "-s 4283 -I"
+        spatial_or_dbf_flags = ["-s", "4283"]
     else:
-        spatial_or_dbf_flags = "-G -n"
+        spatial_or_dbf_flags = ["-G", "-n"]
 
-    # build shp2pgsql command line
-    shp2pgsql_cmd = f"shp2pgsql {delete_append_flag} {spatial_or_dbf_flags} -i \"{file_path}\" {pg_schema}.{pg_table}"
-    # print(shp2pgsql_cmd)
+    # create the table, unless appending to it
+    if delete_table:
+        try:
+            ddl = subprocess.run(["shp2pgsql", "-p"] + spatial_or_dbf_flags + ["-i", file_path,
+                                                                                f"{pg_schema}.{pg_table}"],
+                                 capture_output=True, check=True).stdout.decode("utf-8")
+        except (OSError, subprocess.CalledProcessError) as ex:
+            return f"Importing {file_path} - Couldn't convert Shapefile to SQL : {ex}"
 
-    # convert the Shapefile to SQL statements
-    try:
-        process = subprocess.Popen(shp2pgsql_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        sql_obj, err = process.communicate()
-    except:
-        return f"Importing {file_path} - Couldn't convert Shapefile to SQL"
+        # drop info lines some versions of shp2pgsql write to the output
+        sql = "\n".join([line for line in ddl.splitlines()
+                         if not line.startswith(("Shapefile type: ", "Postgis type: "))])
 
-    # print(f"SQL object is this long: {len(sql_obj)}")
-    # print(f"Error is: {err}")
+        try:
+            pg_cur.execute(f"DROP TABLE IF EXISTS {pg_schema}.{pg_table} CASCADE")
+            pg_cur.execute(sql)
+        except:
+            # a broken connection is retried
+            if pg_cur.connection.broken:
+                raise
 
-    # prep Shapefile SQL
-    sql = sql_obj.decode("utf-8")  # this is required for Python 3
-    sql = sql.replace("Shapefile type: ", "-- Shapefile type: ")
-    sql = sql.replace("Postgis type: ", "-- Postgis type: ")
-    sql = sql.replace("SELECT DropGeometryColumn", "-- SELECT DropGeometryColumn")
+            # if the table create fails for some reason - output sql to file for debugging
+            fail_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), f"fail_{pg_table}.sql")
 
-    # bug in shp2pgsql? - an append command will still create a spatial index if requested - disable it
-    if not delete_table or not spatial:
-        sql = sql.replace("CREATE INDEX ", "-- CREATE INDEX ")
+            with open(fail_file, "w") as target:
+                target.write(sql)
 
-    # this is required due to differing approaches by different versions of PostGIS
-    sql = sql.replace("DROP TABLE ", "DROP TABLE IF EXISTS ")
-    sql = sql.replace("DROP TABLE IF EXISTS IF EXISTS ", "DROP TABLE IF EXISTS ")
+            return f"\tImporting {file_path} - Couldn't run Shapefile SQL"
 
-    # import data to Postgres
-    try:
-        pg_cur.execute(sql)
-    except:
-        # if import fails for some reason - output sql to file for debugging
-        target = open(os.path.join(os.path.dirname(os.path.realpath(__file__)), f"fail_{pg_table}.sql"), "w")
-        target.write(sql)
+    # stream the data - in dump format the rows come between a COPY statement and an end of data marker
+    with tempfile.TemporaryFile() as err_file:
+        try:
+            process = subprocess.Popen(["shp2pgsql", "-a", "-D"] + spatial_or_dbf_flags
+                                       + ["-i", file_path, f"{pg_schema}.{pg_table}"],
+                                       stdout=subprocess.PIPE, stderr=err_file)
+        except OSError as ex:
+            return f"Importing {file_path} - Couldn't convert Shapefile to SQL : {ex}"
 
-        return f"\tImporting {file_path} - Couldn't run Shapefile SQL\nshp2pgsql result was: {err} "
+        try:
+            with process.stdout:
+                for line in process.stdout:
+                    if line.startswith(b"COPY "):
+                        with pg_cur.copy(line.decode("utf-8").strip().rstrip(";")) as copy:
+                            for data_line in process.stdout:
+                                if data_line.rstrip(b"\r\n") == b"\\.":
+                                    break
+
+                                copy.write(data_line)
+        except:
+            process.kill()
+            process.wait()
 
-    # Cluster table on spatial index for performance
-    if delete_table and spatial:
-        sql = f"ALTER TABLE {pg_schema}.{pg_table} CLUSTER ON {pg_table}_geom_idx"
+            # a broken connection is retried
+            if pg_cur.connection.broken:
+                raise
 
+            return f"\tImporting {file_path} - Couldn't copy Shapefile data into {pg_schema}.{pg_table}"
+
+        if process.wait() != 0:
+            err_file.seek(0)
+
+            return (f"\tImporting {file_path} - Couldn't convert Shapefile to SQL\n"
+                    f"shp2pgsql result was: {err_file.read().decode('utf-8', errors='replace')}")
+
+    # add the spatial index now the data's in (faster than updating it row by row) & cluster the table on it
+    if delete_table and spatial:
         try:
-            pg_cur.execute(sql)
+            pg_cur.execute(f"CREATE INDEX {pg_table}_geom_idx ON {pg_schema}.{pg_table} USING gist (geom)")
+            pg_cur.execute(f"ALTER TABLE {pg_schema}.{pg_table} CLUSTER ON {pg_table}_geom_idx")
         except:
-            return f"\tImporting {pg_table} - Couldn't cluster on spatial index"
+            if pg_cur.connection.broken:
+                raise
+
+            return f"\tImporting {pg_table} - Couldn't create & cluster on spatial index"
+
+    pg_cur.execute(f"ANALYZE {pg_schema}.{pg_table}")
 
     return "SUCCESS"
 